@@ -0,0 +1,206 @@
+"""Проверка очереди задач без внешних сервисов.
+
+Один и тот же сценарий (аренда, её истечение, повтор после ошибки,
+исчерпание попыток) прогоняется на SQLiteJobStore и на RedisJobStore
+поверх MemoryRedis — словарной заглушки тех команд Redis, что использует
+очередь:
+
+    python -m bench.jobqueue
+"""
+import asyncio
+import bisect
+import os
+import shutil
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEASE = 1
+
+
+# --- ЗАГЛУШКА REDIS ---
+
+class MemoryRedis:
+    """Клиент redis.asyncio с decode_responses=True, но в памяти процесса.
+
+    Реализованы только команды из RedisJobStore; TTL (``expire``) не моделируется.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def _get(self, name, kind):
+        return self.data.setdefault(name, kind())
+
+    async def incr(self, name):
+        value = int(self.data.get(name, 0)) + 1
+        self.data[name] = str(value)
+        return value
+
+    async def delete(self, *names):
+        return sum(self.data.pop(n, None) is not None for n in names)
+
+    async def expire(self, name, seconds):
+        return name in self.data
+
+    # Хеши
+
+    async def hset(self, name, mapping):
+        h = self._get(name, dict)
+        added = sum(k not in h for k in mapping)
+        h.update({k: str(v) for k, v in mapping.items()})
+        return added
+
+    async def hget(self, name, key):
+        return self.data.get(name, {}).get(key)
+
+    async def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    async def hincrby(self, name, key, amount=1):
+        h = self._get(name, dict)
+        h[key] = str(int(h.get(key, 0)) + amount)
+        return int(h[key])
+
+    # Списки: индекс 0 — левый край
+
+    async def lpush(self, name, *values):
+        items = self._get(name, list)
+        for v in values:
+            items.insert(0, str(v))
+        return len(items)
+
+    async def rpop(self, name):
+        items = self.data.get(name)
+        return items.pop() if items else None
+
+    async def lmove(self, src, dst, where_from, where_to):
+        items = self.data.get(src)
+        if not items:
+            return None
+        value = items.pop() if where_from == "RIGHT" else items.pop(0)
+        target = self._get(dst, list)
+        target.insert(0, value) if where_to == "LEFT" else target.append(value)
+        return value
+
+    async def lrem(self, name, count, value):
+        items = self.data.get(name, [])
+        removed = 0
+        while value in items and (count == 0 or removed < count):
+            items.remove(value)
+            removed += 1
+        return removed
+
+    async def lrange(self, name, start, end):
+        items = self.data.get(name, [])
+        return list(items[start:] if end == -1 else items[start:end + 1])
+
+    async def llen(self, name):
+        return len(self.data.get(name, []))
+
+    # Сортированные множества
+
+    async def zadd(self, name, mapping, nx=False, xx=False, ch=False):
+        z = self._get(name, dict)
+        added = changed = 0
+        for member, score in mapping.items():
+            exists = member in z
+            if (nx and exists) or (xx and not exists):
+                continue
+            if not exists:
+                added += 1
+            elif z[member] != score:
+                changed += 1
+            z[member] = float(score)
+        return added + changed if ch else added
+
+    async def zrem(self, name, *members):
+        z = self.data.get(name, {})
+        return sum(z.pop(m, None) is not None for m in members)
+
+    async def zscore(self, name, member):
+        return self.data.get(name, {}).get(member)
+
+    async def zcard(self, name):
+        return len(self.data.get(name, {}))
+
+    async def zrangebyscore(self, name, low, high):
+        ordered = sorted((score, member) for member, score in self.data.get(name, {}).items())
+        scores = [score for score, _ in ordered]
+        return [member for _, member in ordered[bisect.bisect_left(scores, low):bisect.bisect_right(scores, high)]]
+
+    async def aclose(self):
+        pass
+
+
+# --- СЦЕНАРИЙ ---
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+async def scenario(store):
+    # Аренда истекла — задачу забирает другой воркер, опоздавший ничего не может записать
+    job_id = await store.enqueue({"url": "https://example.com/a"}, 1)
+    job = await store.claim("a", LEASE)
+    check(job and job.id == job_id and job.attempts == 1, f"первая выдача: {job}")
+    check(await store.claim("b", LEASE) is None, "задача в аренде выдана второй раз")
+    check(await store.extend(job_id, "a", LEASE), "владелец не продлил аренду")
+    await asyncio.sleep(LEASE + 0.2)
+    job = await store.claim("b", LEASE)
+    check(job and job.id == job_id and job.attempts == 2, f"после истечения аренды: {job}")
+    check(not await store.extend(job_id, "a", LEASE), "прежний владелец продлил чужую аренду")
+    check(not await store.complete(job_id, "a", {"file": "old"}), "прежний владелец завершил чужую задачу")
+    check(await store.complete(job_id, "b", {"file": "new"}), "новый владелец не завершил задачу")
+    results = await store.take_results()
+    check([(r.id, r.result) for r in results] == [(job_id, {"file": "new"})], f"результаты: {results}")
+    check(await store.take_results() == [], "результат выдан дважды")
+
+    # Ошибка с повтором возвращает задачу в очередь
+    job_id = await store.enqueue({"url": "https://example.com/b"}, 0)
+    job = await store.claim("a", LEASE)
+    check(await store.fail(job.id, "a", "boom", 0), "задача не вернулась в очередь после ошибки")
+    job = await store.claim("b", LEASE)
+    check(job and job.id == job_id and job.attempts == 2, f"повтор после ошибки: {job}")
+
+    # Последняя попытка пропала вместе с воркером — задача больше не выдаётся
+    await asyncio.sleep(LEASE + 0.2)
+    check(await store.claim("c", LEASE) is None, "задача выдана сверх max_attempts")
+    check(not await store.complete(job_id, "b", {}), "задача с истёкшими попытками завершена")
+
+
+async def main():
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from src.db import init_db
+    from src.services.jobqueue import SQLiteJobStore, RedisJobStore
+
+    # db.py открывает data/users.db относительно текущего каталога
+    workdir = tempfile.mkdtemp(prefix="sdbot-jobqueue-")
+    os.chdir(workdir)
+    os.makedirs("data")
+    init_db()
+
+    stores = {
+        "sqlite": SQLiteJobStore(max_attempts=2),
+        "redis (в памяти)": RedisJobStore(MemoryRedis(), max_attempts=2),
+    }
+    failed = False
+    try:
+        for name, store in stores.items():
+            try:
+                await scenario(store)
+                print(f"{name}: ok")
+            except AssertionError as e:
+                failed = True
+                print(f"{name}: ОШИБКА — {e}")
+            finally:
+                await store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(main()) else 0)
@@ -0,0 +1,55 @@
+import os
+import subprocess
+
+# Тестовые файлы: разные кодеки, контейнеры и расположение moov.
+# name -> (имя файла, длительность, размер кадра, аргументы ffmpeg)
+CASES = {
+    "h264_faststart": ("h264_faststart.mp4", 10, "1280x720",
+                       ["-c:v", "libx264", "-preset", "veryfast", "-b:v", "3M", "-pix_fmt", "yuv420p",
+                        "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart"]),
+    "h264_moov_end": ("h264_moov_end.mp4", 10, "1280x720",
+                      ["-c:v", "libx264", "-preset", "veryfast", "-b:v", "3M", "-pix_fmt", "yuv420p",
+                       "-c:a", "aac", "-b:a", "128k"]),
+    "hevc_mkv": ("hevc.mkv", 10, "1280x720",
+                 ["-c:v", "libx265", "-preset", "ultrafast", "-b:v", "2M", "-pix_fmt", "yuv420p",
+                  "-c:a", "aac", "-b:a", "128k"]),
+    "vp9_webm": ("vp9.webm", 10, "854x480",
+                 ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-b:v", "1M",
+                  "-c:a", "libopus", "-b:a", "96k"]),
+    "h264_1080p_long": ("h264_1080p_long.mp4", 30, "1920x1080",
+                        ["-c:v", "libx264", "-preset", "veryfast", "-b:v", "6M", "-pix_fmt", "yuv420p",
+                         "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart"]),
+}
+
+# Звуковая дорожка, которую отдаёт поддельный tikwm в ответ на запрос музыки
+MUSIC_FILE = "music.mp3"
+
+
+def generate(media_dir: str, names, quick: bool = False):
+    """Создаёт недостающие файлы и возвращает {name: путь}. Готовые файлы переиспользуются."""
+    os.makedirs(media_dir, exist_ok=True)
+    paths = {}
+    for name in names:
+        filename, duration, size, args = CASES[name]
+        if quick:
+            duration = min(duration, 3)
+            filename = "quick_" + filename
+        path = os.path.join(media_dir, filename)
+        if not os.path.exists(path):
+            # Шум в кадре, чтобы кодеку было что сжимать, как в настоящем видео
+            _ffmpeg(["-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30",
+                     "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+                     "-vf", "noise=alls=12:allf=t", "-t", str(duration), *args, path])
+        paths[name] = path
+
+    music = os.path.join(media_dir, MUSIC_FILE)
+    if not os.path.exists(music):
+        _ffmpeg(["-f", "lavfi", "-i", "sine=frequency=330:sample_rate=44100", "-t", "30",
+                 "-c:a", "libmp3lame", "-b:a", "128k", music])
+    return paths
+
+
+def _ffmpeg(args):
+    tmp_out = args[-1] + ".tmp" + os.path.splitext(args[-1])[1]
+    subprocess.run(["ffmpeg", "-v", "error", "-y", *args[:-1], tmp_out], check=True)
+    os.replace(tmp_out, args[-1])
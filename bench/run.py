@@ -0,0 +1,375 @@
+"""Офлайн-бенчмарк конвейера загрузки.
+
+Источники видео и tikwm подменяются локальным сервером (bench/server.py),
+Telegram — заглушкой, которая принимает части файла и считает байты.
+Для каждого этапа пишутся время, CPU (свой процесс и дочерние ffmpeg),
+пиковая RSS и объём записанного, результат — JSON для сравнения коммитов:
+
+    python -m bench.run --output before.json
+    python -m bench.run --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench.media import CASES, generate
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO_FORMATS = ("mp3", "m4a", "opus")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# --- ЗАМЕРЫ ---
+
+def _rss(pid) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _children(exclude):
+    # Живые дочерние процессы (ffmpeg) по /proc/*/stat
+    me = os.getpid()
+    result = []
+    try:
+        pids = [p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return result
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == me and int(pid) not in exclude:
+            result.append(pid)
+    return result
+
+
+class Meter:
+    """Время, CPU и пиковая RSS одного этапа.
+
+    RSS считается как сумма своего процесса и живых дочерних, опрос раз в
+    ``interval`` секунд. CPU дочерних учитывается после их завершения.
+    """
+
+    def __init__(self, exclude_pids=(), interval: float = 0.05):
+        self.exclude = set(exclude_pids)
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = _rss("self") + sum(_rss(pid) for pid in _children(self.exclude))
+            self.peak_rss = max(self.peak_rss, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._child_cpu = usage.ru_utime + usage.ru_stime
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = time.process_time() - self._cpu
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.child_cpu = usage.ru_utime + usage.ru_stime - self._child_cpu
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+# --- ЗАГЛУШКА TELEGRAM ---
+
+class FakeTelegramClient:
+    """Принимает SaveFilePartRequest / SaveBigFilePartRequest, как сервер Telegram."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.bytes = 0
+
+    async def __call__(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.bytes += len(request.bytes)
+        return True
+
+
+# --- ПРОГОН ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(media_dir, port):
+    proc = subprocess.Popen([sys.executable, "-m", "bench.server", "--root", media_dir, "--port", str(port)],
+                            cwd=REPO_ROOT)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("bench server did not start")
+
+
+def _size(path) -> int:
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+class Bench:
+    def __init__(self, args, base_url, server_pid, workdir):
+        from src.services.downloader import VideoDownloader
+        from src.services.scheduler import JobScheduler
+        from src.services.storage import StorageManager
+        from src.services.uploader import ParallelUploader
+        from src.config import conf
+
+        self.args = args
+        self.base_url = base_url
+        self.server_pid = server_pid
+        self.workdir = workdir
+        self.conf = conf
+        self.storage = StorageManager(os.path.join(workdir, "downloads"), quota=1 << 40, min_free=0)
+        self.scheduler = JobScheduler(conf.network_limit, conf.transcode_limit, conf.upload_limit)
+        self.make_downloader = lambda: VideoDownloader(self.scheduler, self.storage)
+        self.telegram = FakeTelegramClient(args.upload_latency / 1000)
+        self.uploader = ParallelUploader(self.telegram, workers=conf.upload_workers)
+        self.results = []
+
+    async def measure(self, case, stage, repeat, func):
+        meter = Meter(exclude_pids=[self.server_pid])
+        error = None
+        with meter:
+            try:
+                output = await func()
+            except Exception as e:
+                output, error = None, f"{type(e).__name__}: {e}"[:300]
+        record = {
+            "case": case, "stage": stage, "repeat": repeat,
+            "wall_s": round(meter.wall, 4), "cpu_s": round(meter.cpu, 4),
+            "child_cpu_s": round(meter.child_cpu, 4), "peak_rss_mb": round(meter.peak_rss / 2 ** 20, 1),
+            "bytes_written": output[1] if output else 0,
+        }
+        if error:
+            record["error"] = error
+        self.results.append(record)
+        print(f"  {case:<18} {stage:<18} {record['wall_s']:>8.3f}s  cpu {record['cpu_s']:>7.3f}s"
+              f"  ffmpeg {record['child_cpu_s']:>7.3f}s  rss {record['peak_rss_mb']:>7.1f}MB"
+              f"  {record['bytes_written'] / 2 ** 20:>8.2f}MB" + (f"  ERROR {error}" if error else ""))
+        return output[0] if output else None
+
+    def _copy(self, path):
+        # Обработка удаляет исходник, поэтому каждый прогон получает свою копию
+        stage_dir = os.path.join(self.workdir, "stage")
+        os.makedirs(stage_dir, exist_ok=True)
+        dst = os.path.join(stage_dir, "raw_" + os.path.basename(path))
+        shutil.copyfile(path, dst)
+        return dst
+
+    async def run_case(self, case, path, repeat):
+        url = f"{self.base_url}/media/{os.path.basename(path)}"
+        downloader = self.make_downloader()
+
+        # Как в боте: сначала превью (extract), затем загрузка с переиспользованием info
+        async def info():
+            return await downloader.get_video_info(url), 0
+        await self.measure(case, "info", repeat, info)
+
+        async def download():
+            res = await downloader.download(url)
+            return res, res.file_size
+        res = await self.measure(case, "download", repeat, download)
+
+        if res is not None:
+            async def upload():
+                before = self.telegram.bytes
+                await self.uploader.upload(res.path)
+                return None, self.telegram.bytes - before
+            await self.measure(case, "upload", repeat, upload)
+            downloader.release(res)
+
+        src = self._copy(path)
+        async def process_video():
+            out = await downloader._process_video(src, CASES[case][1])
+            return out, _size(out)
+        out = await self.measure(case, "process_video", repeat, process_video)
+        for leftover in (src, out):
+            if leftover and os.path.exists(leftover):
+                os.remove(leftover)
+
+    async def run_audio(self, case, path, repeat):
+        downloader = self.make_downloader()
+        for fmt in AUDIO_FORMATS:
+            src = self._copy(path)
+            async def process_audio():
+                out = await downloader._process_audio(src, CASES[case][1], None, fmt)
+                return out, _size(out)
+            out = await self.measure(case, f"process_audio_{fmt}", repeat, process_audio)
+            for leftover in (src, out):
+                if leftover and os.path.exists(leftover):
+                    os.remove(leftover)
+
+    async def run_tikwm(self, case, path, repeat):
+        downloader = self.make_downloader()
+        url = f"https://www.tiktok.com/@bench/video/{os.path.basename(path)}"
+        for mode, quality in (("video", None), ("audio", "mp3")):
+            async def download():
+                res = await downloader.download(url, mode=mode, quality=quality)
+                if res.extractor != "tikwm":
+                    raise RuntimeError("fake tikwm was not used")
+                return res, res.file_size
+            res = await self.measure(case, f"tikwm_{mode}", repeat, download)
+            if res is not None:
+                downloader.release(res)
+
+    async def run(self, paths):
+        from src.services.http import close_session
+        try:
+            for repeat in range(self.args.repeat):
+                print(f"repeat {repeat + 1}/{self.args.repeat}")
+                for case, path in paths.items():
+                    await self.run_case(case, path, repeat)
+                first = next(iter(paths))
+                await self.run_audio(first, paths[first], repeat)
+                await self.run_tikwm(first, paths[first], repeat)
+        finally:
+            await close_session()
+
+
+# --- ОТЧЁТ ---
+
+def summarize(results):
+    groups = {}
+    for r in results:
+        if "error" not in r:
+            groups.setdefault((r["case"], r["stage"]), []).append(r)
+    summary = []
+    for (case, stage), items in groups.items():
+        row = {"case": case, "stage": stage, "runs": len(items)}
+        for field in ("wall_s", "cpu_s", "child_cpu_s", "peak_rss_mb", "bytes_written"):
+            row[field] = statistics.median(i[field] for i in items)
+        summary.append(row)
+    return summary
+
+
+def compare(summary, baseline_path):
+    with open(baseline_path) as f:
+        base = {(r["case"], r["stage"]): r for r in json.load(f)["summary"]}
+    print(f"\nСравнение с {baseline_path} (медианы, отрицательное — быстрее):")
+    for row in summary:
+        old = base.get((row["case"], row["stage"]))
+        if not old:
+            continue
+        parts = []
+        for field in ("wall_s", "cpu_s", "child_cpu_s", "peak_rss_mb"):
+            if old[field]:
+                parts.append(f"{field} {100 * (row[field] - old[field]) / old[field]:+6.1f}%")
+        print(f"  {row['case']:<18} {row['stage']:<18} " + "  ".join(parts))
+
+
+def _meta(args):
+    def run(cmd):
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True, cwd=REPO_ROOT).stdout.strip()
+        except OSError:
+            return ""
+    return {
+        "commit": run(["git", "rev-parse", "HEAD"]),
+        "dirty": bool(run(["git", "status", "--porcelain", "--untracked-files=no"])),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": run(["ffmpeg", "-version"]).split("\n", 1)[0],
+        "ffprobe": bool(shutil.which("ffprobe")),
+        "quick": args.quick,
+        "repeat": args.repeat,
+        "upload_latency_ms": args.upload_latency,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the download pipeline")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma-separated, default: all")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="3-second clips instead of full length")
+    parser.add_argument("--upload-latency", type=float, default=0, help="fake Telegram latency per part, ms")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "sdbot-bench"))
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="earlier JSON result to compare with")
+    args = parser.parse_args()
+
+    names = [c for c in args.cases.split(",") if c]
+    unknown = set(names) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    media_dir = os.path.join(args.workdir, "media")
+    print("Готовлю тестовые файлы...")
+    paths = generate(media_dir, names, args.quick)
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    # Конфиг бота требует токены, для бенчмарка подходят любые
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "bench")
+    os.environ["TIKWM_API_URL"] = f"{base_url}/tikwm/api/"
+    output = os.path.abspath(args.output)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    # config.py создаёт data/ и downloads/ в текущем каталоге — пусть это будет рабочий каталог бенчмарка
+    run_dir = os.path.join(args.workdir, "run")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    os.chdir(run_dir)
+
+    server = _start_server(media_dir, port)
+    try:
+        bench = Bench(args, base_url, server.pid, run_dir)
+        asyncio.run(bench.run(paths))
+    finally:
+        server.terminate()
+        server.wait()
+
+    from src.services.probe import decisions, audio_decisions
+    summary = summarize(bench.results)
+    report = {"meta": _meta(args), "decisions": dict(decisions), "audio_decisions": dict(audio_decisions),
+              "summary": summary, "results": bench.results}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nРезультат: {output}")
+    if compare_path:
+        compare(summary, compare_path)
+    if any("error" in r for r in bench.results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
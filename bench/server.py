@@ -0,0 +1,50 @@
+"""Локальные заменители источников: раздача файлов и поддельный API tikwm.
+
+Запускается отдельным процессом, чтобы его CPU и память не попадали в замеры:
+
+    python -m bench.server --root /tmp/sdbot-bench/media --port 8790
+"""
+import argparse
+import os
+from aiohttp import web
+
+from bench.media import MUSIC_FILE
+
+
+def make_app(root: str) -> web.Application:
+    async def tikwm(request):
+        # Ссылка вида https://www.tiktok.com/@bench/video/<имя файла>
+        form = await request.post()
+        name = str(form.get("url", "")).rstrip("/").rsplit("/", 1)[-1]
+        if not name or not os.path.exists(os.path.join(root, name)):
+            return web.json_response({"code": -1, "msg": "Url parsing is failed!"})
+        base = f"{request.scheme}://{request.host}/media"
+        return web.json_response({"code": 0, "msg": "success", "data": {
+            "title": f"bench {name}",
+            "duration": 10,
+            "width": 1280,
+            "height": 720,
+            "cover": "",
+            "play": f"{base}/{name}",
+            "music": f"{base}/{MUSIC_FILE}",
+            "music_info": {"duration": 30},
+            "author": {"nickname": "bench"},
+        }})
+
+    app = web.Application()
+    app.router.add_post("/tikwm/api/", tikwm)
+    app.router.add_static("/media", root, show_index=False)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    args = parser.parse_args()
+    web.run_app(make_app(args.root), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
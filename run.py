@@ -1,12 +1,21 @@
+from src.services.startup import STARTUP # Первым: отсчёт времени запуска
+import sys
 import asyncio
 import logging
-from src.bot import start_bot
 
 # Настройка логирования (чтобы видеть ошибки в консоли)
 logging.basicConfig(level=logging.INFO)
 
 if __name__ == "__main__":
     try:
-        asyncio.run(start_bot())
+        if sys.argv[1:2] == ["worker"]:
+            # python run.py worker — отдельный процесс, который только качает и отправляет
+            from src.worker import start_worker
+            STARTUP.mark("import")
+            asyncio.run(start_worker())
+        else:
+            from src.bot import start_bot
+            STARTUP.mark("import")
+            asyncio.run(start_bot())
     except KeyboardInterrupt:
         print("🛑 Бот остановлен!")
@@ -1,27 +1,81 @@
+import asyncio
 from aiogram import Bot, Dispatcher
 from src.config import conf
-from src.db import init_db
+from src.db import init_db, close_db, write_behind_loop
+from src.services.http import close_session
+from src.services.metrics import Gauge, start_metrics_server
+from src.services.startup import STARTUP
+from src.services.webhook import WebhookServer
 from src.handlers.common import common_router
-from src.handlers.video import video_router, tele_client # Импортируем tele_client
+from src.handlers.video import video_router, tele_client, broadcaster, storage, job_store, collect_results, downloader, journal, resume_jobs, active_jobs, drain_jobs # Импортируем tele_client
+
+Gauge("bot_startup_seconds", "Time spent in each startup phase", ("phase",), func=STARTUP.as_dict)
 
 async def start_bot():
+    # Прогрев yt-dlp идёт в потоке, пока бот подключается к Telegram
+    warm_task = asyncio.create_task(downloader.warm())
     init_db()
+    flush_task = asyncio.create_task(write_behind_loop(conf.db_flush_interval))
+    # Из оставшегося от прошлого запуска нужны только файлы прерванных загрузок — их докачаем
+    unfinished = await journal.unfinished()
+    storage.reap(keep=set().union(*(entry.workspace_ids() for entry in unfinished)))
+    reap_task = asyncio.create_task(storage.reap_loop(conf.reap_interval))
+    # Загрузки идут в воркерах, бот только забирает их результаты
+    collect_task = asyncio.create_task(collect_results()) if job_store is not None else None
+    metrics_runner = None
+    if conf.metrics_port:
+        # Только на локальном адресе по умолчанию: метрики не для посторонних
+        metrics_runner = await start_metrics_server(conf.metrics_host, conf.metrics_port)
+    STARTUP.mark("db + storage")
     
     # --- ЗАПУСК TELETHON ---
     print("🚀 Запуск Telethon клиента...")
     await tele_client.start(bot_token=conf.bot_token)
+    STARTUP.mark("telethon")
     
     bot = Bot(token=conf.bot_token)
     dp = Dispatcher()
     
     dp.include_router(common_router)
     dp.include_router(video_router)
+    STARTUP.mark("dispatcher")
+    await resume_jobs(bot, unfinished)
     
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        print("🤖 Бот запущен и готов к работе!")
-        await dp.start_polling(bot)
+        # chat_member приходит только если явно запросить его в allowed_updates
+        allowed_updates = dp.resolve_used_update_types()
+        if conf.bot_mode == "webhook":
+            await broadcaster.resume_all(bot) # Досылаем рассылки, прерванные перезапуском
+            STARTUP.mark("telegram")
+            STARTUP.report()
+            print("🤖 Бот запущен в режиме webhook!")
+            server = WebhookServer(dp, bot, conf.webhook_secret, conf.webhook_path,
+                                   max_concurrency=conf.webhook_concurrency, drain_timeout=conf.drain_timeout,
+                                   jobs=active_jobs)
+            await server.serve(conf.webhook_host, conf.webhook_port, conf.webhook_url,
+                               allowed_updates, conf.webhook_max_connections)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await broadcaster.resume_all(bot) # Досылаем рассылки, прерванные перезапуском
+            STARTUP.mark("telegram")
+            STARTUP.report()
+            print("🤖 Бот запущен и готов к работе!")
+            # Сессию закрываем сами: начатым загрузкам она ещё нужна для правки статусов
+            await dp.start_polling(bot, allowed_updates=allowed_updates, close_bot_session=False)
     finally:
+        # Polling остановлен (в режиме webhook всё уже дождался сервер) — даём загрузкам доработать
+        await drain_jobs(conf.drain_timeout)
         print("🛑 Остановка клиента...")
         await tele_client.disconnect() # Отключаем Telethon
+        warm_task.cancel()
+        downloader.close() # Сохраняет cookies, как раньше при выходе из YoutubeDL
+        await close_session()
+        flush_task.cancel()
+        reap_task.cancel()
+        if collect_task:
+            collect_task.cancel()
+            await job_store.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        close_db() # Сбрасываем накопленную статистику
         await bot.session.close()
@@ -1,4 +1,5 @@
 import os
+import socket
 from dataclasses import dataclass
 from dotenv import load_dotenv
 
@@ -15,6 +16,69 @@ class Config:
     admin_id: str  # Добавь это поле
     api_id: int
     api_hash: str
+    file_cache_ttl: int  # Сколько секунд хранить file_id отправленных файлов
+    file_cache_max: int  # Максимум записей в кеше file_id
+    network_limit: int  # Сколько загрузок идёт одновременно
+    transcode_limit: int  # Сколько ffmpeg запускается одновременно
+    upload_limit: int  # Сколько файлов одновременно отправляется в Telegram
+    short_clip_seconds: int  # Ролики короче этого идут в очереди раньше
+    transcode_cores: int  # Сколько ядер можно отдать под ffmpeg
+    ffmpeg_threads: int  # Потоков на один процесс ffmpeg
+    ffmpeg_timeout: int  # Максимальное время работы ffmpeg, сек
+    info_cache_size: int  # Сколько результатов анализа ссылок держать в памяти
+    info_cache_ttl: int  # Сколько секунд они действительны
+    http_pool_size: int  # Всего соединений в общей aiohttp-сессии
+    http_pool_per_host: int  # Соединений на один хост
+    stream_max_size: int  # Максимальный размер файла при прямой загрузке, байт
+    db_flush_interval: int  # Как часто сбрасывать накопленную статистику в базу, сек
+    broadcast_rate: float  # Сообщений в секунду при рассылке (лимит Telegram ~30)
+    broadcast_workers: int  # Сколько сообщений рассылки отправляется параллельно
+    sub_positive_ttl: int  # Сколько секунд доверять ответу «подписан»
+    sub_negative_ttl: int  # Сколько секунд доверять ответу «не подписан»
+    upload_workers: int  # Сколько частей файла отправляется в Telegram одновременно
+    pipelined_upload: bool  # Начинать отправку, пока ffmpeg ещё пишет файл
+    progress_interval: float  # Не чаще раза в N секунд прогресс задачи попадает в цикл событий
+    edit_interval: float  # Пауза между правками статуса в одном чате, сек
+    edit_rate: float  # Правок статусных сообщений в секунду на всего бота
+    storage_quota: int  # Сколько байт могут занимать временные файлы загрузок
+    storage_min_free: int  # Сколько байт оставлять свободными на диске
+    storage_wait: int  # Сколько секунд задача ждёт места, прежде чем получить отказ
+    staging_path: str  # RAM-каталог (tmpfs) для небольших задач, пусто — не использовать
+    staging_quota: int  # Объём RAM-каталога, байт
+    staging_max_job: int  # Задачи не больше этого размера идут в RAM-каталог, байт
+    orphan_age: int  # Ничейные файлы старше N секунд удаляются
+    reap_interval: int  # Как часто искать ничейные файлы, сек
+    metrics_host: str  # Адрес для /metrics (Prometheus)
+    metrics_port: int  # Порт для /metrics, 0 — не запускать
+    tikwm_api_url: str  # Адрес API tikwm (подменяется в бенчмарке)
+    bot_mode: str  # polling или webhook
+    webhook_url: str  # Публичный адрес, на который Telegram шлёт обновления; пусто — не регистрировать
+    webhook_path: str  # Путь обработчика webhook
+    webhook_secret: str  # Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+    webhook_host: str  # Где слушать webhook
+    webhook_port: int
+    webhook_concurrency: int  # Сколько обновлений обрабатывается одновременно
+    webhook_max_connections: int  # Сколько соединений Telegram открывает к webhook
+    drain_timeout: int  # Сколько секунд при остановке ждать начатые загрузки
+    job_queue: str  # "" — качать в процессе бота, sqlite или redis — отдавать задачи воркерам
+    redis_url: str
+    redis_prefix: str  # Префикс ключей очереди в Redis
+    job_lease: int  # На сколько секунд воркер берёт задачу, аренда продлевается каждые job_lease / 3
+    job_max_attempts: int  # Сколько раз пробовать задачу, прежде чем сдаться
+    job_retry_delay: int  # Пауза перед повтором, сек (умножается на номер попытки)
+    worker_concurrency: int  # Сколько задач воркер ведёт одновременно
+    worker_id: str  # Имя воркера в очереди
+    ydl_pool_size: int  # Сколько готовых YoutubeDL держать на каждый набор настроек
+    batch_max_links: int  # Сколько ссылок из одного сообщения обрабатывать пачкой
+    journal_max_age: int  # Задачи старше этого (сек) после перезапуска не продолжаются
+    host_limits: dict  # Одновременных запросов к платформе: {"instagram": 2, ...}; остальным — network_limit
+    host_breaker_threshold: int  # Отказов подряд (429, стена входа), после которых платформа встаёт на паузу
+    host_backoff: int  # Первая пауза, сек; дальше удваивается
+    host_backoff_max: int  # Самая длинная пауза, сек
+    cookies_dir: str  # Каталог с cookies: instagram.txt, instagram_2.txt, youtube.txt ...
+    cookie_cooldown: int  # Сколько секунд не использовать cookies после стены входа
+    thumb_path: str  # Каталог готовых обложек 320px
+    thumb_cache_max: int  # Сколько обложек хранить на диске
 
 # Проверка токена
 token = os.getenv("BOT_TOKEN")
@@ -32,6 +96,29 @@ api_hash = os.getenv("API_HASH")
 if not raw_api_id or not api_hash:
     raise ValueError("API_ID или API_HASH не найдены в .env файле!")
 
+bot_mode = os.getenv("BOT_MODE", "polling")
+if bot_mode not in ("polling", "webhook"):
+    raise ValueError("BOT_MODE должен быть polling или webhook!")
+if bot_mode == "webhook" and not os.getenv("WEBHOOK_SECRET"):
+    # Без секрета кто угодно сможет слать боту поддельные обновления
+    raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_SECRET в .env файле!")
+
+job_queue = os.getenv("JOB_QUEUE", "")
+if job_queue not in ("", "sqlite", "redis"):
+    raise ValueError("JOB_QUEUE должен быть пустым, sqlite или redis!")
+
+def parse_limits(raw: str) -> dict:
+    # "instagram=2,youtube=3" -> {"instagram": 2, "youtube": 3}
+    limits = {}
+    for part in raw.split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition("=")
+        if not value.strip().isdigit():
+            raise ValueError(f"HOST_LIMITS: не понял «{part.strip()}», нужно имя=число")
+        limits[name.strip().lower()] = int(value)
+    return limits
+
 conf = Config(
     bot_token=token,
     download_path=os.path.join(os.getcwd(), "downloads"),
@@ -40,7 +127,70 @@ conf = Config(
     channel_url=os.getenv("CHANNEL_URL"), # Просто берем из .env
     admin_id=os.getenv("ADMIN_ID"),
     api_id=int(os.getenv("API_ID")),
-    api_hash=os.getenv("API_HASH")
+    api_hash=os.getenv("API_HASH"),
+    file_cache_ttl=int(os.getenv("FILE_CACHE_TTL", 7 * 24 * 3600)),
+    file_cache_max=int(os.getenv("FILE_CACHE_MAX", 10000)),
+    network_limit=int(os.getenv("NETWORK_LIMIT", 6)),
+    transcode_limit=int(os.getenv("TRANSCODE_LIMIT", max(1, (os.cpu_count() or 2) // 2))),
+    upload_limit=int(os.getenv("UPLOAD_LIMIT", 3)),
+    short_clip_seconds=int(os.getenv("SHORT_CLIP_SECONDS", 90)),
+    transcode_cores=int(os.getenv("TRANSCODE_CORES", os.cpu_count() or 2)),
+    ffmpeg_threads=int(os.getenv("FFMPEG_THREADS", 2)),
+    ffmpeg_timeout=int(os.getenv("FFMPEG_TIMEOUT", 900)),
+    info_cache_size=int(os.getenv("INFO_CACHE_SIZE", 512)),
+    info_cache_ttl=int(os.getenv("INFO_CACHE_TTL", 600)),
+    http_pool_size=int(os.getenv("HTTP_POOL_SIZE", 100)),
+    http_pool_per_host=int(os.getenv("HTTP_POOL_PER_HOST", 20)),
+    stream_max_size=int(os.getenv("STREAM_MAX_SIZE", 1980 * 1024 * 1024)),
+    db_flush_interval=int(os.getenv("DB_FLUSH_INTERVAL", 5)),
+    broadcast_rate=float(os.getenv("BROADCAST_RATE", 25)),
+    broadcast_workers=int(os.getenv("BROADCAST_WORKERS", 10)),
+    sub_positive_ttl=int(os.getenv("SUB_POSITIVE_TTL", 6 * 3600)),
+    sub_negative_ttl=int(os.getenv("SUB_NEGATIVE_TTL", 30)),
+    upload_workers=int(os.getenv("UPLOAD_WORKERS", 4)),
+    pipelined_upload=os.getenv("PIPELINED_UPLOAD", "1") == "1",
+    progress_interval=float(os.getenv("PROGRESS_INTERVAL", 1)),
+    edit_interval=float(os.getenv("EDIT_INTERVAL", 3)),
+    edit_rate=float(os.getenv("EDIT_RATE", 20)),
+    storage_quota=int(os.getenv("STORAGE_QUOTA_MB", 20000)) * 1024 * 1024,
+    storage_min_free=int(os.getenv("STORAGE_MIN_FREE_MB", 1024)) * 1024 * 1024,
+    storage_wait=int(os.getenv("STORAGE_WAIT", 300)),
+    staging_path=os.getenv("STAGING_PATH", ""),
+    staging_quota=int(os.getenv("STAGING_QUOTA_MB", 512)) * 1024 * 1024,
+    staging_max_job=int(os.getenv("STAGING_MAX_JOB_MB", 64)) * 1024 * 1024,
+    orphan_age=int(os.getenv("ORPHAN_AGE", 3 * 3600)),
+    reap_interval=int(os.getenv("REAP_INTERVAL", 600)),
+    metrics_host=os.getenv("METRICS_HOST", "127.0.0.1"),
+    metrics_port=int(os.getenv("METRICS_PORT", 0)),
+    tikwm_api_url=os.getenv("TIKWM_API_URL", "https://www.tikwm.com/api/"),
+    bot_mode=bot_mode,
+    webhook_url=os.getenv("WEBHOOK_URL", ""),
+    webhook_path=os.getenv("WEBHOOK_PATH", "/webhook"),
+    webhook_secret=os.getenv("WEBHOOK_SECRET", ""),
+    webhook_host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+    webhook_port=int(os.getenv("WEBHOOK_PORT", 8080)),
+    webhook_concurrency=int(os.getenv("WEBHOOK_CONCURRENCY", 256)),
+    webhook_max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40)),
+    drain_timeout=int(os.getenv("DRAIN_TIMEOUT", 60)),
+    job_queue=job_queue,
+    redis_url=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+    redis_prefix=os.getenv("REDIS_PREFIX", "sdbot"),
+    job_lease=int(os.getenv("JOB_LEASE", 60)),
+    job_max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", 3)),
+    job_retry_delay=int(os.getenv("JOB_RETRY_DELAY", 15)),
+    worker_concurrency=int(os.getenv("WORKER_CONCURRENCY", 2)),
+    worker_id=os.getenv("WORKER_ID", socket.gethostname()),  # Постоянный: по нему воркер находит свои файлы
+    ydl_pool_size=int(os.getenv("YDL_POOL_SIZE", 4)),
+    batch_max_links=int(os.getenv("BATCH_MAX_LINKS", 10)),
+    journal_max_age=int(os.getenv("JOURNAL_MAX_AGE", 3600)),
+    host_limits=parse_limits(os.getenv("HOST_LIMITS", "instagram=2,youtube=3")),
+    host_breaker_threshold=int(os.getenv("HOST_BREAKER_THRESHOLD", 3)),
+    host_backoff=int(os.getenv("HOST_BACKOFF", 30)),
+    host_backoff_max=int(os.getenv("HOST_BACKOFF_MAX", 900)),
+    cookies_dir=os.getenv("COOKIES_DIR", os.path.join(os.getcwd(), "cookies")),
+    cookie_cooldown=int(os.getenv("COOKIE_COOLDOWN", 1800)),
+    thumb_path=os.getenv("THUMB_PATH", os.path.join(os.getcwd(), "data", "thumbs")),
+    thumb_cache_max=int(os.getenv("THUMB_CACHE_MAX", 5000))
 )
 
 # Автосоздание папки data
@@ -1,13 +1,57 @@
+import asyncio
+import logging
 import sqlite3
 import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = "data/users.db"
 
-_lock = threading.Lock()
+_lock = threading.RLock()
+_conn = None
+
+# Все обращения к базе из асинхронного кода идут через один поток
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+# Буфер частых записей: сбрасывается пачкой по таймеру и при остановке
+_buffer_lock = threading.Lock()
+_pending_active = {}
+_pending_downloads = Counter()
+_pending_stats = Counter()  # (day, platform, lang) -> загрузок
+_pruned_day = None
+
+# Сутки и недели считаются по UTC; неделя начинается с понедельника (1970-01-01 — четверг)
+DAY = 86400
+# Сколько дней хранить отметки «пользователь был активен»: по ним считаются DAU и WAU
+ACTIVITY_RETENTION_DAYS = 60
+
+def day_of(ts):
+    return int(ts) // DAY
+
+def week_of(day):
+    return (day + 3) // 7
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        # Одно постоянное соединение; sqlite3 кеширует подготовленные запросы по тексту SQL
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("PRAGMA busy_timeout=5000")
+    return _conn
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
 
 def init_db():
     with _lock:
-        conn = sqlite3.connect(DB_PATH)
+        conn = _get_conn()
         cursor = conn.cursor()
 
         cursor.execute("""
@@ -21,81 +65,580 @@ def init_db():
             )
         """)
 
-        conn.commit()
-        conn.close()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS file_cache (
+                cache_key TEXT PRIMARY KEY,
+                media_id INTEGER NOT NULL,
+                access_hash INTEGER NOT NULL,
+                file_reference BLOB,
+                title TEXT,
+                created INTEGER NOT NULL,
+                last_used INTEGER NOT NULL,
+                hits INTEGER DEFAULT 0
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_cache_last_used ON file_cache (last_used)")
 
-def add_user(user_id, username, full_name, lang):
-    with _lock:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        # Миграция старых баз: отметка о том, что пользователь заблокировал бота
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(users)")]
+        if "blocked" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN blocked INTEGER DEFAULT 0")
+        # Когда пользователь пришёл; у старых записей неизвестно (0)
+        if "created" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN created INTEGER DEFAULT 0")
 
+        # Админка листает пользователей и топ по загрузкам без полного прохода по таблице
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_downloads ON users (downloads, id)")
+
+        # Агрегаты для статистики: обновляются вместе с исходными данными, читаются за O(1)
         cursor.execute("""
-            INSERT OR IGNORE INTO users (id, username, full_name, lang)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, username, full_name, lang))
+            CREATE TABLE IF NOT EXISTS stats_totals (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_daily (
+                day INTEGER PRIMARY KEY,
+                new_users INTEGER NOT NULL DEFAULT 0,
+                active_users INTEGER NOT NULL DEFAULT 0,
+                downloads INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_weekly (
+                week INTEGER PRIMARY KEY,
+                active_users INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_downloads (
+                day INTEGER NOT NULL,
+                platform TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, platform, lang)
+            ) WITHOUT ROWID
+        """)
+        # Кто уже учтён в активных за день и за неделю — чтобы каждый считался один раз
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_days (
+                day INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (day, user_id)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_weeks (
+                week INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (week, user_id)
+            ) WITHOUT ROWID
+        """)
+        # Первый запуск с агрегатами: итоги один раз берём из самой таблицы
+        cursor.execute("INSERT OR IGNORE INTO stats_totals (key, value) SELECT 'users', COUNT(*) FROM users")
+        cursor.execute("""
+            INSERT OR IGNORE INTO stats_totals (key, value) SELECT 'downloads', COALESCE(SUM(downloads), 0) FROM users
+        """)
 
-        conn.commit()
-        conn.close()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                from_chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                admin_chat_id INTEGER NOT NULL,
+                status_message_id INTEGER,
+                cursor INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                finished INTEGER DEFAULT 0,
+                started_at INTEGER NOT NULL
+            )
+        """)
 
-def update_last_active(user_id, timestamp):
-    with _lock:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                priority INTEGER DEFAULT 0,
+                state TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 3,
+                worker TEXT,
+                lease_until REAL DEFAULT 0,
+                not_before REAL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (state, priority, id)")
 
+        # Журнал загрузок в процессе бота: что было начато и не доведено до конца
         cursor.execute("""
-            UPDATE users SET last_active = ? WHERE id = ?
-        """, (timestamp, user_id))
+            CREATE TABLE IF NOT EXISTS journal (
+                id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
 
         conn.commit()
-        conn.close()
 
-def increment_downloads(user_id):
+def close_db():
+    global _conn
+    flush_writes()
     with _lock:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        if _conn is not None:
+            _conn.close()
+            _conn = None
 
-        cursor.execute("""
-            UPDATE users SET downloads = downloads + 1 WHERE id = ?
-        """, (user_id,))
+def add_user(user_id, username, full_name, lang):
+    now = int(time.time())
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            cursor = conn.execute("""
+                INSERT OR IGNORE INTO users (id, username, full_name, lang, created)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, username, full_name, lang, now))
+            if cursor.rowcount:
+                conn.execute("UPDATE stats_totals SET value = value + 1 WHERE key = 'users'")
+                conn.execute("""
+                    INSERT INTO stats_daily (day, new_users) VALUES (?, 1)
+                    ON CONFLICT(day) DO UPDATE SET new_users = new_users + 1
+                """, (day_of(now),))
+            else:
+                # Повторный /start означает, что бот снова доступен пользователю
+                conn.execute("UPDATE users SET blocked = 0 WHERE id = ?", (user_id,))
+
+def update_last_active(user_id, timestamp):
+    # Только в память, в базу попадёт при ближайшем flush_writes()
+    with _buffer_lock:
+        if timestamp > _pending_active.get(user_id, 0):
+            _pending_active[user_id] = timestamp
+
+def increment_downloads(user_id, platform="other", lang="ru"):
+    with _buffer_lock:
+        _pending_downloads[user_id] += 1
+        _pending_stats[(day_of(time.time()), platform, lang or "ru")] += 1
+
+def flush_writes():
+    global _pending_active, _pending_downloads, _pending_stats
+    with _buffer_lock:
+        active, _pending_active = _pending_active, {}
+        downloads, _pending_downloads = _pending_downloads, Counter()
+        stats, _pending_stats = _pending_stats, Counter()
+    if not active and not downloads and not stats:
+        return
 
-        conn.commit()
-        conn.close()
-def get_users(offset=0, limit=20):
     with _lock:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        conn = _get_conn()
+        try:
+            with conn:
+                conn.executemany("""
+                    UPDATE users SET last_active = MAX(last_active, ?) WHERE id = ?
+                """, [(ts, uid) for uid, ts in active.items()])
+                conn.executemany("""
+                    UPDATE users SET downloads = downloads + ? WHERE id = ?
+                """, [(n, uid) for uid, n in downloads.items()])
+                _update_activity(conn, active)
+                _update_download_stats(conn, stats)
+        except sqlite3.Error as e:
+            # Транзакция откатилась — возвращаем пачку в буфер, запишем при следующем сбросе
+            logger.warning("Не удалось сбросить буфер статистики (записей: %d), повторю позже: %s",
+                           len(active) + len(downloads) + len(stats), e)
+            _requeue_writes(active, downloads, stats)
+            return
+        _prune_activity(conn)
 
-        cursor.execute("""
+def _requeue_writes(active, downloads, stats):
+    # Пока шла запись, буфер мог пополниться: складываем, а не заменяем
+    with _buffer_lock:
+        for uid, ts in active.items():
+            if ts > _pending_active.get(uid, 0):
+                _pending_active[uid] = ts
+        _pending_downloads.update(downloads)
+        _pending_stats.update(stats)
+
+def _update_activity(conn, active):
+    # Пользователь попадает в DAU/WAU только при первой активности за день/неделю
+    new_days, new_weeks = Counter(), Counter()
+    for uid, ts in active.items():
+        day = day_of(ts)
+        if conn.execute("INSERT OR IGNORE INTO user_days (day, user_id) VALUES (?, ?)", (day, uid)).rowcount:
+            new_days[day] += 1
+        week = week_of(day)
+        if conn.execute("INSERT OR IGNORE INTO user_weeks (week, user_id) VALUES (?, ?)", (week, uid)).rowcount:
+            new_weeks[week] += 1
+    conn.executemany("""
+        INSERT INTO stats_daily (day, active_users) VALUES (?, ?)
+        ON CONFLICT(day) DO UPDATE SET active_users = active_users + excluded.active_users
+    """, list(new_days.items()))
+    conn.executemany("""
+        INSERT INTO stats_weekly (week, active_users) VALUES (?, ?)
+        ON CONFLICT(week) DO UPDATE SET active_users = active_users + excluded.active_users
+    """, list(new_weeks.items()))
+
+def _update_download_stats(conn, stats):
+    if not stats:
+        return
+    conn.executemany("""
+        INSERT INTO stats_downloads (day, platform, lang, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(day, platform, lang) DO UPDATE SET count = count + excluded.count
+    """, [(day, platform, lang, n) for (day, platform, lang), n in stats.items()])
+    per_day = Counter()
+    for (day, _, _), n in stats.items():
+        per_day[day] += n
+    conn.executemany("""
+        INSERT INTO stats_daily (day, downloads) VALUES (?, ?)
+        ON CONFLICT(day) DO UPDATE SET downloads = downloads + excluded.downloads
+    """, list(per_day.items()))
+    conn.execute("UPDATE stats_totals SET value = value + ? WHERE key = 'downloads'", (sum(stats.values()),))
+
+def _prune_activity(conn):
+    # Раз в сутки убираем старые отметки активности; сами агрегаты остаются
+    global _pruned_day
+    today = day_of(time.time())
+    if _pruned_day == today:
+        return
+    _pruned_day = today
+    oldest = today - ACTIVITY_RETENTION_DAYS
+    with conn:
+        conn.execute("DELETE FROM user_days WHERE day < ?", (oldest,))
+        conn.execute("DELETE FROM user_weeks WHERE week < ?", (week_of(oldest),))
+
+async def write_behind_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        await run_db(flush_writes)
+
+def get_users(after_id=0, limit=20):
+    # Постранично по id: следующая страница начинается после последнего показанного
+    with _lock:
+        cursor = _get_conn().execute("""
             SELECT id, username, full_name, lang, downloads, last_active
             FROM users
+            WHERE id > ?
             ORDER BY id ASC
-            LIMIT ? OFFSET ?
-        """, (limit, offset))
+            LIMIT ?
+        """, (after_id, limit))
+        return cursor.fetchall()
 
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
+
+def get_top_users(before=None, limit=20):
+    # Топ по загрузкам; before — (downloads, id) последней строки предыдущей страницы
+    with _lock:
+        if before is None:
+            cursor = _get_conn().execute("""
+                SELECT id, username, full_name, lang, downloads, last_active
+                FROM users
+                ORDER BY downloads DESC, id DESC
+                LIMIT ?
+            """, (limit,))
+        else:
+            cursor = _get_conn().execute("""
+                SELECT id, username, full_name, lang, downloads, last_active
+                FROM users
+                WHERE (downloads, id) < (?, ?)
+                ORDER BY downloads DESC, id DESC
+                LIMIT ?
+            """, (*before, limit))
+        return cursor.fetchall()
 
 
 def count_users():
     with _lock:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        row = _get_conn().execute("SELECT value FROM stats_totals WHERE key = 'users'").fetchone()
+        return row[0] if row else 0
 
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total = cursor.fetchone()[0]
 
-        conn.close()
-        return total
+def get_dashboard(now=None):
+    """Всё для статистики в админке: только чтение агрегатов по ключу, без сканов users."""
+    today = day_of(now or time.time())
+    with _lock:
+        conn = _get_conn()
+        totals = dict(conn.execute("SELECT key, value FROM stats_totals").fetchall())
+        row = conn.execute("""
+            SELECT new_users, active_users, downloads FROM stats_daily WHERE day = ?
+        """, (today,)).fetchone() or (0, 0, 0)
+        week = conn.execute("SELECT active_users FROM stats_weekly WHERE week = ?", (week_of(today),)).fetchone()
+        by_platform = conn.execute("""
+            SELECT platform, SUM(count) FROM stats_downloads WHERE day = ? GROUP BY platform ORDER BY 2 DESC
+        """, (today,)).fetchall()
+        by_lang = conn.execute("""
+            SELECT lang, SUM(count) FROM stats_downloads WHERE day = ? GROUP BY lang ORDER BY 2 DESC
+        """, (today,)).fetchall()
+    return {
+        "users": totals.get("users", 0),
+        "downloads": totals.get("downloads", 0),
+        "new_today": row[0],
+        "dau": row[1],
+        "downloads_today": row[2],
+        "wau": week[0] if week else 0,
+        "by_platform": by_platform,
+        "by_lang": by_lang,
+    }
 
 
 def get_all_user_ids():
     with _lock:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = _get_conn().execute("SELECT id FROM users")
+        return [row[0] for row in cursor.fetchall()]
+
 
-        cursor.execute("SELECT id FROM users")
-        rows = cursor.fetchall()
+# --- РАССЫЛКИ ---
 
-        conn.close()
-        return [row[0] for row in rows]
+def get_user_ids_after(after_id, limit):
+    with _lock:
+        cursor = _get_conn().execute("""
+            SELECT id FROM users
+            WHERE id > ? AND blocked = 0
+            ORDER BY id ASC
+            LIMIT ?
+        """, (after_id, limit))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def count_reachable_users():
+    with _lock:
+        cursor = _get_conn().execute("SELECT COUNT(*) FROM users WHERE blocked = 0")
+        return cursor.fetchone()[0]
+
+
+def mark_users_blocked(user_ids):
+    with _lock:
+        conn = _get_conn()
+        conn.executemany("UPDATE users SET blocked = 1 WHERE id = ?", [(uid,) for uid in user_ids])
+        conn.commit()
+
+
+def create_broadcast(from_chat_id, message_id, admin_chat_id, status_message_id, total):
+    with _lock:
+        conn = _get_conn()
+        cursor = conn.execute("""
+            INSERT INTO broadcasts (from_chat_id, message_id, admin_chat_id, status_message_id, total, started_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (from_chat_id, message_id, admin_chat_id, status_message_id, total, int(time.time())))
+        conn.commit()
+        return cursor.lastrowid
+
+
+def save_broadcast_progress(broadcast_id, cursor_id, sent, blocked, failed, finished=False):
+    with _lock:
+        conn = _get_conn()
+        conn.execute("""
+            UPDATE broadcasts
+            SET cursor = ?, sent = ?, blocked = ?, failed = ?, finished = ?
+            WHERE id = ?
+        """, (cursor_id, sent, blocked, failed, int(finished), broadcast_id))
+        conn.commit()
+
+
+def get_unfinished_broadcasts():
+    with _lock:
+        cursor = _get_conn().execute("""
+            SELECT id, from_chat_id, message_id, admin_chat_id, status_message_id,
+                   cursor, total, sent, blocked, failed
+            FROM broadcasts
+            WHERE finished = 0
+            ORDER BY id ASC
+        """)
+        return cursor.fetchall()
+
+
+# --- КЕШ ОТПРАВЛЕННЫХ ФАЙЛОВ ---
+
+def get_cached_file(cache_key, min_created):
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("""
+            SELECT media_id, access_hash, file_reference, title
+            FROM file_cache
+            WHERE cache_key = ? AND created >= ?
+        """, (cache_key, min_created)).fetchone()
+
+        if row:
+            conn.execute("""
+                UPDATE file_cache SET last_used = ?, hits = hits + 1 WHERE cache_key = ?
+            """, (int(time.time()), cache_key))
+            conn.commit()
+
+        return row
+
+
+def save_cached_file(cache_key, media_id, access_hash, file_reference, title):
+    now = int(time.time())
+    with _lock:
+        conn = _get_conn()
+        conn.execute("""
+            INSERT OR REPLACE INTO file_cache
+                (cache_key, media_id, access_hash, file_reference, title, created, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (cache_key, media_id, access_hash, file_reference, title, now, now))
+        conn.commit()
+
+
+def delete_cached_file(cache_key):
+    with _lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM file_cache WHERE cache_key = ?", (cache_key,))
+        conn.commit()
+
+
+def evict_cached_files(min_created, max_entries):
+    with _lock:
+        conn = _get_conn()
+
+        # Сначала протухшие по TTL, затем самые давно использованные сверх лимита
+        conn.execute("DELETE FROM file_cache WHERE created < ?", (min_created,))
+        conn.execute("""
+            DELETE FROM file_cache WHERE cache_key IN (
+                SELECT cache_key FROM file_cache
+                ORDER BY last_used DESC
+                LIMIT -1 OFFSET ?
+            )
+        """, (max_entries,))
+        conn.commit()
+
+
+# --- ОЧЕРЕДЬ ЗАДАЧ ---
+
+def enqueue_job(payload, priority, max_attempts):
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        cursor = conn.execute("""
+            INSERT INTO jobs (payload, priority, max_attempts, created, updated)
+            VALUES (?, ?, ?, ?, ?)
+        """, (payload, priority, max_attempts, now, now))
+        conn.commit()
+        return cursor.lastrowid
+
+
+def claim_job(worker_id, lease_seconds):
+    # Несколько процессов берут задачи из одного файла: BEGIN IMMEDIATE сразу берёт блокировку на запись
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Воркер пропал, а попытки кончились — задача считается проваленной
+            conn.execute("""
+                UPDATE jobs SET state = 'failed', error = 'lease expired', updated = ?
+                WHERE state = 'running' AND lease_until < ? AND attempts >= max_attempts
+            """, (now, now))
+            row = conn.execute("""
+                SELECT id, payload, attempts FROM jobs
+                WHERE (state = 'queued' AND not_before <= ?) OR (state = 'running' AND lease_until < ?)
+                ORDER BY priority ASC, id ASC
+                LIMIT 1
+            """, (now, now)).fetchone()
+            if row:
+                conn.execute("""
+                    UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ?
+                    WHERE id = ?
+                """, (worker_id, now + lease_seconds, now, row[0]))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return (row[0], row[1], row[2] + 1) if row else None
+
+
+def extend_job_lease(job_id, worker_id, lease_seconds):
+    with _lock:
+        conn = _get_conn()
+        cursor = conn.execute("""
+            UPDATE jobs SET lease_until = ?
+            WHERE id = ? AND worker = ? AND state = 'running'
+        """, (time.time() + lease_seconds, job_id, worker_id))
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def complete_job(job_id, worker_id, result):
+    with _lock:
+        conn = _get_conn()
+        cursor = conn.execute("""
+            UPDATE jobs SET state = 'done', result = ?, updated = ?
+            WHERE id = ? AND worker = ? AND state = 'running'
+        """, (result, time.time(), job_id, worker_id))
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def fail_job(job_id, worker_id, error, retry_delay):
+    # Возвращает True, если задача вернулась в очередь, и False, если попытки исчерпаны
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("""
+            SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ? AND state = 'running'
+        """, (job_id, worker_id)).fetchone()
+        if not row:
+            return False
+        retry = row[0] < row[1]
+        conn.execute("""
+            UPDATE jobs SET state = ?, error = ?, worker = NULL, not_before = ?, updated = ?
+            WHERE id = ?
+        """, ("queued" if retry else "failed", error, now + retry_delay * row[0], now, job_id))
+        conn.commit()
+        return retry
+
+
+def take_job_results(limit):
+    # Готовые задачи забираются один раз: строки удаляются вместе с выдачей
+    with _lock:
+        conn = _get_conn()
+        rows = conn.execute("""
+            SELECT id, payload, result FROM jobs WHERE state = 'done' ORDER BY id ASC LIMIT ?
+        """, (limit,)).fetchall()
+        if rows:
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(row[0],) for row in rows])
+            conn.commit()
+        return rows
+
+
+def count_jobs_by_state():
+    with _lock:
+        cursor = _get_conn().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        return dict(cursor.fetchall())
+
+
+# --- ЖУРНАЛ ЗАГРУЗОК ---
+
+def journal_add(job_id, payload, state):
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        conn.execute("""
+            INSERT OR REPLACE INTO journal (id, payload, state, created, updated) VALUES (?, ?, ?, ?, ?)
+        """, (job_id, payload, state, now, now))
+        conn.commit()
+
+
+def journal_set_state(job_id, state):
+    with _lock:
+        conn = _get_conn()
+        conn.execute("UPDATE journal SET state = ?, updated = ? WHERE id = ?", (state, time.time(), job_id))
+        conn.commit()
+
+
+def journal_remove(job_id):
+    with _lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM journal WHERE id = ?", (job_id,))
+        conn.commit()
+
+
+def journal_unfinished():
+    with _lock:
+        cursor = _get_conn().execute("SELECT id, payload, state, created FROM journal ORDER BY created ASC")
+        return cursor.fetchall()
@@ -1,74 +1,75 @@
 import os
+import re
+import html
 import time
 import asyncio
+import logging
 from aiogram import Router, types, F
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
 from telethon import TelegramClient
-from telethon.tl.types import DocumentAttributeVideo
 
-from src.services.downloader import VideoDownloader
-from src.db import add_user, get_users, count_users, get_all_user_ids
+from src.services.downloader import VideoDownloader, normalize_url
+from src.services.storage import StorageManager
+from src.services.file_cache import FileCache
+from src.services.scheduler import JobScheduler, PRIORITY_AUDIO, PRIORITY_SHORT, PRIORITY_NORMAL
+from src.services.broadcast import Broadcaster
+from src.services.subscriptions import SubscriptionCache
+from src.services.uploader import ParallelUploader
+from src.services.metrics import Gauge, platform_of
+from src.services.progress import EditScheduler
+from src.services.pipeline import Job, Pipeline, StatusMessage, make_caption
+from src.services.journal import JobJournal
+from src.services.thumbnails import ThumbnailCache, thumb_key
+from src.services.jobqueue import make_store
+from src.strings import STRINGS
+from src.db import run_db, add_user, update_last_active, increment_downloads, get_dashboard, get_users, get_top_users
 from src.config import conf
 
+logger = logging.getLogger(__name__)
+
 CHANNEL_ID = conf.channel_id
 CHANNEL_URL = conf.channel_url
 
 video_router = Router()
-downloader = VideoDownloader()
+scheduler = JobScheduler(conf.network_limit, conf.transcode_limit, conf.upload_limit)
+storage = StorageManager(conf.download_path, conf.storage_quota, conf.storage_min_free,
+                         staging_root=conf.staging_path, staging_quota=conf.staging_quota,
+                         staging_max_job=conf.staging_max_job, wait_timeout=conf.storage_wait,
+                         orphan_age=conf.orphan_age)
+downloader = VideoDownloader(scheduler, storage)
+file_cache = FileCache(ttl=conf.file_cache_ttl, max_entries=conf.file_cache_max)
+broadcaster = Broadcaster(rate=conf.broadcast_rate, workers=conf.broadcast_workers)
+subscriptions = SubscriptionCache(CHANNEL_ID, conf.sub_positive_ttl, conf.sub_negative_ttl)
+edits = EditScheduler(per_chat_interval=conf.edit_interval, global_rate=conf.edit_rate)
+
+Gauge("bot_queue_depth", "Jobs waiting for a scheduler slot", ("stage",),
+      func=lambda: {name: waiting for name, (active, waiting) in scheduler.stats().items()})
+Gauge("bot_active_slots", "Jobs holding a scheduler slot", ("stage",),
+      func=lambda: {name: active for name, (active, waiting) in scheduler.stats().items()})
+Gauge("bot_inflight_jobs", "Download jobs in progress", func=lambda: downloader.inflight)
+Gauge("bot_storage_bytes", "Space reserved for temp files", ("root",),
+      func=storage.usage)
+Gauge("bot_host_limit", "Current concurrency limit per platform", ("platform",),
+      func=downloader.hosts.limits_snapshot)
+Gauge("bot_host_paused", "Platforms paused after repeated rate limiting", ("platform",),
+      func=downloader.hosts.open_snapshot)
 
 # Инициализируем Telethon
 tele_client = TelegramClient('telethon_bot', conf.api_id, conf.api_hash)
-
-# --- ЛОКАЛИЗАЦИЯ ---
-STRINGS = {
-    "ru": {
-        "choose_lang": "Выберите язык / Choose language:",
-        "welcome": "Привет, {name}! 👋\n\nЯ помогу тебе скачать видео из <b>TikTok, YouTube, Instagram или VK</b>.\nПросто пришли мне ссылку!",
-        "sub_req": "⚠️ <b>Для использования бота нужно подписаться на наш канал!</b>",
-        "btn_sub": "✅ Подписаться",
-        "btn_check_sub": "🔄 Проверить подписку",
-        "btn_channel": "📢 Наш канал",
-        "btn_help": "🆘 Помощь",
-        "btn_video": "🎬 Видео (Max)",
-        "btn_audio": "🎵 Аудио (MP3)",
-        "btn_cancel": "❌ Отмена",
-        "btn_settings": "⚙️ Настройки",
-        "btn_change_lang": "🌐 Сменить язык",
-        "btn_back": "⬅️ Назад",
-        "link_ok": "Выберите качество видео:",
-        "link_ok_general": "Ссылка принята! Что скачиваем?",
-        "step_1": "🔍 Анализирую ссылку...",
-        "step_2": "📥 Загружаю: {p}",
-        "step_3": "⚙️ Обработка файла...",
-        "step_4": "📤 Отправка в Telegram...",
-        "promo": "\n\n🚀 <b>Скачано через: @youtodownloadbot</b>"
-    },
-    "en": {
-        "choose_lang": "Choose language / Выберите язык:",
-        "welcome": "Hello, {name}! 👋\n\nI can download from <b>TikTok, YouTube, Instagram or VK</b>.",
-        "sub_req": "⚠️ <b>Please subscribe to our channel!</b>",
-        "btn_sub": "✅ Subscribe",
-        "btn_check_sub": "🔄 Check",
-        "btn_channel": "📢 Channel",
-        "btn_help": "🆘 Help",
-        "btn_video": "🎬 Video (Max)",
-        "btn_audio": "🎵 Audio (MP3)",
-        "btn_cancel": "❌ Cancel",
-        "btn_settings": "⚙️ Settings",
-        "btn_change_lang": "🌐 Language",
-        "btn_back": "⬅️ Back",
-        "link_ok": "Choose video quality:",
-        "link_ok_general": "Link accepted! What to download?",
-        "step_1": "🔍 Analyzing...",
-        "step_2": "📥 Downloading: {p}",
-        "step_3": "⚙️ Processing...",
-        "step_4": "📤 Sending...",
-        "promo": "\n\n🚀 <b>Via: @youtodownloadbot</b>"
-    }
-}
+uploader = ParallelUploader(tele_client, workers=conf.upload_workers)
+thumbnails = ThumbnailCache(conf.thumb_path, conf.thumb_cache_max)
+pipeline = Pipeline(downloader, uploader, tele_client, scheduler, edits, conf.progress_interval, thumbnails)
+job_store = make_store(conf)
+journal = JobJournal(max_age=conf.journal_max_age)
+# Загрузки, которые бот ведёт сам (из обработчиков и продолженные после перезапуска): их ждут при остановке
+active_jobs = set()
+
+AUDIO_FORMATS = {"mp3": "MP3", "m4a": "M4A", "opus": "Opus"}
+ADMIN_PAGE_SIZE = 20  # Пользователей на странице в админке
+URL_RE = re.compile(r'https?://\S+')
 
 class DownloadStates(StatesGroup):
     choosing_language = State()
@@ -77,18 +78,20 @@ class AdminStates(StatesGroup):
     waiting_for_broadcast = State()
 
 async def is_subscribed(bot, user_id):
-    try:
-        member = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
-        return member.status in ["member", "administrator", "creator"]
-    except Exception:
-        return False
+    return await subscriptions.is_subscribed(bot, user_id)
+
+@video_router.chat_member()
+async def on_channel_member(event: types.ChatMemberUpdated):
+    # Вступления и выходы из канала сразу обновляют кеш подписок
+    if subscriptions.matches_channel(event.chat):
+        subscriptions.set_status(event.new_chat_member.user.id, event.new_chat_member)
 
 # --- ОБЩИЕ ХЕНДЛЕРЫ ---
 
 @video_router.message(Command("start"))
 async def start_cmd(message: types.Message, state: FSMContext):
     await state.clear()
-    add_user(user_id=message.from_user.id, username=message.from_user.username, full_name=message.from_user.full_name, lang="ru")
+    await run_db(add_user, user_id=message.from_user.id, username=message.from_user.username, full_name=message.from_user.full_name, lang="ru")
     kb = InlineKeyboardMarkup(inline_keyboard=[[
         InlineKeyboardButton(text="🇷🇺 Русский", callback_data="setlang_ru"),
         InlineKeyboardButton(text="🇺🇸 English", callback_data="setlang_en")
@@ -114,12 +117,33 @@ async def set_language(callback: types.CallbackQuery, state: FSMContext):
 async def settings_menu(callback: types.CallbackQuery, state: FSMContext):
     u_data = await state.get_data()
     lang = u_data.get("lang", "ru")
+    audio_fmt = u_data.get("audio_fmt", "mp3")
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=STRINGS[lang]["btn_change_lang"], callback_data="change_language")],
+        [InlineKeyboardButton(text=STRINGS[lang]["btn_audio_fmt"].format(fmt=AUDIO_FORMATS[audio_fmt]), callback_data="audio_fmt_menu")],
         [InlineKeyboardButton(text=STRINGS[lang]["btn_back"], callback_data="back_to_main")]
     ])
     await callback.message.edit_text("⚙️ Settings / Настройки", reply_markup=kb)
 
+@video_router.callback_query(F.data == "audio_fmt_menu")
+async def audio_fmt_menu(callback: types.CallbackQuery, state: FSMContext):
+    u_data = await state.get_data()
+    lang = u_data.get("lang", "ru")
+    current = u_data.get("audio_fmt", "mp3")
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=("✅ " if key == current else "") + name, callback_data=f"setaudio_{key}")
+         for key, name in AUDIO_FORMATS.items()],
+        [InlineKeyboardButton(text=STRINGS[lang]["btn_back"], callback_data="settings_menu")]
+    ])
+    await callback.message.edit_text(STRINGS[lang]["audio_fmt_title"], reply_markup=kb)
+
+@video_router.callback_query(F.data.startswith("setaudio_"))
+async def set_audio_fmt(callback: types.CallbackQuery, state: FSMContext):
+    fmt = callback.data.split("_")[1]
+    if fmt in AUDIO_FORMATS:
+        await state.update_data(audio_fmt=fmt)
+    await settings_menu(callback, state)
+
 @video_router.callback_query(F.data == "change_language")
 async def change_lang(callback: types.CallbackQuery):
     kb = InlineKeyboardMarkup(inline_keyboard=[[
@@ -154,8 +178,71 @@ async def admin_main(callback: types.CallbackQuery):
 
 @video_router.callback_query(F.data == "admin_stats")
 async def admin_stats(callback: types.CallbackQuery):
-    total = count_users()
-    await callback.answer(f"Всего пользователей: {total}", show_alert=True)
+    if str(callback.from_user.id) != str(conf.admin_id): return
+    # Только готовые агрегаты: ответ не зависит от числа пользователей
+    d = await run_db(get_dashboard)
+    lines = [
+        "📊 <b>Статистика</b>",
+        f"Всего пользователей: {d['users']}",
+        f"Всего загрузок: {d['downloads']}",
+        "",
+        f"Сегодня: активных {d['dau']}, новых {d['new_today']}, загрузок {d['downloads_today']}",
+        f"Активных за неделю: {d['wau']}",
+    ]
+    if d["by_platform"]:
+        lines.append("Платформы сегодня: " + ", ".join(f"{name} {n}" for name, n in d["by_platform"]))
+    if d["by_lang"]:
+        lines.append("Языки сегодня: " + ", ".join(f"{name} {n}" for name, n in d["by_lang"]))
+    # Платформы, которые сейчас ограничивают бота
+    for name, host in downloader.hosts.health().items():
+        if host["limit"] < host["cap"] or host["open_for"] or host["cookies_resting"]:
+            line = f"{name}: лимит {host['limit']}/{host['cap']}"
+            if host["open_for"]:
+                line += f", пауза {host['open_for']} с"
+            if host["cookies_resting"]:
+                line += f", cookies на отдыхе {host['cookies_resting']}/{host['cookies']}"
+            lines.append(line)
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="👥 Пользователи", callback_data="admin_users:0")],
+        [InlineKeyboardButton(text="🏆 Топ по загрузкам", callback_data="admin_top")],
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_panel")]
+    ])
+    await callback.message.edit_text("\n".join(lines), parse_mode="HTML", reply_markup=kb)
+
+def user_line(row):
+    uid, username, full_name, lang, downloads, last_active = row
+    name = html.escape(full_name or "—")
+    if username:
+        name += f" (@{html.escape(username)})"
+    seen = time.strftime("%d.%m.%Y", time.gmtime(last_active)) if last_active else "—"
+    return f"<code>{uid}</code> {name} · {lang or '—'} · ⬇️ {downloads} · {seen}"
+
+async def show_user_page(callback: types.CallbackQuery, title: str, rows, next_data: str):
+    # Листаем только вперёд: следующая страница начинается с ключа последней строки
+    text = f"{title}\n\n" + ("\n".join(user_line(row) for row in rows[:ADMIN_PAGE_SIZE]) or "Пусто")
+    buttons = []
+    if len(rows) > ADMIN_PAGE_SIZE:
+        buttons.append([InlineKeyboardButton(text="Дальше ▶️", callback_data=next_data)])
+    buttons.append([InlineKeyboardButton(text="⬅️ К статистике", callback_data="admin_stats")])
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+@video_router.callback_query(F.data.startswith("admin_users:"))
+async def admin_users(callback: types.CallbackQuery):
+    if str(callback.from_user.id) != str(conf.admin_id): return
+    after_id = int(callback.data.split(":")[1])
+    # Одна лишняя строка показывает, есть ли следующая страница
+    rows = await run_db(get_users, after_id, ADMIN_PAGE_SIZE + 1)
+    last = rows[ADMIN_PAGE_SIZE - 1][0] if len(rows) > ADMIN_PAGE_SIZE else 0
+    await show_user_page(callback, "👥 <b>Пользователи</b>", rows, f"admin_users:{last}")
+
+@video_router.callback_query(F.data.startswith("admin_top"))
+async def admin_top(callback: types.CallbackQuery):
+    if str(callback.from_user.id) != str(conf.admin_id): return
+    parts = callback.data.split(":")
+    before = (int(parts[1]), int(parts[2])) if len(parts) == 3 else None
+    rows = await run_db(get_top_users, before, ADMIN_PAGE_SIZE + 1)
+    last = rows[ADMIN_PAGE_SIZE - 1] if len(rows) > ADMIN_PAGE_SIZE else (0, None, None, None, 0)
+    await show_user_page(callback, "🏆 <b>Топ по загрузкам</b>", rows, f"admin_top:{last[4]}:{last[0]}")
 
 @video_router.callback_query(F.data == "admin_broadcast")
 async def admin_broad_start(callback: types.CallbackQuery, state: FSMContext):
@@ -168,19 +255,8 @@ async def admin_broad_process(message: types.Message, state: FSMContext):
         await state.clear()
         return await message.answer("Рассылка отменена.")
     
-    u_ids = get_all_user_ids()
-    sent, blocked = 0, 0
-    prog = await message.answer("🚀 Рассылка началась...")
-    
-    for uid in u_ids:
-        try:
-            await message.copy_to(chat_id=int(uid))
-            sent += 1
-            await asyncio.sleep(0.05)
-        except:
-            blocked += 1
-    
-    await prog.edit_text(f"🏁 Рассылка завершена!\n✅ Успешно: {sent}\n❌ Заблокировали бота: {blocked}")
+    # Рассылка идёт в фоне и переживает перезапуск бота
+    await broadcaster.start(message.bot, message.chat.id, message.message_id, message.chat.id)
     await state.clear()
 
 # --- ОБРАБОТКА ССЫЛОК + ПРЕВЬЮ ---
@@ -189,6 +265,7 @@ async def admin_broad_process(message: types.Message, state: FSMContext):
 async def handle_url(message: types.Message, state: FSMContext):
     u_data = await state.get_data()
     lang = u_data.get("lang", "ru")
+    update_last_active(message.from_user.id, int(time.time()))
     
     if not await is_subscribed(message.bot, message.from_user.id):
         kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -197,35 +274,84 @@ async def handle_url(message: types.Message, state: FSMContext):
         ])
         return await message.answer(STRINGS[lang]["sub_req"], parse_mode="HTML", reply_markup=kb)
 
-    url = message.text.strip()
+    urls = extract_urls(message.text)
+    if len(urls) > 1:
+        return await offer_batch(message, state, lang, urls)
+    url = urls[0]
     await state.update_data(download_url=url)
     
     tmp = await message.answer(STRINGS[lang]["step_1"])
     info = await downloader.get_video_info(url)
+    await state.update_data(download_duration=info.get('duration') if info else None)
     
     is_yt = any(x in url.lower() for x in ['youtube.com', 'youtu.be']) and 'shorts' not in url.lower()
     
+    # Кнопки качества — только из реально доступных форматов, план берётся из той же выборки, что и превью
+    plan = await downloader.get_format_plan(url) if is_yt and info else None
     rows = []
-    if is_yt:
+    if plan and plan.options:
+        buttons = [InlineKeyboardButton(text=quality_label(option), callback_data=f"dl_res_{option.quality}")
+                   for option in plan.options]
+        rows.extend(buttons[i:i + 2] for i in range(0, len(buttons), 2))
+    elif not is_yt:
+        rows.append([InlineKeyboardButton(text=STRINGS[lang]["btn_video"], callback_data="dl_video")])
+    elif not (plan and plan.too_big):
+        # Форматы неизвестны — прежний фиксированный набор
         rows.append([InlineKeyboardButton(text="📹 1080p", callback_data="dl_res_1080"), InlineKeyboardButton(text="📹 720p", callback_data="dl_res_720")])
         rows.append([InlineKeyboardButton(text="📹 480p", callback_data="dl_res_480"), InlineKeyboardButton(text="📹 360p", callback_data="dl_res_360")])
-    else:
-        rows.append([InlineKeyboardButton(text=STRINGS[lang]["btn_video"], callback_data="dl_video")])
     
-    rows.append([InlineKeyboardButton(text=STRINGS[lang]["btn_audio"], callback_data="dl_audio")])
+    audio_fmt = AUDIO_FORMATS[u_data.get("audio_fmt", "mp3")]
+    rows.append([InlineKeyboardButton(text=STRINGS[lang]["btn_audio"].format(fmt=audio_fmt), callback_data="dl_audio")])
     rows.append([InlineKeyboardButton(text=STRINGS[lang]["btn_cancel"], callback_data="cancel_download")])
     
     kb = InlineKeyboardMarkup(inline_keyboard=rows)
+    # Обложку отдаём своим файлом: сам Telegram часто не может скачать её с CDN (особенно Instagram)
+    thumb = await thumbnails.get(thumb_key(url, info.get('id')), info['thumbnail']) if info and info.get('thumbnail') else None
     await tmp.delete()
 
     title = info['title'] if info else "Video"
-    caption = f"🎬 <b>{title}</b>\n\n{STRINGS[lang]['link_ok'] if is_yt else STRINGS[lang]['link_ok_general']}"
+    if plan and plan.too_big:
+        prompt = STRINGS[lang]['too_big']
+    else:
+        prompt = STRINGS[lang]['link_ok'] if is_yt else STRINGS[lang]['link_ok_general']
+    caption = f"🎬 <b>{title}</b>\n\n{prompt}"
     
-    if info and info.get('thumbnail'):
-        await message.answer_photo(photo=info['thumbnail'], caption=caption, parse_mode="HTML", reply_markup=kb)
+    if thumb:
+        await message.answer_photo(photo=FSInputFile(thumb), caption=caption, parse_mode="HTML", reply_markup=kb)
     else:
         await message.answer(caption, parse_mode="HTML", reply_markup=kb)
 
+def extract_urls(text: str):
+    # Порядок сохраняем, повторы убираем: пересланные списки часто содержат дубли
+    seen, urls = set(), []
+    for url in URL_RE.findall(text or ""):
+        url = url.rstrip(").,;!?»\"'")
+        key = normalize_url(url)
+        if key not in seen:
+            seen.add(key)
+            urls.append(url)
+    return urls
+
+async def offer_batch(message: types.Message, state: FSMContext, lang: str, urls):
+    text = STRINGS[lang]["batch_found"].format(n=len(urls))
+    if len(urls) > conf.batch_max_links:
+        text += STRINGS[lang]["batch_truncated"].format(max=conf.batch_max_links)
+    await state.update_data(batch_urls=urls[:conf.batch_max_links])
+    u_data = await state.get_data()
+    audio_fmt = AUDIO_FORMATS[u_data.get("audio_fmt", "mp3")]
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=STRINGS[lang]["btn_video"], callback_data="batch_video")],
+        [InlineKeyboardButton(text=STRINGS[lang]["btn_audio"].format(fmt=audio_fmt), callback_data="batch_audio")],
+        [InlineKeyboardButton(text=STRINGS[lang]["btn_cancel"], callback_data="cancel_download")]
+    ])
+    await message.answer(text, parse_mode="HTML", reply_markup=kb)
+
+def quality_label(option):
+    if not option.size:
+        return f"📹 {option.quality}p"
+    # Оценка по битрейту помечается «~», точный размер — без неё
+    return f"📹 {option.quality}p · {'' if option.exact else '~'}{max(1, option.size >> 20)} MB"
+
 # --- СКАЧИВАНИЕ ---
 
 @video_router.callback_query(F.data.startswith("dl_"))
@@ -239,50 +365,183 @@ async def start_dl(callback: types.CallbackQuery, state: FSMContext):
     parts = callback.data.split("_")
     mode = 'audio' if parts[1] == 'audio' else 'video'
     quality = parts[2] if len(parts) > 2 else None
+    if mode == 'audio':
+        # Для аудио вместо качества передаём выбранный формат
+        quality = u_data.get("audio_fmt", "mp3")
 
     try: await callback.message.delete()
     except: pass
     
     status = await callback.message.answer(STRINGS[lang]["step_1"], parse_mode="HTML")
-    last_upd = [0]
 
-    async def prog_cb(p_str):
-        if time.time() - last_upd[0] < 2: return
+    # Аудио и короткие ролики обрабатываются раньше длинных видео
+    duration = u_data.get("download_duration")
+    if mode == 'audio':
+        priority = PRIORITY_AUDIO
+    elif duration and duration <= conf.short_clip_seconds:
+        priority = PRIORITY_SHORT
+    else:
+        priority = PRIORITY_NORMAL
+    user_id = callback.from_user.id
+
+    # Если этот файл уже отправлялся — пересылаем его без скачивания
+    cache_key = file_cache.make_key(url, mode, quality)
+    cached = await file_cache.get(cache_key)
+    if cached:
         try:
-            await status.edit_text(STRINGS[lang]["step_2"].format(p=p_str), parse_mode="HTML")
-            last_upd[0] = time.time()
-        except: pass
+            if not tele_client.is_connected(): await tele_client.start(bot_token=conf.bot_token)
+            await tele_client.send_file(
+                callback.message.chat.id,
+                cached.media,
+                caption=make_caption(mode, lang, cached.title),
+                parse_mode='html'
+            )
+            sent = True
+        except Exception as e:
+            # Старую ссылку на файл не приняли (RPCError) или отправка сорвалась — качаем заново
+            logger.warning("Не удалось отправить из кеша %s: %s", cache_key, e)
+            sent = False
+            try:
+                await file_cache.invalidate(cache_key)
+            except Exception as e:
+                logger.warning("Не удалось удалить запись кеша %s: %s", cache_key, e)
+        if sent:
+            increment_downloads(user_id, platform_of(url), lang)
+            edits.discard(status)
+            try:
+                await status.delete()
+            except Exception as e:
+                logger.debug("Не удалось удалить статус: %s", e)
+            return
+
+    job = Job(url=url, mode=mode, quality=quality, chat_id=callback.message.chat.id, user_id=user_id,
+              status_message_id=status.message_id, lang=lang, priority=priority, cache_key=cache_key)
+
+    if job_store is not None:
+        # Качать будет воркер, результат заберёт collect_results
+        try:
+            await job_store.enqueue(job.to_dict(), priority)
+        except Exception as e:
+            logger.exception("Не удалось поставить задачу в очередь: %s", e)
+            return await pipeline.show_error(status, lang, e)
+        return await pipeline.show_status(status, lang, "queued")
+
+    await run_job(job, status)
+
+@video_router.callback_query(F.data.startswith("batch_"))
+async def start_batch(callback: types.CallbackQuery, state: FSMContext):
+    u_data = await state.get_data()
+    urls = u_data.get("batch_urls")
+    lang = u_data.get("lang", "ru")
+
+    if not urls: return await callback.answer("Ошибка: ссылка потеряна")
 
+    mode = 'audio' if callback.data == "batch_audio" else 'video'
+    quality = u_data.get("audio_fmt", "mp3") if mode == 'audio' else None
+    user_id = callback.from_user.id
+
+    try: await callback.message.delete()
+    except: pass
+
+    status = await callback.message.answer(STRINGS[lang]["step_1"], parse_mode="HTML")
+
+    # Уже отправлявшиеся файлы попадут в альбом без скачивания
+    items = []
+    for url in urls:
+        cache_key = file_cache.make_key(url, mode, quality)
+        cached = await file_cache.get(cache_key)
+        items.append({"url": url, "cache_key": cache_key, "cached": cached_result(cached) if cached else None})
+
+    job = Job(url=urls[0], mode=mode, quality=quality, chat_id=callback.message.chat.id, user_id=user_id,
+              status_message_id=status.message_id, lang=lang, priority=PRIORITY_NORMAL, items=items)
+
+    if job_store is not None:
+        try:
+            await job_store.enqueue(job.to_dict(), PRIORITY_NORMAL)
+        except Exception as e:
+            logger.exception("Не удалось поставить пачку в очередь: %s", e)
+            return await pipeline.show_error(status, lang, e)
+        return await pipeline.show_status(status, lang, "queued")
+
+    await run_job(job, status)
+
+async def run_job(job: Job, status, journal_id: str = None):
+    # Запись в журнале снимается только после ответа пользователю: если процесс
+    # остановится посреди загрузки, задачу продолжат после перезапуска
+    task = asyncio.current_task()
+    active_jobs.add(task)
     try:
-        res = await downloader.download(url, mode=mode, quality=quality, progress_callback=prog_cb)
-        await status.edit_text(STRINGS[lang]["step_3"])
-        
-        if not tele_client.is_connected(): await tele_client.start(bot_token=conf.bot_token)
-        
-        cap = f"🎬 <b>{res.title}</b>{STRINGS[lang]['promo']}"
-        if mode == 'audio': cap = f"🎵 <b>{res.title}</b>{STRINGS[lang]['promo']}"
-
-        # ПРАВКА: Добавлен параметр supports_streaming для быстрой отправки и просмотра
-        await tele_client.send_file(
-            callback.message.chat.id, 
-            res.path, 
-            caption=cap, 
-            parse_mode='html',
-            supports_streaming=True, # Обязательно для быстрой отправки
-            attributes=[DocumentAttributeVideo(
-                duration=res.duration, 
-                w=res.width, 
-                h=res.height, 
-                supports_streaming=True
-            )] if mode == 'video' else []
-        )
-        await status.delete()
-    except Exception as e:
-        await status.edit_text(f"❌ Error: {str(e)[:100]}")
+        if journal_id is None:
+            journal_id = await journal.begin(job)
+        on_stage = journal.tracker(journal_id)
+        try:
+            if not tele_client.is_connected(): await tele_client.start(bot_token=conf.bot_token)
+            if job.items:
+                await save_results(job.user_id, job.lang, await pipeline.run_batch(job, status, on_stage))
+            else:
+                sent, title = await pipeline.run(job, status, on_stage)
+                await file_cache.put(job.cache_key, sent, title)
+                increment_downloads(job.user_id, platform_of(job.url), job.lang)
+        except Exception as e:
+            await pipeline.show_error(status, job.lang, e)
+        await journal.finish(journal_id)
     finally:
-        if 'res' in locals() and os.path.exists(res.path): 
-            try: os.remove(res.path)
-            except: pass
+        active_jobs.discard(task)
+
+async def drain_jobs(timeout: float):
+    # При остановке начатые загрузки дорабатывают; прерванные продолжатся после перезапуска по журналу
+    if not active_jobs:
+        return
+    logger.info("Жду завершения загрузок: %d", len(active_jobs))
+    done, pending = await asyncio.wait(set(active_jobs), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("Прервано загрузок после %d с: %d", timeout, len(pending))
+        await asyncio.gather(*pending, return_exceptions=True)
+
+async def resume_jobs(bot, entries):
+    # Задачи, прерванные перезапуском: правим их статусы и запускаем заново
+    for entry in entries:
+        status = StatusMessage(bot, entry.job.chat_id, entry.job.status_message_id)
+        await pipeline.show_status(status, entry.job.lang, "resumed")
+        task = asyncio.create_task(run_job(entry.job, status, entry.id))
+        active_jobs.add(task)
+        task.add_done_callback(active_jobs.discard)
+    if entries:
+        logger.info("Продолжаю прерванные загрузки: %d", len(entries))
+
+def cached_result(cached):
+    doc = cached.media
+    return {"id": doc.id, "access_hash": doc.access_hash, "file_reference": (doc.file_reference or b"").hex(),
+            "title": cached.title}
+
+async def save_results(user_id, lang, results):
+    # results: (cache_key, document_result или None, платформа) на каждый доставленный файл
+    for cache_key, result, platform in results:
+        if result and result.get("id") and cache_key:
+            await file_cache.put_document(cache_key, result["id"], result["access_hash"],
+                                          bytes.fromhex(result.get("file_reference", "")), result.get("title", ""))
+        increment_downloads(user_id, platform, lang)
+
+async def collect_results(interval: float = 2):
+    # Воркеры отправляют файлы сами, боту остаётся кеш и статистика
+    while True:
+        try:
+            for done in await job_store.take_results():
+                payload = done.payload
+                if payload.get("items"):
+                    # Платформу берём из ссылок задачи, а не из ответа воркера
+                    urls = {item["cache_key"]: item["url"] for item in payload["items"]}
+                    results = [(r[0], r[1], platform_of(urls.get(r[0], ""))) for r in done.result.get("items", [])]
+                else:
+                    results = [(payload.get("cache_key"), done.result, platform_of(payload["url"]))]
+                await save_results(payload["user_id"], payload.get("lang"), results)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Не удалось забрать результаты задач: %s", e)
+        await asyncio.sleep(interval)
 
 @video_router.callback_query(F.data == "cancel_download")
 async def cancel_dl(callback: types.CallbackQuery, state: FSMContext):
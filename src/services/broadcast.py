@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest, TelegramNetworkError
+
+from src.db import (
+    run_db, get_user_ids_after, count_reachable_users, mark_users_blocked,
+    create_broadcast, save_broadcast_progress, get_unfinished_broadcasts
+)
+
+logger = logging.getLogger(__name__)
+
+SENT, BLOCKED, FAILED = "sent", "blocked", "failed"
+
+
+class TokenBucket:
+    """Ограничитель скорости: ``rate`` отправок в секунду с запасом ``capacity``."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # Flood-wait от Telegram касается всего бота, поэтому останавливаем всех отправителей
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _Progress:
+    def __init__(self, row):
+        (self.id, self.from_chat_id, self.message_id, self.admin_chat_id, self.status_message_id,
+         self.cursor, self.total, self.sent, self.blocked, self.failed) = row
+        self.started = time.monotonic()
+        self.done_at_start = self.done
+        self.last_report = 0.0
+
+    @property
+    def done(self):
+        return self.sent + self.blocked + self.failed
+
+    def text(self, finished=False):
+        if finished:
+            return (f"🏁 Рассылка завершена!\n✅ Успешно: {self.sent}\n"
+                    f"❌ Заблокировали бота: {self.blocked}\n⚠️ Ошибки: {self.failed}")
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        speed = (self.done - self.done_at_start) / elapsed
+        left = max(self.total - self.done, 0)
+        eta = int(left / speed) if speed > 0 else 0
+        return (f"🚀 Рассылка: {self.done}/{self.total}\n"
+                f"✅ {self.sent}  ❌ {self.blocked}  ⚠️ {self.failed}\n"
+                f"⚡ {speed:.1f} сообщ./с, осталось ~{eta // 60} мин {eta % 60} с")
+
+
+class Broadcaster:
+    """Рассылка копии сообщения всем пользователям.
+
+    Пользователи обходятся страницами по возрастанию id, после каждой страницы
+    прогресс сохраняется в SQLite. После перезапуска рассылка продолжается с
+    последней сохранённой страницы, поэтому её часть может прийти повторно.
+    """
+
+    def __init__(self, rate: float, workers: int, page_size: int = 500, report_interval: int = 5):
+        self.bucket = TokenBucket(rate, capacity=max(1, int(rate)))
+        self.workers = workers
+        self.page_size = page_size
+        self.report_interval = report_interval
+        self._tasks = {}
+
+    async def start(self, bot: Bot, from_chat_id: int, message_id: int, admin_chat_id: int):
+        total = await run_db(count_reachable_users)
+        status = await bot.send_message(admin_chat_id, "🚀 Рассылка началась...")
+        broadcast_id = await run_db(create_broadcast, from_chat_id, message_id, admin_chat_id, status.message_id, total)
+        self._spawn(bot, (broadcast_id, from_chat_id, message_id, admin_chat_id, status.message_id, 0, total, 0, 0, 0))
+        return broadcast_id
+
+    async def resume_all(self, bot: Bot):
+        for row in await run_db(get_unfinished_broadcasts):
+            logger.info("Продолжаю рассылку #%s с пользователя %s", row[0], row[5])
+            self._spawn(bot, row)
+
+    def _spawn(self, bot, row):
+        task = asyncio.create_task(self._run(bot, _Progress(row)))
+        self._tasks[row[0]] = task
+        task.add_done_callback(lambda t: self._tasks.pop(row[0], None))
+
+    async def _run(self, bot: Bot, prog: _Progress):
+        while True:
+            ids = await run_db(get_user_ids_after, prog.cursor, self.page_size)
+            if not ids:
+                break
+
+            queue = asyncio.Queue()
+            for uid in ids:
+                queue.put_nowait(uid)
+            results = {}
+            senders = [asyncio.create_task(self._sender(bot, prog, queue, results))
+                       for _ in range(min(self.workers, len(ids)))]
+            await asyncio.gather(*senders)
+
+            blocked = [uid for uid, r in results.items() if r == BLOCKED]
+            if blocked:
+                await run_db(mark_users_blocked, blocked)
+            prog.cursor = ids[-1]
+            await run_db(save_broadcast_progress, prog.id, prog.cursor, prog.sent, prog.blocked, prog.failed)
+            await self._report(bot, prog)
+
+        await run_db(save_broadcast_progress, prog.id, prog.cursor, prog.sent, prog.blocked, prog.failed, True)
+        await self._report(bot, prog, finished=True)
+
+    async def _sender(self, bot, prog, queue, results):
+        while not queue.empty():
+            uid = queue.get_nowait()
+            result = await self._send(bot, prog, uid)
+            results[uid] = result
+            if result == SENT:
+                prog.sent += 1
+            elif result == BLOCKED:
+                prog.blocked += 1
+            else:
+                prog.failed += 1
+            await self._report(bot, prog)
+
+    async def _send(self, bot, prog, uid):
+        for attempt in range(5):
+            await self.bucket.acquire()
+            try:
+                await bot.copy_message(chat_id=uid, from_chat_id=prog.from_chat_id, message_id=prog.message_id)
+                return SENT
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return BLOCKED
+                return FAILED
+            except TelegramNetworkError:
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logger.warning("Broadcast to %s failed: %s", uid, e)
+                return FAILED
+        return FAILED
+
+    async def _report(self, bot, prog, finished=False):
+        now = time.monotonic()
+        if not finished and now - prog.last_report < self.report_interval:
+            return
+        prog.last_report = now
+        try:
+            await bot.edit_message_text(prog.text(finished), chat_id=prog.admin_chat_id, message_id=prog.status_message_id)
+        except TelegramRetryAfter as e:
+            self.bucket.pause(e.retry_after)
+        except Exception as e:
+            logger.debug("Broadcast status update failed: %s", e)
@@ -1,13 +1,72 @@
 import os
-import asyncio
-import yt_dlp
-import subprocess
-import random
-import aiohttp
-import re
 import time
-from dataclasses import dataclass
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, replace
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from src.config import conf
+from src.services.scheduler import JobScheduler, PRIORITY_NORMAL
+from src.services.transcoder import Transcoder, TranscodeError
+from src.services.info_cache import InfoCache, preview_fields
+from src.services.http import get_session
+from src.services.uploader import GrowingFile
+from src.services.progress import ProgressReporter, STAGE_QUEUE, STAGE_DOWNLOAD, STAGE_TRANSCODE
+from src.services.storage import StorageManager, remove_file
+from src.services.ytdl import YDLPool
+from src.services.formats import plan_formats
+from src.services.hosts import HostPolicy
+from src.services.metrics import track, platform_of, BYTES, JOBS
+from src.services.probe import probe_media, plan_video, record_decision, audio_decisions, ACTION_SKIP, ACTION_ENCODE, ACTION_AUDIO
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Оценка места под задачу, пока настоящий размер неизвестен
+VIDEO_BYTES_PER_SEC = 1024 * 1024
+AUDIO_BYTES_PER_SEC = 32 * 1024
+DEFAULT_ESTIMATE = 300 * 1024 * 1024
+
+# Форматы аудио: MP3 перекодируется, M4A и Opus обычно отдаются без перекодировки
+# select — формат yt-dlp: сначала дорожка уже в нужном кодеке, тогда её хватит скопировать
+AUDIO_TARGETS = {
+    'mp3': {'codec': 'mp3', 'ext': '.mp3', 'encode': ["-c:a", "libmp3lame", "-q:a", "2"], 'mux': [],
+            'select': 'bestaudio[acodec=mp3]/bestaudio[ext=m4a]/bestaudio/best'},
+    'm4a': {'codec': 'aac', 'ext': '.m4a', 'encode': ["-c:a", "aac", "-b:a", "192k"], 'mux': ["-movflags", "+faststart"],
+            'select': 'bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best'},
+    'opus': {'codec': 'opus', 'ext': '.opus', 'encode': ["-c:a", "libopus", "-b:a", "128k"], 'mux': [],
+             'select': 'bestaudio[acodec=opus]/bestaudio/best'},
+}
+
+# Ссылки-образцы для прогрева YoutubeDL: по одной на каждый набор настроек
+WARM_URLS = ["https://www.youtube.com/", "https://www.instagram.com/", "https://vk.com/"]
+
+# Параметры, которые не влияют на содержимое (метки шаринга и трекинга)
+TRACKING_PARAMS = {"si", "feature", "igsh", "igshid", "_r", "_t", "is_from_webapp", "sender_device", "share_app_id"}
+
+def normalize_url(url: str) -> str:
+    url = url.strip()
+    if "vk.ru" in url: url = url.replace("vk.ru", "vk.com")
+    if "youtube.com/shorts/" in url:
+        video_id = url.split("shorts/")[1].split("?")[0]
+        url = f"https://www.youtube.com/watch?v={video_id}"
+
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS and not k.startswith("utm_")]
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+def download_key(url: str, mode: str, quality: str = None):
+    # Один и тот же файл — одна загрузка: по этому ключу склеиваются одинаковые запросы
+    url = normalize_url(url)
+    if mode == 'audio':
+        quality = quality if quality in AUDIO_TARGETS else 'mp3'
+    return url, mode, quality
+
+def workspace_id(url: str, mode: str, quality: str = None) -> str:
+    # Имена временных файлов зависят только от ключа загрузки, поэтому после
+    # перезапуска yt-dlp находит свои .part и докачивает только недостающее
+    url, mode, quality = download_key(url, mode, quality)
+    return hashlib.sha1(f"{mode}|{quality or ''}|{url}".encode()).hexdigest()[:12]
 
 class DownloadError(Exception):
     pass
@@ -22,215 +81,504 @@ class DownloadedVideo:
     height: int
     thumb_url: str
     file_size: int
+    extractor: str = ""
+    video_id: str = ""
 
-class VideoDownloader:
+logger = logging.getLogger(__name__)
+
+class _InflightJob:
+    # Одна загрузка, к которой могут присоединиться несколько пользователей
     def __init__(self):
+        self.task = None
+        self.callbacks = []
+        self.waiters = 0
+        # Общий для всех ждущих: отсекает лишние события прямо в потоке загрузки
+        self.reporter = ProgressReporter(self.notify, conf.progress_interval)
+
+    def notify(self, stage, value):
+        for cb in list(self.callbacks):
+            try:
+                cb(stage, value)
+            except Exception as e:
+                logger.debug("Progress callback failed: %s", e)
+
+class VideoDownloader:
+    def __init__(self, scheduler: JobScheduler = None, storage: StorageManager = None):
         self.download_path = conf.download_path
-        if not os.path.exists(self.download_path):
-            os.makedirs(self.download_path)
-            
-        self.user_agents = [
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15',
-            'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        ]
+        self.scheduler = scheduler or JobScheduler(conf.network_limit, conf.transcode_limit, conf.upload_limit)
+        self.storage = storage or StorageManager(self.download_path, conf.storage_quota, conf.storage_min_free)
+        self.transcoder = Transcoder(conf.transcode_cores, conf.ffmpeg_threads, conf.ffmpeg_timeout)
+        self.info_cache = InfoCache(conf.info_cache_size, conf.info_cache_ttl)
+        self._inflight = {}
+        self._file_refs = {}
+        self._workspaces = {}
+        self.ydl_pool = YDLPool(max_idle=conf.ydl_pool_size)
+        self.hosts = HostPolicy(conf.host_limits, conf.network_limit, conf.cookies_dir,
+                                breaker_threshold=conf.host_breaker_threshold, backoff=conf.host_backoff,
+                                backoff_max=conf.host_backoff_max, login_cooldown=conf.cookie_cooldown)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def warm(self):
+        # Первый запрос не платит за импорт yt-dlp и создание экстракторов
+        tmpl = os.path.join(self.download_path, "%(id)s.%(ext)s")
+        profiles = [self._get_opts(url, tmpl, mode=mode) for url in WARM_URLS for mode in ('video', 'audio')]
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.ydl_pool.warm, profiles)
+        except Exception as e:
+            logger.warning("Не удалось прогреть YoutubeDL: %s", e)
+            return
+        logger.info("YoutubeDL прогрет за %.2f с (%d наборов настроек)", time.perf_counter() - started, len(profiles))
+
+    def close(self):
+        self.ydl_pool.close()
 
     def _normalize_url(self, url: str) -> str:
-        url = url.strip()
-        if "vk.ru" in url: url = url.replace("vk.ru", "vk.com")
-        if "youtube.com/shorts/" in url:
-            video_id = url.split("shorts/")[1].split("?")[0]
-            url = f"https://www.youtube.com/watch?v={video_id}"
-        return url
+        return normalize_url(url)
 
     async def get_video_info(self, url: str):
         url = self._normalize_url(url)
-        loop = asyncio.get_running_loop()
-        return await asyncio.to_thread(self._get_info_sync, url)
+        cached = self.info_cache.get_preview(url)
+        if cached:
+            return cached
+        try:
+            async with track("info", platform_of(url)), self.hosts.slot(url) as identity:
+                return await asyncio.to_thread(self._get_info_sync, url, identity)
+        except Exception as e:
+            # Без превью ссылку всё равно можно скачать, поэтому ошибку только записываем
+            logger.info("Не удалось получить информацию о %s: %s", url, e)
+            return None
 
-    def _get_info_sync(self, url: str):
-        opts = {
-            'extract_flat': True,
-            'quiet': True,
-            'no_warnings': True,
-            'user_agent': random.choice(self.user_agents),
-            'cookiefile': 'cookies.txt' if os.path.exists('cookies.txt') else None
-        }
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            try:
-                info = ydl.extract_info(url, download=False)
-                thumb = info.get('thumbnail')
-                if not thumb and info.get('thumbnails'):
-                    thumb = info['thumbnails'][-1].get('url')
-                
-                return {
-                    'title': info.get('title', 'Video'),
-                    'thumbnail': thumb,
-                    'duration': info.get('duration')
-                }
-            except:
-                return None
-
-    def _process_audio(self, input_path):
-        base = os.path.basename(input_path)
-        output_path = os.path.join(self.download_path, os.path.splitext(base)[0] + ".mp3")
-        cmd = ["ffmpeg", "-y", "-i", input_path, "-vn", "-acodec", "libmp3lame", "-q:a", "2", output_path]
-        subprocess.run(cmd, capture_output=True)
-        if os.path.exists(input_path):
-            try: os.remove(input_path)
-            except: pass
+    def _get_info_sync(self, url: str, identity=None):
+        # Те же настройки, что и при загрузке, чтобы результат можно было переиспользовать
+        opts = self._get_opts(url, os.path.join(self.download_path, "%(id)s.%(ext)s"), identity=identity)
+        with self.ydl_pool.lease(opts) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+            if info.get('_type', 'video') != 'video':
+                # Перенаправления и плейлисты не кешируем, просто дорабатываем как раньше
+                return preview_fields(ydl.process_ie_result(info, download=False))
+        self.info_cache.put(url, info)
+        return self.info_cache.get_preview(url)
+
+    async def get_format_plan(self, url: str):
+        """План форматов по той же выборке, что и превью; None — если форматы неизвестны."""
+        url = self._normalize_url(url)
+        plan = self.info_cache.get_plan(url)
+        if plan is not None:
+            return plan
+        info = self.info_cache.get_info(url)
+        if info is None:
+            await self.get_video_info(url)
+            info = self.info_cache.get_info(url)
+        if not info or not info.get('formats'):
+            return None
+        plan = plan_formats(info, conf.stream_max_size)
+        self.info_cache.set_plan(url, plan)
+        return plan
+
+    async def _process_audio(self, input_path, duration=None, progress_callback=None, audio_format='mp3'):
+        # Если исходная дорожка уже в нужном кодеке — только меняем контейнер
+        target = AUDIO_TARGETS.get(audio_format, AUDIO_TARGETS['mp3'])
+        probe = await probe_media(input_path)
+        copy = probe is not None and probe.acodec == target['codec']
+
+        directory, name = os.path.split(input_path)
+        base = os.path.splitext(name)[0]
+        output_path = os.path.join(directory, base + target['ext'])
+        if output_path == input_path:
+            output_path = os.path.join(directory, base + "_a" + target['ext'])
+
+        codec_args = ["-c:a", "copy"] if copy else target['encode']
+        args = ["-i", input_path, "-vn", "-map", "0:a:0", *codec_args, *target['mux'], output_path]
+        audio_decisions["copy" if copy else "encode"] += 1
+        try:
+            await self.transcoder.run(args, duration, progress_callback)
+        finally:
+            remove_file(input_path)
         return output_path
 
-    def _process_video(self, input_path, duration, is_insta=False):
+    async def _process_video(self, input_path, duration, is_insta=False, progress_callback=None, on_output=None):
         base = os.path.basename(input_path).replace("raw_", "final_")
         if not base.endswith(".mp4"):
             base = os.path.splitext(base)[0] + ".mp4"
             
-        output_path = os.path.join(self.download_path, base)
+        output_path = os.path.join(os.path.dirname(input_path), base)
         if not os.path.exists(input_path):
             return input_path
 
         file_size = os.path.getsize(input_path)
         MTPROTO_LIMIT = 1980 * 1024 * 1024 
-        
-        # ПРАВКА: Если файл MP4 и под лимитом - просто копируем (быстро и без потери качества)
-        if file_size <= MTPROTO_LIMIT and not is_insta and input_path.endswith(".mp4"):
-            cmd = ["ffmpeg", "-y", "-i", input_path, "-c", "copy", "-map_metadata", "0", "-movflags", "+faststart", output_path]
-        else:
-            # ПРАВКА: Если конвертируем, убираем принудительный scale=720, чтобы сохранить исходное разрешение
-            # Мы используем crf 23 для баланса веса и качества
-            cmd = ["ffmpeg", "-y", "-i", input_path, 
-                   "-c:v", "libx264", "-preset", "ultrafast", "-crf", "23", 
-                   "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", output_path]
+
+        # Смотрим, что внутри, и выбираем самый дешёвый путь
+        plan = plan_video(await probe_media(input_path), input_path, file_size, MTPROTO_LIMIT, is_insta)
+        record_decision(plan, input_path)
+        if plan.action == ACTION_SKIP:
+            return input_path
+
+        # При параллельной отправке перекодированный файл пишем фрагментированным MP4:
+        # он пишется строго последовательно, и готовые части можно отправлять, пока ffmpeg работает
+        growing = None
+        if plan.action in (ACTION_ENCODE, ACTION_AUDIO) and on_output and conf.pipelined_upload:
+            growing = GrowingFile(output_path)
+        mux = (["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-frag_duration", "2000000"]
+               if growing else ["-movflags", "+faststart"])
+        args = [*plan.input_args, "-i", input_path, *plan.output_args, *mux, output_path]
+
+        if growing:
+            await on_output(growing)
 
         try:
-            subprocess.run(cmd, capture_output=True, timeout=900)
-        except Exception as e:
-            print(f"FFmpeg Error: {e}")
+            await self.transcoder.run(args, duration, progress_callback)
+            if growing: growing.finish()
+        except BaseException as e:
+            if growing: growing.fail()
+            if not isinstance(e, TranscodeError):
+                raise
+            logger.warning("FFmpeg Error: %s", e)
+            remove_file(output_path)
             if input_path.endswith(".mp4"):
                 return input_path
             
         if os.path.exists(output_path):
-            if os.path.exists(input_path):
-                try: os.remove(input_path)
-                except: pass
+            # Исходник больше не нужен — освобождаем место, не дожидаясь конца задачи
+            remove_file(input_path)
             return output_path
         return input_path
 
-    def _get_opts(self, url, filename_tmpl, quality=None):
-        if quality:
+    def _get_opts(self, url, filename_tmpl, quality=None, mode='video', format_spec=None, identity=None):
+        if mode == 'audio':
+            # Для аудио качаем только звуковую дорожку, по возможности сразу в выбранном кодеке
+            fmt = AUDIO_TARGETS.get(quality, AUDIO_TARGETS['mp3'])['select']
+        elif quality:
             # ПРАВКА: Более точный выбор формата для YouTube
             fmt = f'bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/best[height<={quality}]/best'
         else:
             fmt = 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080][ext=mp4]/best'
+        if format_spec and mode != 'audio':
+            # Форматы, выбранные планом; общая строка остаётся запасным вариантом
+            fmt = f'{format_spec}/{fmt}'
 
         opts = {
             'format': fmt,
             'outtmpl': filename_tmpl,
             'noplaylist': True,
             'quiet': True,
+            'noprogress': True,
             'no_warnings': True,
             'geo_bypass': True,
             'nocheckcertificate': True,
-            'user_agent': random.choice(self.user_agents),
         }
-        
-        if "instagram.com" in url:
-            cookies_path = os.path.join(os.getcwd(), "cookies.txt")
-            if os.path.exists(cookies_path): opts['cookiefile'] = cookies_path
-        elif "youtube.com" in url or "youtu.be" in url:
+
+        # Cookies и User-Agent выдаёт политика платформы; без неё (прогрев) — первые из пула
+        identity = identity or self.hosts.default_identity(url)
+        if identity.user_agent:
+            opts['user_agent'] = identity.user_agent
+        if identity.cookiefile:
+            opts['cookiefile'] = identity.cookiefile
+        if "youtube.com" in url or "youtu.be" in url:
             opts['extractor_args'] = {'youtube': {'player_client': ['android', 'web']}}
             
         return opts
 
-    async def download(self, url: str, mode: str = 'video', quality: str = None, progress_callback=None) -> DownloadedVideo:
-        url = self._normalize_url(url)
-        unique_id = str(abs(hash(url + str(time.time()))))[:8]
-        temp_path = os.path.join(self.download_path, f"raw_{unique_id}.mp4")
-        loop = asyncio.get_running_loop()
+    async def download(self, url: str, mode: str = 'video', quality: str = None, progress_callback=None,
+                       user_id=None, priority: int = PRIORITY_NORMAL, on_output=None) -> DownloadedVideo:
+        # progress_callback(stage, value) — обычная функция, вызывается в цикле событий
+        # для этапов queue, download и transcode.
+        # on_output(GrowingFile) вызывается, когда итоговый файл начинает записываться,
+        # чтобы отправка в Telegram шла параллельно. Только для того, кто запустил загрузку.
+        # Для аудио quality — это формат: mp3, m4a или opus.
+        key = download_key(url, mode, quality)
+        url, mode, quality = key
 
-        if "tiktok.com" in url and mode != 'audio':
-            try:
-                data = await self._download_tiktok_via_api(url, temp_path)
-                return data
-            except:
-                pass
+        # Одинаковые запросы, пришедшие во время загрузки, ждут уже запущенную задачу
+        job = self._inflight.get(key)
+        if job is None:
+            job = _InflightJob()
+            job.task = asyncio.create_task(self._run_download(url, mode, quality, job.reporter.report, user_id,
+                                                              priority, on_output))
+            job.task.add_done_callback(lambda t: self._finish_job(key, job))
+            self._inflight[key] = job
+
+        job.waiters += 1
+        if progress_callback:
+            job.callbacks.append(progress_callback)
+        try:
+            data = await asyncio.shield(job.task)
+        except asyncio.CancelledError:
+            if job.task.done() and not job.task.cancelled() and job.task.exception() is None:
+                # Задача успела завершиться и уже учла этого получателя
+                self._release_path(job.task.result().path)
+            else:
+                job.waiters -= 1
+            raise
+        finally:
+            if progress_callback in job.callbacks:
+                job.callbacks.remove(progress_callback)
 
-        data = await asyncio.to_thread(self._download_sync, url, temp_path, quality, progress_callback, loop)
+        # Каждый получает свою копию, файл общий
+        return replace(data)
 
+    def _finish_job(self, key, job):
+        if self._inflight.get(key) is job:
+            del self._inflight[key]
+        if job.task.cancelled() or job.task.exception():
+            return
+        path = job.task.result().path
+        self._file_refs[path] = self._file_refs.get(path, 0) + job.waiters
+        if job.waiters <= 0:
+            self._release_path(path, count=0)
+
+    def release(self, video: DownloadedVideo):
+        # Вызывается после отправки: файл удаляется, когда его отпустил последний получатель
+        self._release_path(video.path)
+
+    def _release_path(self, path, count=1):
+        refs = self._file_refs.get(path, 0) - count
+        if refs > 0:
+            self._file_refs[path] = refs
+            return
+        self._file_refs.pop(path, None)
+        workspace = self._workspaces.pop(path, None)
+        if workspace is not None:
+            workspace.close()
+        else:
+            remove_file(path)
+
+    def _estimate_size(self, url: str, mode: str, quality: str = None) -> int:
+        preview = self.info_cache.get_preview(url)
+        duration = (preview or {}).get('duration')
+        if not duration:
+            return DEFAULT_ESTIMATE
         if mode == 'audio':
-            audio_path = self._process_audio(data.path)
-            data.path = audio_path
-            data.file_size = os.path.getsize(audio_path)
-            
+            return int(duration * AUDIO_BYTES_PER_SEC) * 2
+        plan = self.info_cache.get_plan(url)
+        option = plan.pick(quality) if plan else None
+        if option and option.size:
+            return option.size * 2
+        # Исходник и перекодированный файл какое-то время лежат рядом
+        return min(int(duration * VIDEO_BYTES_PER_SEC), conf.stream_max_size) * 2
+
+    async def _run_download(self, url: str, mode: str, quality: str, report,
+                            user_id=None, priority: int = PRIORITY_NORMAL, on_output=None) -> DownloadedVideo:
+        queue_callback = lambda pos: report(STAGE_QUEUE, pos)
+        download_progress = lambda p: report(STAGE_DOWNLOAD, p)
+        transcode_progress = lambda p: report(STAGE_TRANSCODE, f"{p}%")
+        platform = platform_of(url)
+        try:
+            async with track("job", platform):
+                data = await self._run_stages(url, mode, quality, user_id, priority, on_output, platform,
+                                              queue_callback, download_progress, transcode_progress)
+        except asyncio.CancelledError:
+            JOBS.inc(platform=platform, result="cancelled")
+            raise
+        except Exception:
+            JOBS.inc(platform=platform, result="error")
+            raise
+        JOBS.inc(platform=platform, result="ok")
         return data
 
-    def _download_sync(self, url: str, temp_path_raw: str, quality: str = None, progress_callback=None, loop=None) -> DownloadedVideo:
+    async def _run_stages(self, url, mode, quality, user_id, priority, on_output, platform,
+                          queue_callback, download_progress, transcode_progress) -> DownloadedVideo:
+        # Место резервируем до сетевого слота, чтобы не занимать его в ожидании диска
+        workspace = await self.storage.reserve(self._estimate_size(url, mode, quality), workspace_id(url, mode, quality))
+        try:
+            temp_path = workspace.path("raw", ".mp4")
+            # План форматов может сам сходить на платформу, поэтому строим его до того,
+            # как занять место в её лимите (у TikTok выбора качества нет)
+            format_spec = None
+            if mode == 'video' and "tiktok.com" not in url:
+                format_spec = await self._plan_format(url, quality)
+            # Сначала место в лимите платформы, потом общий сетевой слот: пока платформа
+            # занята, задача не держит слот, нужный загрузкам с других сайтов
+            async with self.hosts.slot(url) as identity, \
+                    self.scheduler.slot("network", user_id, priority, queue_callback):
+                data = None
+                if "tiktok.com" in url:
+                    try:
+                        async with track("tiktok_api", platform):
+                            data = await self._download_tiktok_via_api(url, temp_path, download_progress, on_output, mode)
+                    except Exception as e:
+                        logger.info("TikTok API failed, falling back to yt-dlp: %s", e)
+
+                if data is None:
+                    # Если превью уже извлекло метаданные, второй раз extract не делаем
+                    info = self.info_cache.get_info(url)
+                    if mode == 'audio':
+                        temp_path = workspace.path("raw", ".%(ext)s")
+                    async with track("download", platform):
+                        data = await asyncio.to_thread(self._download_sync, url, temp_path, quality, download_progress,
+                                                       info, mode, format_spec, identity)
+            BYTES.inc(data.file_size, direction="download", platform=platform)
+
+            # Файл из API TikTok уже готов к отправке
+            if data.extractor != "tikwm" or mode == 'audio':
+                async with self.scheduler.slot("transcode", user_id, priority, queue_callback):
+                    if mode == 'audio':
+                        async with track("transcode_audio", platform):
+                            data.path = await self._process_audio(data.path, data.duration, transcode_progress, quality)
+                    else:
+                        is_insta = "instagram" in data.extractor.lower()
+                        async with track("transcode_video", platform):
+                            data.path = await self._process_video(data.path, data.duration, is_insta, transcode_progress, on_output)
+
+            data.file_size = os.path.getsize(data.path)
+        except asyncio.CancelledError:
+            workspace.detach()
+            raise
+        except BaseException:
+            workspace.close()
+            raise
+
+        # Итоговый файл живёт до release(), всё остальное удаляем сразу
+        workspace.keep_only(data.path)
+        self._workspaces[data.path] = workspace
+        return data
+
+    async def _plan_format(self, url: str, quality: str):
+        plan = await self.get_format_plan(url)
+        if plan is None:
+            return None
+        if plan.too_big:
+            raise DownloadError("Video is too large for Telegram")
+        option = plan.pick(quality)
+        if option is None:
+            return None
+        if quality and option.quality != int(quality):
+            logger.info("Качество %sp недоступно или не влезает в лимит, беру %sp: %s", quality, option.quality, url)
+        return option.format
+
+    def _download_sync(self, url: str, temp_path_raw: str, quality: str = None, progress_callback=None, info=None,
+                       mode='video', format_spec=None, identity=None) -> DownloadedVideo:
         def ydl_hook(d):
-            if d['status'] == 'downloading' and progress_callback and loop:
-                p = d.get('_percent_str', '0%')
-                clean_p = re.sub(r'\x1b\[[0-9;]*m', '', p).strip()
-                loop.call_soon_threadsafe(
-                    lambda: asyncio.create_task(progress_callback(clean_p))
-                )
+            # Вызывается из потока загрузки; отсечка частоты — внутри progress_callback
+            if d['status'] == 'downloading' and progress_callback:
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                done = d.get('downloaded_bytes') or 0
+                if total:
+                    progress_callback(f"{int(done * 100 / total)}%")
+                else:
+                    progress_callback(f"{done // (1024 * 1024)} MB")
 
-        opts = self._get_opts(url, temp_path_raw, quality)
-        opts['progress_hooks'] = [ydl_hook]
+        opts = self._get_opts(url, temp_path_raw, quality, mode, format_spec, identity)
 
-        with yt_dlp.YoutubeDL(opts) as ydl:
+        with self.ydl_pool.lease(opts, ydl_hook) as ydl:
             try:
-                info = ydl.extract_info(url, download=True)
+                if info:
+                    info = ydl.process_ie_result(info, download=True)
+                else:
+                    info = ydl.extract_info(url, download=True)
             except Exception as e:
+                # Ссылки из кеша могли протухнуть — следующая попытка извлечёт заново
+                self.info_cache.discard(url)
                 raise DownloadError(f"Download failed: {str(e)}")
                 
             downloaded_path = ydl.prepare_filename(info)
             
             if not os.path.exists(downloaded_path):
                 base_no_ext = os.path.splitext(downloaded_path)[0]
-                for ext in [".mp4", ".mkv", ".webm"]:
+                for ext in [".mp4", ".mkv", ".webm", ".m4a", ".opus"]:
                     if os.path.exists(base_no_ext + ext):
                         downloaded_path = base_no_ext + ext
                         break
 
             duration = info.get("duration", 0)
-            is_insta = "instagram" in (info.get("extractor", "") or "").lower()
-            
-            final_path = self._process_video(downloaded_path, duration, is_insta=is_insta)
 
             return DownloadedVideo(
-                path=final_path, 
+                path=downloaded_path, 
                 title=info.get("title", "Video"),
                 duration=int(duration or 0), 
                 author=info.get("uploader", "Unknown"),
                 width=info.get("width", 0), 
                 height=info.get("height", 0),
                 thumb_url=info.get("thumbnail", ""), 
-                file_size=os.path.getsize(final_path)
+                file_size=os.path.getsize(downloaded_path),
+                extractor=info.get("extractor", "") or "",
+                video_id=str(info.get("id") or "")
             )
 
-    async def _download_tiktok_via_api(self, url: str, temp_path: str) -> DownloadedVideo:
-        api_url = "https://www.tikwm.com/api/"
-        async with aiohttp.ClientSession() as session:
-            async with session.post(api_url, data={'url': url}) as response:
-                res = await response.json()
-                if res.get('code') != 0:
-                    raise DownloadError(f"TikTok API Error: {res.get('msg')}")
-                
-                data = res['data']
-                video_url = data.get('play')
-                
-                async with session.get(video_url) as video_res:
-                    with open(temp_path, 'wb') as f:
-                        f.write(await video_res.read())
-                        
-                duration = data.get('duration', 0)
-                return DownloadedVideo(
-                    path=temp_path, 
-                    title=data.get('title', 'TikTok Video'),
-                    duration=int(duration), 
-                    author=data.get('author', {}).get('nickname', 'TikTok User'),
-                    width=data.get('width', 0), 
-                    height=data.get('height', 0),
-                    thumb_url=data.get('cover', ''), 
-                    file_size=os.path.getsize(temp_path)
-                )
+    async def _download_tiktok_via_api(self, url: str, temp_path: str, progress_callback=None, on_output=None, mode='video') -> DownloadedVideo:
+        session = get_session()
+        async with session.post(conf.tikwm_api_url, data={'url': url}) as response:
+            res = await response.json()
+            if res.get('code') != 0:
+                raise DownloadError(f"TikTok API Error: {res.get('msg')}")
+
+        data = res['data']
+        if mode == 'audio':
+            # API отдаёт звуковую дорожку отдельной ссылкой — видео не нужно вовсе
+            music_url = data.get('music') or (data.get('music_info') or {}).get('play')
+            if not music_url:
+                raise DownloadError("TikTok API: no music url")
+            temp_path = os.path.splitext(temp_path)[0] + ".mp3"
+            await self._stream_to_file(music_url, temp_path, progress_callback)
+            return DownloadedVideo(
+                path=temp_path,
+                title=data.get('title', 'TikTok Audio'),
+                duration=int((data.get('music_info') or {}).get('duration') or data.get('duration', 0)),
+                author=data.get('author', {}).get('nickname', 'TikTok User'),
+                width=0,
+                height=0,
+                thumb_url=data.get('cover', ''),
+                file_size=os.path.getsize(temp_path),
+                extractor="tikwm",
+                video_id=str(data.get('id') or '')
+            )
+
+        video_url = data.get('play')
+        # Файл из API не перекодируется, поэтому отправлять его можно прямо во время загрузки
+        growing = GrowingFile(temp_path) if on_output and conf.pipelined_upload else None
+        if growing:
+            await on_output(growing)
+        try:
+            await self._stream_to_file(video_url, temp_path, progress_callback)
+        except BaseException:
+            if growing: growing.fail()
+            raise
+        if growing: growing.finish()
+
+        duration = data.get('duration', 0)
+        return DownloadedVideo(
+            path=temp_path, 
+            title=data.get('title', 'TikTok Video'),
+            duration=int(duration), 
+            author=data.get('author', {}).get('nickname', 'TikTok User'),
+            width=data.get('width', 0), 
+            height=data.get('height', 0),
+            thumb_url=data.get('cover', ''), 
+            file_size=os.path.getsize(temp_path),
+            extractor="tikwm",
+            video_id=str(data.get('id') or '')
+        )
+
+    async def _stream_to_file(self, file_url: str, path: str, progress_callback=None):
+        # Пишем кусками, запись на диск уводим из цикла событий
+        max_size = conf.stream_max_size
+        async with get_session().get(file_url) as resp:
+            resp.raise_for_status()
+            total = resp.content_length
+            if total and total > max_size:
+                raise DownloadError(f"File is too large: {total} bytes")
+
+            done = 0
+            last_p = -1
+            f = await asyncio.to_thread(open, path, 'wb')
+            try:
+                async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    done += len(chunk)
+                    if done > max_size:
+                        raise DownloadError(f"File is too large: over {max_size} bytes")
+                    await asyncio.to_thread(f.write, chunk)
+
+                    if progress_callback:
+                        p = int(done * 100 / total) if total else done // (1024 * 1024)
+                        if p != last_p:
+                            last_p = p
+                            progress_callback(f"{p}%" if total else f"{p} MB")
+            except BaseException:
+                await asyncio.to_thread(f.close)
+                remove_file(path)
+                raise
+            await asyncio.to_thread(f.close)
@@ -0,0 +1,53 @@
+import time
+import logging
+from dataclasses import dataclass
+from telethon.tl.types import InputDocument, MessageMediaDocument
+
+from src.db import run_db, get_cached_file, save_cached_file, delete_cached_file, evict_cached_files
+from src.services.downloader import normalize_url
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedMedia:
+    media: InputDocument
+    title: str
+
+
+class FileCache:
+    """Кеш уже загруженных в Telegram файлов: (URL, режим, качество) -> документ."""
+
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @staticmethod
+    def make_key(url: str, mode: str, quality: str = None) -> str:
+        return f"{mode}:{quality or ''}:{normalize_url(url)}"
+
+    async def get(self, key: str):
+        row = await run_db(get_cached_file, key, int(time.time()) - self.ttl)
+        if not row:
+            return None
+        media_id, access_hash, file_reference, title = row
+        return CachedMedia(
+            media=InputDocument(id=media_id, access_hash=access_hash, file_reference=file_reference or b""),
+            title=title
+        )
+
+    async def put(self, key: str, message, title: str):
+        media = getattr(message, "media", None)
+        if not isinstance(media, MessageMediaDocument) or not media.document:
+            return
+        doc = media.document
+        await self.put_document(key, doc.id, doc.access_hash, doc.file_reference, title)
+
+    async def put_document(self, key: str, media_id: int, access_hash: int, file_reference: bytes, title: str):
+        # Воркеры присылают готовый документ без сообщения, поэтому запись возможна и по полям
+        await run_db(save_cached_file, key, media_id, access_hash, file_reference, title)
+        await run_db(evict_cached_files, int(time.time()) - self.ttl, self.max_entries)
+
+    async def invalidate(self, key: str):
+        logger.info("Удаляю устаревшую запись кеша: %s", key)
+        await run_db(delete_cached_file, key)
@@ -0,0 +1,99 @@
+import logging
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+# Выше 1080p бот не качает: дальше только рост размера и времени обработки
+MAX_HEIGHT = 1080
+MIN_HEIGHT = 144
+
+
+@dataclass
+class FormatOption:
+    quality: int  # Короткая сторона кадра: 720 для 1280x720 и для вертикального 720x1280
+    format: str  # Конкретные format_id для yt-dlp, например "136+140"
+    size: int  # Оценка итогового размера в байтах, 0 — неизвестно
+    exact: bool  # Размер из filesize, а не оценка по битрейту
+
+
+@dataclass
+class FormatPlan:
+    """Что реально можно скачать по ссылке и сколько это будет весить.
+
+    В ``options`` только варианты, которые влезают в лимит доставки,
+    от лучшего к худшему. ``too_big`` — видео есть, но ни один вариант не влезает.
+    """
+    duration: float
+    options: list = field(default_factory=list)
+    too_big: bool = False
+
+    def pick(self, quality=None):
+        # Запрошенное качество или ближайшее меньшее, если оно не влезло или его нет
+        limit = int(quality) if quality else MAX_HEIGHT
+        for option in self.options:
+            if option.quality <= limit:
+                return option
+        return self.options[-1] if self.options else None
+
+
+def _short_side(f):
+    height = f.get('height')
+    width = f.get('width')
+    return min(height, width) if height and width else height
+
+
+def _size(f, duration):
+    size = f.get('filesize')
+    if size:
+        return size, True
+    size = f.get('filesize_approx')
+    if size:
+        return size, False
+    # tbr — килобиты в секунду
+    if f.get('tbr') and duration:
+        return int(f['tbr'] * 1000 / 8 * duration), False
+    return 0, False
+
+
+def _rank(f, preferred_ext):
+    # Тот же порядок предпочтений, что и в строке формата загрузчика: сначала нужный контейнер
+    return (f.get('ext') == preferred_ext, f.get('tbr') or 0, f.get('filesize') or f.get('filesize_approx') or 0)
+
+
+def plan_formats(info: dict, limit: int, max_height: int = MAX_HEIGHT) -> FormatPlan:
+    """Строит план по уже извлечённому ``info`` (достаточно ``process=False``), без новых запросов."""
+    duration = info.get('duration') or 0
+    formats = [f for f in info.get('formats') or [] if f.get('format_id') and f.get('protocol') != 'mhtml']
+
+    audio = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+    best_audio = max(audio, key=lambda f: _rank(f, 'm4a')) if audio else None
+
+    candidates = {}
+    for f in formats:
+        quality = _short_side(f)
+        if not quality or quality < MIN_HEIGHT or quality > max_height or f.get('vcodec') == 'none':
+            continue
+        video_only = f.get('acodec') == 'none'
+        if video_only and best_audio is None:
+            continue
+        size, exact = _size(f, duration)
+        if video_only:
+            audio_size, audio_exact = _size(best_audio, duration)
+            size = size + audio_size if size and audio_size else 0
+            exact = exact and audio_exact
+            spec = f"{f['format_id']}+{best_audio['format_id']}"
+        else:
+            spec = f['format_id']
+        option = FormatOption(quality, spec, size, exact)
+        current = candidates.get(quality)
+        if current is None or _rank(f, 'mp4') > current[0]:
+            candidates[quality] = (_rank(f, 'mp4'), option)
+
+    plan = FormatPlan(duration)
+    for quality in sorted(candidates, reverse=True):
+        option = candidates[quality][1]
+        if option.size and option.size > limit:
+            continue
+        plan.options.append(option)
+    plan.too_big = bool(candidates) and not plan.options
+    return plan
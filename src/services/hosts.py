@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from src.services.metrics import platform_of, THROTTLED
+
+logger = logging.getLogger(__name__)
+
+FAILURE_RATE_LIMIT = "rate_limit"
+FAILURE_LOGIN = "login"
+
+# Признаки в тексте ошибок yt-dlp и API. Стена входа проверяется первой:
+# Instagram пишет «rate-limit reached or login required», и помогают там свежие cookies
+LOGIN_MARKERS = ("login required", "login_required", "sign in to confirm", "use --cookies",
+                 "cookies-from-browser", "log in to", "not a bot")
+RATE_LIMIT_MARKERS = ("too many requests", "rate-limit", "rate limit", "api limit", "try again later",
+                      "please wait a few minutes")
+# Код 429 считается только рядом со словами про HTTP: голые цифры бывают в id и размерах
+RATE_LIMIT_STATUS_RE = re.compile(r"\b(?:error|status(?: code)?|response code)\W{0,3}429\b"
+                                  r"|\b429\W{0,3}(?:client error|too many)")
+
+DEFAULT_USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+)
+
+
+class HostUnavailable(Exception):
+    """Платформа сейчас ограничивает запросы, и бот временно не ходит к ней."""
+
+    def __init__(self, platform: str, retry_in: float):
+        super().__init__(f"{platform} is rate limiting, retry in {int(retry_in)} s")
+        self.platform = platform
+        self.retry_in = retry_in
+
+
+def classify(error: BaseException):
+    """FAILURE_LOGIN, FAILURE_RATE_LIMIT или None, если ошибка не про ограничения платформы."""
+    if getattr(error, "status", None) == 429:
+        return FAILURE_RATE_LIMIT
+    text = str(error).lower()
+    if any(m in text for m in LOGIN_MARKERS):
+        return FAILURE_LOGIN
+    if any(m in text for m in RATE_LIMIT_MARKERS) or RATE_LIMIT_STATUS_RE.search(text):
+        return FAILURE_RATE_LIMIT
+    return None
+
+
+class _Credential:
+    # Файл cookies или User-Agent; после отказа платформы какое-то время не используется
+    def __init__(self, value):
+        self.value = value
+        self.uses = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+
+class _CredentialPool:
+    def __init__(self, values):
+        self.items = [_Credential(v) for v in values]
+
+    def pick(self, now):
+        if not self.items:
+            return None
+        ready = [c for c in self.items if c.cooldown_until <= now]
+        if ready:
+            # Среди здоровых — наименее нагруженный, чтобы запросы расходились по всему пулу
+            credential = min(ready, key=lambda c: (c.failures, c.uses))
+        else:
+            # Все на паузе — берём тот, что освободится раньше
+            credential = min(self.items, key=lambda c: c.cooldown_until)
+        credential.uses += 1
+        return credential
+
+    def first(self):
+        return self.items[0].value if self.items else None
+
+
+@dataclass
+class Identity:
+    cookiefile: str
+    user_agent: str
+    _cookie: _Credential = None
+    _agent: _Credential = None
+
+
+class _Host:
+    def __init__(self, name, cap, cookies, user_agents):
+        self.name = name
+        self.cap = max(1, cap)
+        self.limit = self.cap  # Текущий лимит: сжимается при 429 и постепенно растёт обратно
+        self.active = 0
+        self.waiters = deque()
+        self.successes = 0
+        self.failures = 0  # Отказы подряд
+        self.trips = 0  # Сколько раз подряд размыкался предохранитель
+        self.open_until = 0.0
+        self.probing = False
+        self.cookies = _CredentialPool(cookies)
+        self.user_agents = _CredentialPool(user_agents)
+
+    def check_open(self, now):
+        # Разомкнут: ждём окончания паузы; после неё пропускаем один пробный запрос
+        return bool(self.open_until) and (now < self.open_until or self.probing)
+
+
+class HostPolicy:
+    """Правила обращения к платформам: сколько запросов одновременно, чьими cookies и когда остановиться.
+
+    У каждой платформы свой лимит одновременных запросов. На 429 лимит
+    уменьшается вдвое и растёт обратно по одному после серии удачных запросов.
+    После ``breaker_threshold`` отказов подряд платформа закрывается на паузу
+    (удваивается с каждым разом до ``backoff_max``): новые задачи сразу получают
+    HostUnavailable, а не ждут заведомо неудачной загрузки. Файлы cookies и
+    User-Agent чередуются; получивший отказ отдыхает, остальные продолжают работать.
+    """
+
+    def __init__(self, limits: dict, default_limit: int, cookies_dir: str = None, user_agents=DEFAULT_USER_AGENTS,
+                 breaker_threshold: int = 3, backoff: float = 30, backoff_max: float = 900,
+                 login_cooldown: float = 1800):
+        self.limits = limits
+        self.default_limit = default_limit
+        self.cookies_dir = cookies_dir
+        self.user_agents = tuple(user_agents)
+        self.breaker_threshold = max(1, breaker_threshold)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.login_cooldown = login_cooldown
+        self._hosts = {}
+
+    def _cookie_files(self, platform):
+        files = []
+        if platform == "instagram":
+            # Прежнее место cookies для Instagram продолжает работать
+            legacy = os.path.join(os.getcwd(), "cookies.txt")
+            if os.path.exists(legacy):
+                files.append(legacy)
+        if self.cookies_dir and os.path.isdir(self.cookies_dir):
+            # cookies/instagram.txt, cookies/instagram_2.txt, cookies/youtube.txt ...
+            for name in sorted(os.listdir(self.cookies_dir)):
+                if name.startswith(platform) and name.endswith(".txt"):
+                    files.append(os.path.join(self.cookies_dir, name))
+        return files
+
+    def _host(self, platform) -> _Host:
+        host = self._hosts.get(platform)
+        if host is None:
+            host = _Host(platform, self.limits.get(platform, self.default_limit),
+                         self._cookie_files(platform), self.user_agents)
+            self._hosts[platform] = host
+        return host
+
+    def default_identity(self, url: str) -> Identity:
+        # Без учёта использования: для прогрева и запросов вне slot()
+        host = self._host(platform_of(url))
+        return Identity(host.cookies.first(), host.user_agents.first())
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        """Место в лимите платформы и Identity для запроса; исход запроса учитывается автоматически."""
+        host = self._host(platform_of(url))
+        probe = await self._acquire(host)
+        now = time.monotonic()
+        cookie = host.cookies.pick(now)
+        agent = host.user_agents.pick(now)
+        identity = Identity(cookie and cookie.value, agent and agent.value, cookie, agent)
+        try:
+            yield identity
+        except asyncio.CancelledError:
+            if probe:
+                host.probing = False
+            raise
+        except Exception as e:
+            self._on_failure(host, identity, e)
+            raise
+        else:
+            self._on_success(host, identity)
+        finally:
+            host.active -= 1
+            self._wake(host)
+
+    async def _acquire(self, host: _Host) -> bool:
+        # Возвращает True, если этот запрос — пробный после паузы
+        now = time.monotonic()
+        if host.check_open(now):
+            raise HostUnavailable(host.name, max(host.open_until - now, 1))
+        if host.active < host.limit and not host.waiters:
+            host.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            host.waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    host.active -= 1
+                    self._wake(host)
+                else:
+                    host.waiters.remove(future)
+                raise
+        if not host.open_until:
+            return False
+        # Пробный запрос назначается только получившему место: иначе отменённый в очереди
+        # оставил бы флаг навсегда, и платформа не открылась бы до перезапуска
+        now = time.monotonic()
+        if host.check_open(now):
+            # Пока ждали, платформа закрылась или пробный запрос уже идёт
+            host.active -= 1
+            self._wake(host)
+            raise HostUnavailable(host.name, max(host.open_until - now, 1))
+        host.probing = True
+        return True
+
+    def _wake(self, host: _Host):
+        while host.waiters and host.active < host.limit:
+            future = host.waiters.popleft()
+            if future.done():
+                continue
+            host.active += 1
+            future.set_result(None)
+
+    def _on_success(self, host: _Host, identity: Identity):
+        if identity._cookie:
+            identity._cookie.failures = 0
+        if identity._agent:
+            identity._agent.failures = 0
+        host.failures = 0
+        if host.open_until:
+            logger.info("%s снова отвечает, продолжаю загрузки", host.name)
+            host.open_until = 0.0
+            host.trips = 0
+            host.probing = False
+        host.successes += 1
+        if host.limit < host.cap and host.successes >= host.limit:
+            host.limit += 1
+            host.successes = 0
+            self._wake(host)
+
+    def _on_failure(self, host: _Host, identity: Identity, error: Exception):
+        kind = classify(error)
+        if kind is None:
+            # Обычная ошибка (удалённое видео и т.п.) ничего не говорит о лимитах
+            if host.probing:
+                self._on_success(host, identity)
+            return
+        THROTTLED.inc(platform=host.name, kind=kind)
+        now = time.monotonic()
+        if kind == FAILURE_LOGIN and identity._cookie:
+            # Cookies, скорее всего, разлогинены — надолго убираем их из ротации
+            identity._cookie.failures += 1
+            identity._cookie.cooldown_until = now + self.login_cooldown
+            logger.warning("%s: стена входа с %s, файл отложен на %d с",
+                           host.name, os.path.basename(identity.cookiefile), self.login_cooldown)
+        pause = min(self.backoff * 2 ** host.failures, self.backoff_max)
+        for credential in (identity._cookie, identity._agent):
+            if credential and kind == FAILURE_RATE_LIMIT:
+                credential.failures += 1
+                credential.cooldown_until = max(credential.cooldown_until, now + pause)
+        if kind == FAILURE_RATE_LIMIT and host.limit > 1:
+            host.limit = max(1, host.limit // 2)
+            logger.warning("%s ограничивает запросы, одновременно теперь не больше %d", host.name, host.limit)
+        host.successes = 0
+        host.failures += 1
+        if host.probing or host.failures >= self.breaker_threshold:
+            host.probing = False
+            pause = min(self.backoff * 2 ** host.trips, self.backoff_max) * random.uniform(0.8, 1.2)
+            host.trips += 1
+            host.open_until = now + pause
+            logger.warning("%s: %d отказов подряд, пауза %.0f с", host.name, host.failures, pause)
+
+    def limits_snapshot(self) -> dict:
+        return {name: host.limit for name, host in self._hosts.items()}
+
+    def open_snapshot(self) -> dict:
+        now = time.monotonic()
+        return {name: int(host.open_until > now) for name, host in self._hosts.items()}
+
+    def health(self) -> dict:
+        """Состояние платформ, которые уже использовались: лимит, пауза и отдыхающие cookies."""
+        now = time.monotonic()
+        return {
+            name: {
+                "limit": host.limit,
+                "cap": host.cap,
+                "active": host.active,
+                "waiting": len(host.waiters),
+                "open_for": max(0, int(host.open_until - now)),
+                "cookies": len(host.cookies.items),
+                "cookies_resting": sum(c.cooldown_until > now for c in host.cookies.items),
+            }
+            for name, host in self._hosts.items()
+        }
@@ -0,0 +1,26 @@
+import aiohttp
+from src.config import conf
+
+# Одна сессия на процесс: keep-alive соединения и DNS-кеш переиспользуются между запросами
+_session = None
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=conf.http_pool_size,
+            limit_per_host=conf.http_pool_per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=60
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=60)
+        )
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,86 @@
+import copy
+import time
+from collections import OrderedDict
+
+# Поля, которые не нужны ни превью, ни загрузке, но занимают много памяти
+HEAVY_FIELDS = (
+    "description", "subtitles", "automatic_captions", "heatmap", "chapters",
+    "tags", "categories", "comments", "thumbnails", "_old_archive_ids",
+)
+FORMAT_HEAVY_FIELDS = ("__working",)
+
+
+def preview_fields(info: dict) -> dict:
+    thumb = info.get('thumbnail')
+    if not thumb and info.get('thumbnails'):
+        thumb = info['thumbnails'][-1].get('url')
+    return {
+        'id': info.get('id'),
+        'title': info.get('title', 'Video'),
+        'thumbnail': thumb,
+        'duration': info.get('duration'),
+    }
+
+
+def trim_info(info: dict) -> dict:
+    # Для process_ie_result оставляем всё, что касается форматов, остальное выбрасываем
+    trimmed = {k: v for k, v in info.items() if k not in HEAVY_FIELDS and not callable(v)}
+    formats = []
+    for f in info.get('formats') or []:
+        if f.get('format_note') == 'storyboard' or f.get('ext') == 'mhtml':
+            continue
+        formats.append({k: v for k, v in f.items() if k not in FORMAT_HEAVY_FIELDS})
+    if formats:
+        trimmed['formats'] = formats
+    return trimmed
+
+
+class InfoCache:
+    """LRU-кеш результатов yt-dlp с ограничением по времени жизни.
+
+    Ссылки на форматы у YouTube и Instagram живут ограниченное время,
+    поэтому TTL должен быть заметно меньше их срока действия.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items = OrderedDict()
+
+    def _lookup(self, url: str):
+        item = self._items.get(url)
+        if item is None:
+            return None
+        if time.monotonic() - item[0] > self.ttl:
+            del self._items[url]
+            return None
+        self._items.move_to_end(url)
+        return item
+
+    def get_preview(self, url: str):
+        item = self._lookup(url)
+        return dict(item[1]) if item else None
+
+    def get_info(self, url: str):
+        # yt-dlp дописывает поля в словарь при обработке, поэтому отдаём копию
+        item = self._lookup(url)
+        return copy.deepcopy(item[2]) if item else None
+
+    def get_plan(self, url: str):
+        item = self._lookup(url)
+        return item[3] if item else None
+
+    def set_plan(self, url: str, plan):
+        # План форматов живёт ровно столько же, сколько извлечённые ссылки, из которых он построен
+        item = self._items.get(url)
+        if item is not None:
+            item[3] = plan
+
+    def put(self, url: str, info: dict):
+        self._items[url] = [time.monotonic(), preview_fields(info), trim_info(info), None]
+        self._items.move_to_end(url)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def discard(self, url: str):
+        self._items.pop(url, None)
@@ -0,0 +1,262 @@
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+from src.db import (
+    run_db, enqueue_job, claim_job, extend_job_lease, complete_job, fail_job,
+    take_job_results, count_jobs_by_state
+)
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = (0, 1, 2)
+
+
+@dataclass
+class ClaimedJob:
+    id: str
+    payload: dict
+    attempts: int
+
+
+@dataclass
+class JobResult:
+    id: str
+    payload: dict
+    result: dict
+
+
+class JobStore(ABC):
+    """Очередь задач на загрузку между ботом и воркерами.
+
+    Взятая задача принадлежит воркеру, пока он продлевает аренду (``extend``).
+    Если воркер пропал и аренда истекла, задачу забирает другой воркер;
+    после ``max_attempts`` попыток задача считается проваленной.
+    """
+
+    @abstractmethod
+    async def enqueue(self, payload: dict, priority: int) -> str:
+        ...
+
+    @abstractmethod
+    async def claim(self, worker_id: str, lease_seconds: int):
+        ...
+
+    @abstractmethod
+    async def extend(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        ...
+
+    @abstractmethod
+    async def complete(self, job_id: str, worker_id: str, result: dict) -> bool:
+        ...
+
+    @abstractmethod
+    async def fail(self, job_id: str, worker_id: str, error: str, retry_delay: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def take_results(self, limit: int = 100):
+        ...
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        ...
+
+    async def close(self):
+        pass
+
+
+class SQLiteJobStore(JobStore):
+    """Очередь в общей базе SQLite — для бота и воркеров на одной машине."""
+
+    def __init__(self, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+
+    async def enqueue(self, payload, priority):
+        job_id = await run_db(enqueue_job, json.dumps(payload), priority, self.max_attempts)
+        return str(job_id)
+
+    async def claim(self, worker_id, lease_seconds):
+        row = await run_db(claim_job, worker_id, lease_seconds)
+        if row is None:
+            return None
+        return ClaimedJob(str(row[0]), json.loads(row[1]), row[2])
+
+    async def extend(self, job_id, worker_id, lease_seconds):
+        return await run_db(extend_job_lease, int(job_id), worker_id, lease_seconds)
+
+    async def complete(self, job_id, worker_id, result):
+        return await run_db(complete_job, int(job_id), worker_id, json.dumps(result))
+
+    async def fail(self, job_id, worker_id, error, retry_delay):
+        return await run_db(fail_job, int(job_id), worker_id, error, retry_delay)
+
+    async def take_results(self, limit=100):
+        rows = await run_db(take_job_results, limit)
+        return [JobResult(str(r[0]), json.loads(r[1]), json.loads(r[2] or "{}")) for r in rows]
+
+    async def stats(self):
+        return await run_db(count_jobs_by_state)
+
+
+class RedisJobStore(JobStore):
+    """Очередь в Redis (или совместимом сервере) — для воркеров на разных машинах.
+
+    Ключи:
+      <prefix>:queue:<priority>  — списки ожидающих задач
+      <prefix>:processing        — задачи в работе
+      <prefix>:leases            — ZSET id -> время окончания аренды
+      <prefix>:delayed           — ZSET id -> время повторной попытки
+      <prefix>:results           — готовые задачи для бота
+      <prefix>:job:<id>          — HASH с данными задачи
+    Используются только простые команды, без Lua, поэтому подходит любой совместимый сервер.
+    """
+
+    def __init__(self, client, prefix: str = "sdbot", max_attempts: int = 3, result_ttl: int = 24 * 3600):
+        self.r = client
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("Для JOB_QUEUE=redis установите пакет redis: pip install redis")
+        return cls(redis.from_url(url, decode_responses=True), **kwargs)
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + tuple(str(p) for p in parts))
+
+    async def enqueue(self, payload, priority):
+        job_id = str(await self.r.incr(self._key("seq")))
+        await self.r.hset(self._key("job", job_id), mapping={
+            "payload": json.dumps(payload), "priority": priority, "attempts": 0,
+            "state": "queued", "created": time.time(),
+        })
+        await self.r.lpush(self._key("queue", priority), job_id)
+        return job_id
+
+    async def claim(self, worker_id, lease_seconds):
+        now = time.time()
+        await self._promote_delayed(now)
+        await self._requeue_expired(now, lease_seconds)
+
+        job_id = None
+        for priority in PRIORITIES:
+            job_id = await self.r.lmove(self._key("queue", priority), self._key("processing"), "RIGHT", "LEFT")
+            if job_id:
+                break
+        if not job_id:
+            return None
+
+        key = self._key("job", job_id)
+        await self.r.zadd(self._key("leases"), {job_id: now + lease_seconds})
+        attempts = await self.r.hincrby(key, "attempts", 1)
+        await self.r.hset(key, mapping={"state": "running", "worker": worker_id})
+        payload = await self.r.hget(key, "payload")
+        if payload is None:
+            # Данные задачи пропали (например, истёк TTL) — выбрасываем
+            await self._forget_running(job_id)
+            return None
+        return ClaimedJob(job_id, json.loads(payload), attempts)
+
+    async def extend(self, job_id, worker_id, lease_seconds):
+        if await self.r.hget(self._key("job", job_id), "worker") != worker_id:
+            return False
+        changed = await self.r.zadd(self._key("leases"), {job_id: time.time() + lease_seconds}, xx=True, ch=True)
+        return bool(changed) or await self.r.zscore(self._key("leases"), job_id) is not None
+
+    async def complete(self, job_id, worker_id, result):
+        key = self._key("job", job_id)
+        if await self.r.hget(key, "worker") != worker_id:
+            return False
+        await self._forget_running(job_id)
+        await self.r.hset(key, mapping={"state": "done", "result": json.dumps(result)})
+        await self.r.expire(key, self.result_ttl)
+        await self.r.lpush(self._key("results"), job_id)
+        return True
+
+    async def fail(self, job_id, worker_id, error, retry_delay):
+        key = self._key("job", job_id)
+        data = await self.r.hgetall(key)
+        if data.get("worker") != worker_id:
+            return False
+        await self._forget_running(job_id)
+        attempts = int(data.get("attempts", 0))
+        if attempts < self.max_attempts:
+            await self.r.hset(key, mapping={"state": "queued", "error": error, "worker": ""})
+            await self.r.zadd(self._key("delayed"), {job_id: time.time() + retry_delay * attempts})
+            return True
+        await self.r.hset(key, mapping={"state": "failed", "error": error, "worker": ""})
+        await self.r.expire(key, self.result_ttl)
+        return False
+
+    async def take_results(self, limit=100):
+        results = []
+        for _ in range(limit):
+            job_id = await self.r.rpop(self._key("results"))
+            if not job_id:
+                break
+            key = self._key("job", job_id)
+            data = await self.r.hgetall(key)
+            await self.r.delete(key)
+            if data:
+                results.append(JobResult(job_id, json.loads(data["payload"]), json.loads(data.get("result") or "{}")))
+        return results
+
+    async def stats(self):
+        queued = 0
+        for priority in PRIORITIES:
+            queued += await self.r.llen(self._key("queue", priority))
+        return {
+            "queued": queued + await self.r.zcard(self._key("delayed")),
+            "running": await self.r.llen(self._key("processing")),
+            "done": await self.r.llen(self._key("results")),
+        }
+
+    async def close(self):
+        await self.r.aclose() if hasattr(self.r, "aclose") else await self.r.close()
+
+    async def _forget_running(self, job_id):
+        await self.r.lrem(self._key("processing"), 1, job_id)
+        await self.r.zrem(self._key("leases"), job_id)
+
+    async def _promote_delayed(self, now):
+        for job_id in await self.r.zrangebyscore(self._key("delayed"), 0, now):
+            # Кто первым удалил из delayed, тот и возвращает в очередь
+            if await self.r.zrem(self._key("delayed"), job_id):
+                priority = await self.r.hget(self._key("job", job_id), "priority") or PRIORITIES[-1]
+                await self.r.lpush(self._key("queue", priority), job_id)
+
+    async def _requeue_expired(self, now, lease_seconds):
+        # Задача могла попасть в processing, а воркер упал до записи аренды — даём ей аренду сейчас
+        for job_id in await self.r.lrange(self._key("processing"), 0, -1):
+            if await self.r.zscore(self._key("leases"), job_id) is None:
+                await self.r.zadd(self._key("leases"), {job_id: now + lease_seconds}, nx=True)
+
+        for job_id in await self.r.zrangebyscore(self._key("leases"), 0, now):
+            if not await self.r.zrem(self._key("leases"), job_id):
+                continue
+            if not await self.r.lrem(self._key("processing"), 1, job_id):
+                continue
+            key = self._key("job", job_id)
+            data = await self.r.hgetall(key)
+            logger.warning("Аренда задачи %s истекла (воркер %s)", job_id, data.get("worker"))
+            if int(data.get("attempts", 0)) >= self.max_attempts:
+                await self.r.hset(key, mapping={"state": "failed", "error": "lease expired", "worker": ""})
+                await self.r.expire(key, self.result_ttl)
+            else:
+                await self.r.hset(key, mapping={"state": "queued", "worker": ""})
+                await self.r.lpush(self._key("queue", data.get("priority", PRIORITIES[-1])), job_id)
+
+
+def make_store(conf):
+    if conf.job_queue == "sqlite":
+        return SQLiteJobStore(max_attempts=conf.job_max_attempts)
+    if conf.job_queue == "redis":
+        return RedisJobStore.from_url(conf.redis_url, prefix=conf.redis_prefix, max_attempts=conf.job_max_attempts)
+    return None
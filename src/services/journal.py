@@ -0,0 +1,87 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+
+from src.db import run_db, journal_add, journal_set_state, journal_remove, journal_unfinished
+from src.services.downloader import workspace_id
+from src.services.pipeline import Job
+from src.services.progress import STAGE_DOWNLOAD, STAGE_TRANSCODE, STAGE_UPLOAD
+
+logger = logging.getLogger(__name__)
+
+STATE_QUEUED = "queued"
+STATE_DOWNLOADING = "downloading"
+STATE_PROCESSING = "processing"
+STATE_UPLOADING = "uploading"
+
+STAGE_STATES = {STAGE_DOWNLOAD: STATE_DOWNLOADING, STAGE_TRANSCODE: STATE_PROCESSING, STAGE_UPLOAD: STATE_UPLOADING}
+
+
+@dataclass
+class JournalEntry:
+    id: str
+    job: Job
+    state: str
+    created: float
+
+    def workspace_ids(self) -> set:
+        urls = [item["url"] for item in self.job.items] or [self.job.url]
+        return {workspace_id(url, self.job.mode, self.job.quality) for url in urls}
+
+
+class JobJournal:
+    """Журнал загрузок, которые бот ведёт сам (без очереди воркеров).
+
+    Запись появляется до начала загрузки и удаляется, когда пользователь
+    получил файл или ошибку. Всё, что осталось в журнале после перезапуска,
+    продолжается: имена временных файлов постоянные, поэтому yt-dlp докачивает
+    свои ``.part`` вместо загрузки с нуля.
+    """
+
+    def __init__(self, max_age: int):
+        self.max_age = max_age
+        self._writes = set()
+
+    async def begin(self, job: Job) -> str:
+        job_id = uuid.uuid4().hex
+        await run_db(journal_add, job_id, json.dumps(job.to_dict()), STATE_QUEUED)
+        return job_id
+
+    def tracker(self, job_id: str):
+        """Возвращает on_stage(stage) для Pipeline: пишет в базу только смену состояния."""
+        last = [STATE_QUEUED]
+
+        def on_stage(stage):
+            state = STAGE_STATES.get(stage)
+            if state is None or state == last[0]:
+                return
+            last[0] = state
+            task = asyncio.create_task(run_db(journal_set_state, job_id, state))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+        return on_stage
+
+    async def finish(self, job_id: str):
+        await run_db(journal_remove, job_id)
+
+    async def unfinished(self) -> list:
+        entries = []
+        now = time.time()
+        for job_id, payload, state, created in await run_db(journal_unfinished):
+            if now - created > self.max_age:
+                # Пользователь давно не ждёт этот файл
+                logger.info("Журнал: задача %s слишком старая (%s), не продолжаю", job_id, state)
+                await run_db(journal_remove, job_id)
+                continue
+            try:
+                job = Job.from_dict(json.loads(payload))
+            except (ValueError, TypeError) as e:
+                logger.warning("Журнал: не удалось прочитать задачу %s: %s", job_id, e)
+                await run_db(journal_remove, job_id)
+                continue
+            entries.append(JournalEntry(job_id, job, state, created))
+        return entries
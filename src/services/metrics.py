@@ -0,0 +1,179 @@
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+from aiohttp import web
+from src.services.probe import decisions, audio_decisions
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин в секундах: от быстрого анализа ссылки до долгой перекодировки
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+PLATFORMS = (
+    ("tiktok", ("tiktok.com",)),
+    ("youtube", ("youtube.com", "youtu.be")),
+    ("instagram", ("instagram.com",)),
+    ("vk", ("vk.com", "vk.ru", "vkvideo.ru")),
+)
+
+
+def platform_of(url: str) -> str:
+    # Метка платформы должна быть из короткого списка, иначе число рядов не ограничено
+    host = urlsplit(url).netloc.lower()
+    for name, domains in PLATFORMS:
+        if any(host == d or host.endswith("." + d) for d in domains):
+            return name
+    return "other"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in list(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Значение снимается в момент запроса: ``func()`` возвращает {метки: число} или число."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def _samples(self):
+        if self.func is None:
+            return []
+        try:
+            values = self.func()
+        except Exception as e:
+            logger.debug("Gauge %s failed: %s", self.name, e)
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_labels(self.labelnames, k if isinstance(k, tuple) else (k,))} {v}"
+                for k, v in values.items()]
+
+
+class CounterFunc(Gauge):
+    # То же, что Gauge, но значение только растёт (например, счётчик, который ведёт другой модуль)
+    kind = "counter"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # метки -> [счётчики корзин..., +Inf], сумма
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        item = self._values.get(key)
+        if item is None:
+            item = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect.bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram("bot_stage_seconds", "Duration of a pipeline stage", ("stage", "platform"))
+QUEUE_WAIT_SECONDS = Histogram("bot_queue_wait_seconds", "Time spent waiting for a scheduler slot", ("stage",))
+BYTES = Counter("bot_bytes_total", "Bytes downloaded from sources and uploaded to Telegram", ("direction", "platform"))
+ERRORS = Counter("bot_errors_total", "Failed stages by exception type", ("stage", "type"))
+JOBS = Counter("bot_jobs_total", "Finished download jobs", ("platform", "result"))
+THROTTLED = Counter("bot_host_throttled_total", "Rate limit and login wall responses from platforms",
+                    ("platform", "kind"))
+TRANSCODE_DECISIONS = CounterFunc("bot_transcode_decisions_total", "Chosen transcode paths", ("action",),
+                                  func=lambda: dict(decisions))
+AUDIO_DECISIONS = CounterFunc("bot_audio_decisions_total", "Audio extraction: stream copy or re-encode", ("action",),
+                              func=lambda: dict(audio_decisions))
+
+
+@asynccontextmanager
+async def track(stage: str, platform: str = "other"):
+    """Замеряет этап; ошибки считаются по типу исключения, отмена ошибкой не считается."""
+    start = time.monotonic()
+    try:
+        yield
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        ERRORS.inc(stage=stage, type=type(e).__name__)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.monotonic() - start, stage=stage, platform=platform)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(host: str, port: int):
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
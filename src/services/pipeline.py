@@ -0,0 +1,362 @@
+import asyncio
+import logging
+import mimetypes
+import os
+from dataclasses import dataclass, asdict, field
+from types import SimpleNamespace
+from telethon.tl.types import (
+    DocumentAttributeVideo, DocumentAttributeAudio, DocumentAttributeFilename,
+    InputDocument, InputMediaUploadedDocument, MessageMediaDocument
+)
+from telethon.errors import RPCError
+
+from src.services.storage import StorageFull
+from src.services.hosts import HostUnavailable
+from src.services.thumbnails import thumb_key
+from src.services.uploader import UploadAborted
+from src.services.metrics import track, platform_of, BYTES
+from src.services.progress import ProgressReporter, STAGE_QUEUE, STAGE_DOWNLOAD, STAGE_TRANSCODE, STAGE_UPLOAD
+from src.services.scheduler import PRIORITY_NORMAL
+from src.strings import STRINGS
+
+logger = logging.getLogger(__name__)
+
+STAGE_STRINGS = {STAGE_QUEUE: "queue", STAGE_DOWNLOAD: "step_2", STAGE_TRANSCODE: "step_3", STAGE_UPLOAD: "step_4"}
+
+# mimetypes знает не все расширения, которые отдаёт загрузчик
+MIME_TYPES = {".mp4": "video/mp4", ".mp3": "audio/mpeg", ".m4a": "audio/mp4", ".opus": "audio/ogg"}
+
+
+@dataclass
+class Job:
+    """Задача на загрузку: всё, что нужно воркеру, чтобы довести её до конца без бота."""
+    url: str
+    mode: str
+    quality: str
+    chat_id: int
+    user_id: int
+    status_message_id: int
+    lang: str = "ru"
+    priority: int = PRIORITY_NORMAL
+    cache_key: str = ""
+    # Пачка ссылок одним альбомом: [{"url", "cache_key", "cached"}], cached — document_result или None
+    items: list = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+
+def make_caption(mode: str, lang: str, title: str, promo: bool = True) -> str:
+    icon = "🎵" if mode == 'audio' else "🎬"
+    return f"{icon} <b>{title}</b>{STRINGS[lang]['promo'] if promo else ''}"
+
+
+def document_result(sent, title: str) -> dict:
+    # Между процессами передаётся только документ, сами сообщения не нужны
+    media = getattr(sent, "media", None)
+    if not isinstance(media, MessageMediaDocument) or not media.document:
+        return {"title": title}
+    doc = media.document
+    return {"id": doc.id, "access_hash": doc.access_hash, "file_reference": (doc.file_reference or b"").hex(), "title": title}
+
+
+def input_document(result: dict) -> InputDocument:
+    return InputDocument(id=result["id"], access_hash=result["access_hash"],
+                         file_reference=bytes.fromhex(result.get("file_reference", "")))
+
+
+def media_attributes(mode: str, res) -> list:
+    if mode == 'video':
+        return [DocumentAttributeVideo(duration=res.duration, w=res.width, h=res.height, supports_streaming=True)]
+    return [DocumentAttributeAudio(duration=res.duration, title=res.title, performer=res.author)]
+
+
+class BatchProgress:
+    """Один статус на всю пачку: по строке на ссылку."""
+
+    def __init__(self, total: int, lang: str, sink):
+        self.lang = lang
+        self.sink = sink
+        self.lines = [STRINGS[lang]["step_1"]] * total
+        self.finished = set()
+
+    @property
+    def done(self) -> int:
+        return len(self.finished)
+
+    def stage(self, index, stage, value):
+        # Запоздавший прогресс не должен затирать итог строки
+        if index in self.finished:
+            return
+        self.lines[index] = STRINGS[self.lang][STAGE_STRINGS[stage]].format(p=value, pos=value)
+        self._emit()
+
+    def finish(self, index, ok: bool):
+        self.lines[index] = "✅" if ok else "❌"
+        self.finished.add(index)
+        self._emit()
+
+    def text(self) -> str:
+        header = STRINGS[self.lang]["batch_progress"].format(done=self.done, total=len(self.lines))
+        return header + "\n" + "\n".join(f"{i}. {line}" for i, line in enumerate(self.lines, 1))
+
+    def _emit(self):
+        self.sink(self.text())
+
+
+class StatusMessage:
+    """Сообщение со статусом, восстановленное по chat_id/message_id.
+
+    Воркер не получал исходный ``types.Message``, поэтому правит и удаляет
+    его через ``bot`` напрямую; интерфейс тот же, что нужен EditScheduler.
+    """
+
+    def __init__(self, bot, chat_id: int, message_id: int):
+        self.bot = bot
+        self.chat = SimpleNamespace(id=chat_id)
+        self.message_id = message_id
+
+    async def edit_text(self, text: str, **kwargs):
+        return await self.bot.edit_message_text(text, chat_id=self.chat.id, message_id=self.message_id, **kwargs)
+
+    async def delete(self):
+        return await self.bot.delete_message(self.chat.id, self.message_id)
+
+
+class Pipeline:
+    """Скачивание, обработка и отправка одного файла или пачки файлов альбомом.
+
+    Один и тот же код работает и в процессе бота, и в отдельном воркере.
+    """
+
+    def __init__(self, downloader, uploader, client, scheduler, edits, progress_interval: float = 1,
+                 thumbnails=None):
+        self.downloader = downloader
+        self.uploader = uploader
+        self.client = client
+        self.scheduler = scheduler
+        self.edits = edits
+        self.progress_interval = progress_interval
+        self.thumbnails = thumbnails
+
+    def _start_thumbnail(self, url: str, mode: str, res):
+        # Обложка готовится, пока файл уходит в Telegram; для видео без обложки берётся кадр
+        if self.thumbnails is None:
+            return None
+        video_path = res.path if mode == 'video' else None
+        return asyncio.create_task(self.thumbnails.get(thumb_key(url, res.video_id), res.thumb_url,
+                                                       video_path, res.duration))
+
+    async def run(self, job: Job, status, on_stage=None):
+        """Возвращает (отправленное сообщение, название). Статус удаляется после отправки.
+
+        ``on_stage(stage)`` получает каждое событие прогресса (например, для журнала).
+        """
+        lang = job.lang
+
+        def on_progress(stage, value):
+            if on_stage:
+                on_stage(stage)
+            # Сама правка уйдёт через общую очередь, здесь только подставляем текст
+            text = STRINGS[lang][STAGE_STRINGS[stage]].format(p=value, pos=value)
+            self.edits.submit(status, text, parse_mode="HTML")
+
+        # Прогресс отправки: загрузку и обработку отсекает сам downloader
+        upload_progress = ProgressReporter(on_progress, self.progress_interval)
+
+        early = {}
+
+        async def on_output(growing):
+            # Файл ещё пишется, а его части уже уходят в Telegram
+            early["file"] = growing
+            early["task"] = asyncio.create_task(self.uploader.upload(growing.path, growing))
+
+        res = None
+        thumb_task = None
+        try:
+            res = await self.downloader.download(job.url, mode=job.mode, quality=job.quality,
+                                                 progress_callback=on_progress, user_id=job.user_id,
+                                                 priority=job.priority, on_output=on_output)
+            thumb_task = self._start_thumbnail(job.url, job.mode, res)
+            upload_progress.report(STAGE_UPLOAD, "0%")
+
+            async with self.scheduler.slot("upload", job.user_id, job.priority,
+                                           lambda pos: upload_progress.report(STAGE_QUEUE, pos)):
+                platform = platform_of(job.url)
+                async with track("upload", platform):
+                    handle = await take_early_upload(early, res.path)
+                    if handle is None:
+                        handle = await self.uploader.upload(
+                            res.path,
+                            progress_callback=lambda sent, total: upload_progress.report(STAGE_UPLOAD, f"{sent * 100 // max(total, 1)}%")
+                        )
+                # Последние проценты могли отсечься — пока идёт send_file, пусть висит итоговое значение
+                upload_progress.flush()
+                BYTES.inc(res.file_size, direction="upload", platform=platform)
+                thumb = await thumb_task if thumb_task else None
+
+                # supports_streaming нужен для быстрой отправки и просмотра
+                async with track("send", platform):
+                    sent = await self.client.send_file(
+                        job.chat_id,
+                        handle,
+                        caption=make_caption(job.mode, lang, res.title),
+                        parse_mode='html',
+                        supports_streaming=True,
+                        attributes=media_attributes(job.mode, res),
+                        thumb=thumb
+                    )
+            self.edits.discard(status)
+            await status.delete()
+            return sent, res.title
+        finally:
+            if "task" in early and not early["task"].done():
+                early["task"].cancel()
+            if thumb_task is not None and not thumb_task.done():
+                thumb_task.cancel()
+            if res is not None:
+                self.downloader.release(res)
+
+    async def run_batch(self, job: Job, status, on_stage=None):
+        """Пачка ссылок: качаются параллельно (в пределах доли пользователя в планировщике),
+        а уходят одним альбомом. Возвращает (cache_key, document_result, платформа) на каждый
+        отправленный файл; для взятых из кеша вместо документа None.
+        """
+        lang = job.lang
+        progress = BatchProgress(len(job.items), lang, lambda text: self.edits.submit(status, text, parse_mode="HTML"))
+        prepared = [None] * len(job.items)
+        downloaded = []
+
+        async def prepare(index, use_cache=True):
+            item = job.items[index]
+            try:
+                if use_cache and item.get("cached"):
+                    prepared[index] = (input_document(item["cached"]), item["cached"].get("title", ""), True)
+                else:
+                    prepared[index] = await self._prepare_item(job, item["url"], index, progress, downloaded, on_stage)
+                progress.finish(index, True)
+            except Exception as e:
+                logger.warning("Пачка: не удалось скачать %s: %s", item["url"], e)
+                prepared[index] = None
+                progress.finish(index, False)
+
+        try:
+            await asyncio.gather(*(prepare(i) for i in range(len(job.items))))
+            if not any(prepared):
+                raise RuntimeError("nothing was downloaded")
+            try:
+                sent = await self._send_album(job, prepared)
+            except RPCError as e:
+                stale = [i for i, p in enumerate(prepared) if p and p[2]]
+                if not stale:
+                    raise
+                # Telegram не принял старые ссылки на файлы из кеша — докачиваем их и шлём заново
+                logger.info("Пачка: кешированные файлы отклонены (%s), качаю заново: %d", e, len(stale))
+                await asyncio.gather(*(prepare(i, use_cache=False) for i in stale))
+                sent = await self._send_album(job, prepared)
+        finally:
+            for res in downloaded:
+                self.downloader.release(res)
+
+        # Для кешированных файлов документ уже известен, для новых — берём из отправленных сообщений
+        results = []
+        messages = iter(sent)
+        for item, p in zip(job.items, prepared):
+            if p is None:
+                continue
+            message = next(messages, None)
+            fresh = not p[2] and message is not None
+            results.append((item["cache_key"], document_result(message, p[1]) if fresh else None,
+                            platform_of(item["url"])))
+
+        failed = sum(1 for p in prepared if p is None)
+        self.edits.discard(status)
+        if failed:
+            await status.edit_text(STRINGS[lang]["batch_partial"].format(failed=failed, total=len(job.items)))
+        else:
+            await status.delete()
+        return results
+
+    async def _prepare_item(self, job: Job, url: str, index: int, progress: BatchProgress, downloaded: list,
+                            on_stage=None):
+        # Скачивает и загружает один файл пачки; отправка — общая, альбомом
+        def on_progress(stage, value):
+            if on_stage:
+                on_stage(stage)
+            progress.stage(index, stage, value)
+        upload_progress = ProgressReporter(on_progress, self.progress_interval)
+        res = await self.downloader.download(url, mode=job.mode, quality=job.quality, progress_callback=on_progress,
+                                             user_id=job.user_id, priority=job.priority)
+        downloaded.append(res)
+        thumb_task = self._start_thumbnail(url, job.mode, res)
+        try:
+            async with self.scheduler.slot("upload", job.user_id, job.priority,
+                                           lambda pos: upload_progress.report(STAGE_QUEUE, pos)):
+                platform = platform_of(url)
+                async with track("upload", platform):
+                    handle = await self.uploader.upload(
+                        res.path,
+                        progress_callback=lambda sent, total: upload_progress.report(STAGE_UPLOAD, f"{sent * 100 // max(total, 1)}%")
+                    )
+                upload_progress.flush()
+                BYTES.inc(res.file_size, direction="upload", platform=platform)
+            thumb_path = await thumb_task if thumb_task else None
+        finally:
+            if thumb_task is not None and not thumb_task.done():
+                thumb_task.cancel()
+        # В альбоме обложка передаётся уже загруженным файлом
+        thumb = await self.client.upload_file(thumb_path) if thumb_path else None
+        ext = os.path.splitext(res.path)[1].lower()
+        mime = MIME_TYPES.get(ext) or mimetypes.guess_type(res.path)[0] or "application/octet-stream"
+        attributes = media_attributes(job.mode, res) + [DocumentAttributeFilename(os.path.basename(res.path))]
+        media = InputMediaUploadedDocument(file=handle, mime_type=mime, attributes=attributes, thumb=thumb,
+                                           nosound_video=job.mode == 'video')
+        return media, res.title, False
+
+    async def _send_album(self, job: Job, prepared: list):
+        ready = [p for p in prepared if p is not None]
+        # Реклама одна на альбом — в подписи последнего файла
+        captions = [make_caption(job.mode, job.lang, title, promo=i == len(ready) - 1)
+                    for i, (_, title, _) in enumerate(ready)]
+        async with track("send", "batch"):
+            sent = await self.client.send_file(job.chat_id, [media for media, _, _ in ready], caption=captions,
+                                               parse_mode='html', supports_streaming=True)
+        return sent if isinstance(sent, list) else [sent]
+
+    async def show_error(self, status, lang: str, error: BaseException):
+        self.edits.discard(status)
+        if isinstance(error, StorageFull):
+            text = STRINGS[lang]["busy"]
+        elif isinstance(error, HostUnavailable):
+            text = STRINGS[lang]["host_busy"]
+        else:
+            text = f"❌ Error: {str(error)[:100]}"
+        try:
+            await status.edit_text(text)
+        except Exception as e:
+            logger.warning("Не удалось показать ошибку: %s", e)
+
+    async def show_status(self, status, lang: str, key: str):
+        self.edits.discard(status)
+        try:
+            await status.edit_text(STRINGS[lang][key])
+        except Exception as e:
+            logger.warning("Не удалось обновить статус: %s", e)
+
+
+async def take_early_upload(early, path):
+    # Результат параллельной отправки годится, только если это тот самый итоговый файл
+    task = early.get("task")
+    if task is None:
+        return None
+    if early["file"].path != path:
+        task.cancel()
+        return None
+    try:
+        return await task
+    except (UploadAborted, RPCError, OSError):
+        return None
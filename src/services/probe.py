@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+from collections import Counter
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+ACTION_SKIP = "skip"          # файл уже готов к отправке
+ACTION_REMUX = "remux"        # меняем только контейнер / переносим moov в начало
+ACTION_FIX = "fix"            # копируем потоки, исправляя таймстемпы и edit list
+ACTION_AUDIO = "audio"        # видео копируем, перекодируем только звук
+ACTION_ENCODE = "encode"      # полная перекодировка
+
+# Что Telegram и iPhone проигрывают без перекодировки
+VIDEO_CODECS_OK = ("h264",)
+AUDIO_CODECS_OK = ("aac", "mp3")
+PIX_FMTS_OK = ("yuv420p", "yuvj420p")
+
+MAX_MOOV_SCAN = 64 * 1024 * 1024
+
+# crf 23 — баланс веса и качества, исходное разрешение сохраняем
+ENCODE_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "23", "-pix_fmt", "yuv420p",
+               "-c:a", "aac", "-b:a", "128k"]
+
+# Сколько раз выбран каждый путь — видно, какую долю перекодировок удаётся избежать
+decisions = Counter()
+# Аудио считается отдельно: оно не входит в долю избежанных перекодировок видео
+audio_decisions = Counter()
+
+
+@dataclass
+class MediaProbe:
+    format_name: str = ""
+    vcodec: str = None
+    acodec: str = None
+    pix_fmt: str = None
+    width: int = 0
+    height: int = 0
+    duration: float = 0.0
+    start_time: float = 0.0
+    has_b_frames: int = 0
+    vfr: bool = False
+    faststart: bool = False
+    edit_list_issue: bool = False
+
+
+@dataclass
+class TranscodePlan:
+    action: str
+    reason: str
+    input_args: list = field(default_factory=list)
+    output_args: list = field(default_factory=list)
+
+
+async def probe_media(path: str):
+    cmd = ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        out, _ = await asyncio.wait_for(proc.communicate(), 30)
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.warning("ffprobe failed for %s: %s", path, e)
+        return None
+    if proc.returncode != 0:
+        return None
+
+    data = json.loads(out or b"{}")
+    fmt = data.get("format", {})
+    result = MediaProbe(format_name=fmt.get("format_name", ""), duration=_float(fmt.get("duration")),
+                        start_time=_float(fmt.get("start_time")))
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and result.vcodec is None:
+            if (stream.get("disposition") or {}).get("attached_pic"):
+                continue
+            result.vcodec = stream.get("codec_name")
+            result.pix_fmt = stream.get("pix_fmt")
+            result.width = stream.get("width", 0)
+            result.height = stream.get("height", 0)
+            result.has_b_frames = int(stream.get("has_b_frames", 0) or 0)
+            r_rate, avg_rate = _rate(stream.get("r_frame_rate")), _rate(stream.get("avg_frame_rate"))
+            result.vfr = bool(r_rate and avg_rate and abs(r_rate - avg_rate) / r_rate > 0.01)
+        elif stream.get("codec_type") == "audio" and result.acodec is None:
+            result.acodec = stream.get("codec_name")
+
+    if "mp4" in result.format_name or "mov" in result.format_name:
+        result.faststart, result.edit_list_issue = await asyncio.to_thread(mp4_layout, path)
+    return result
+
+
+def mp4_layout(path: str):
+    """Возвращает (moov перед mdat, подозрительный edit list) по верхнеуровневым атомам MP4."""
+    faststart = False
+    edit_issue = False
+    try:
+        with open(path, "rb") as f:
+            size_total = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset + 8 <= size_total:
+                f.seek(offset)
+                size, kind = struct.unpack(">I4s", f.read(8))
+                header = 8
+                if size == 1:
+                    size = struct.unpack(">Q", f.read(8))[0]
+                    header = 16
+                elif size == 0:
+                    size = size_total - offset
+                if size < header:
+                    break
+                if kind == b"mdat" and not faststart:
+                    # mdat встретился раньше moov
+                    break
+                if kind == b"moov":
+                    faststart = True
+                    if size <= MAX_MOOV_SCAN:
+                        edit_issue = _has_edit_list_issue(f.read(size - header))
+                    break
+                offset += size
+    except (OSError, struct.error):
+        return False, False
+    return faststart, edit_issue
+
+
+def _has_edit_list_issue(moov: bytes) -> bool:
+    # Пустые правки и несколько сегментов дают «застывший кадр» на iOS
+    pos = moov.find(b"elst")
+    while pos != -1:
+        try:
+            version = moov[pos + 4]
+            count = struct.unpack(">I", moov[pos + 8:pos + 12])[0]
+            if count > 1:
+                return True
+            if count == 1:
+                if version == 1:
+                    media_time = struct.unpack(">q", moov[pos + 20:pos + 28])[0]
+                else:
+                    media_time = struct.unpack(">i", moov[pos + 16:pos + 20])[0]
+                if media_time < 0:
+                    return True
+        except (IndexError, struct.error):
+            return False
+        pos = moov.find(b"elst", pos + 4)
+    return False
+
+
+def plan_video(info: MediaProbe, input_path: str, file_size: int, size_limit: int, is_insta: bool = False) -> TranscodePlan:
+    if info is None:
+        # Нет ffprobe — прежнее поведение
+        if file_size <= size_limit and not is_insta and input_path.endswith(".mp4"):
+            return TranscodePlan(ACTION_REMUX, "no probe", output_args=["-c", "copy", "-map_metadata", "0"])
+        return TranscodePlan(ACTION_ENCODE, "no probe", output_args=ENCODE_ARGS)
+
+    if file_size > size_limit:
+        return TranscodePlan(ACTION_ENCODE, "too large", output_args=ENCODE_ARGS)
+    if info.vcodec not in VIDEO_CODECS_OK:
+        return TranscodePlan(ACTION_ENCODE, f"video codec {info.vcodec}", output_args=ENCODE_ARGS)
+    if info.pix_fmt not in PIX_FMTS_OK:
+        return TranscodePlan(ACTION_ENCODE, f"pix_fmt {info.pix_fmt}", output_args=ENCODE_ARGS)
+    if is_insta and info.vfr:
+        # Переменная частота кадров из Instagram дёргается на iPhone, лечится только перекодировкой
+        return TranscodePlan(ACTION_ENCODE, "variable frame rate", output_args=ENCODE_ARGS)
+
+    if info.acodec and info.acodec not in AUDIO_CODECS_OK:
+        return TranscodePlan(ACTION_AUDIO, f"audio codec {info.acodec}",
+                             output_args=["-map", "0:v:0", "-map", "0:a:0", "-c:v", "copy", "-c:a", "aac", "-b:a", "128k"])
+
+    is_mp4 = "mp4" in info.format_name or "mov" in info.format_name
+    broken_ts = info.edit_list_issue or info.start_time < 0
+    if broken_ts and info.has_b_frames:
+        # С B-кадрами pts и dts расходятся: -ignore_editlist и genpts при копировании сдвигают
+        # их по-разному, и звук уезжает — таймстемпы честно пересчитывает только перекодировка
+        return TranscodePlan(ACTION_ENCODE, "B-frames with broken timestamps", output_args=ENCODE_ARGS)
+    if broken_ts:
+        input_args = ["-fflags", "+genpts"] + (["-ignore_editlist", "1"] if is_mp4 else [])
+        output_args = ["-c", "copy", "-map_metadata", "0", "-avoid_negative_ts", "make_zero"]
+        if "mpegts" in info.format_name and info.acodec == "aac":
+            output_args += ["-bsf:a", "aac_adtstoasc"]
+        return TranscodePlan(ACTION_FIX, "edit list / timestamps", input_args, output_args)
+
+    if is_mp4 and info.faststart and input_path.endswith(".mp4"):
+        return TranscodePlan(ACTION_SKIP, "already faststart mp4")
+
+    output_args = ["-c", "copy", "-map_metadata", "0"]
+    if "mpegts" in info.format_name and info.acodec == "aac":
+        output_args += ["-bsf:a", "aac_adtstoasc"]
+    return TranscodePlan(ACTION_REMUX, "container", output_args=output_args)
+
+
+def record_decision(plan: TranscodePlan, path: str):
+    decisions[plan.action] += 1
+    total = sum(decisions.values())
+    avoided = total - decisions[ACTION_ENCODE]
+    logger.info("Transcode %s: %s (%s); encodes avoided %d/%d", os.path.basename(path), plan.action,
+                plan.reason, avoided, total)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _rate(value):
+    try:
+        num, den = (value or "0/1").split("/")
+        return int(num) / int(den) if int(den) else 0
+    except ValueError:
+        return 0
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+
+logger = logging.getLogger(__name__)
+
+# Этапы, о которых сообщается пользователю
+STAGE_QUEUE = "queue"
+STAGE_DOWNLOAD = "download"
+STAGE_TRANSCODE = "transcode"
+STAGE_UPLOAD = "upload"
+
+
+class ProgressReporter:
+    """Прогресс одной задачи с отсечкой на стороне источника.
+
+    ``report()`` можно вызывать из любого потока сколь угодно часто: хранится
+    только последнее значение, а в цикл событий оно попадает не чаще раза в
+    ``interval`` секунд. Смена этапа отправляется сразу. Отсечённое последнее
+    значение можно дослать через ``flush()``.
+    """
+
+    def __init__(self, sink, interval: float, loop: asyncio.AbstractEventLoop = None):
+        self._sink = sink
+        self._interval = interval
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._lock = threading.Lock()
+        self._latest = None
+        self._stage = None
+        self._last_emit = 0.0
+        self._scheduled = False
+        self._dirty = False  # Последнее значение отсечено и ещё не отправлено
+
+    def report(self, stage: str, value):
+        now = time.monotonic()
+        with self._lock:
+            self._latest = (stage, value)
+            if self._scheduled:
+                return
+            if stage == self._stage and now - self._last_emit < self._interval:
+                self._dirty = True
+                return
+            self._stage = stage
+            self._last_emit = now
+            self._scheduled = True
+
+        self._dispatch()
+
+    def flush(self):
+        # Досылает отсечённое последнее значение, например 100% перед финальной правкой
+        with self._lock:
+            if not self._dirty or self._scheduled:
+                return
+            self._last_emit = time.monotonic()
+            self._scheduled = True
+        self._dispatch()
+
+    def _dispatch(self):
+        if threading.get_ident() == self._loop_thread:
+            self._emit()
+        else:
+            self._loop.call_soon_threadsafe(self._emit)
+
+    def _emit(self):
+        with self._lock:
+            stage, value = self._latest
+            self._scheduled = False
+            self._dirty = False
+        try:
+            self._sink(stage, value)
+        except Exception as e:
+            logger.debug("Progress sink failed: %s", e)
+
+
+class EditScheduler:
+    """Единая очередь правок статусных сообщений.
+
+    Для каждого сообщения хранится только последний текст, правки одного чата
+    идут не чаще ``per_chat_interval``, всего — не больше ``global_rate`` в
+    секунду. RetryAfter откладывает правки этого чата на указанное время.
+    Одно сообщение правится не более чем одной задачей за раз; ``discard()``
+    отменяет и ждущую, и уже идущую правку.
+    """
+
+    def __init__(self, per_chat_interval: float, global_rate: float):
+        self.per_chat_interval = per_chat_interval
+        self.global_rate = global_rate
+        self._pending = OrderedDict()   # (chat_id, message_id) -> (message, text, kwargs)
+        self._chat_ready = {}           # chat_id -> время, когда можно снова править
+        self._global_ready = 0.0
+        self._wakeup = None
+        self._task = None
+        self._inflight = {}             # (chat_id, message_id) -> задача с идущей правкой
+        self._discarded = set()         # Ключи, отброшенные во время идущей правки
+
+    def submit(self, message, text: str, **kwargs):
+        # Если правка уже ждёт, место в очереди сохраняется, а текст заменяется свежим
+        key = (message.chat.id, message.message_id)
+        self._discarded.discard(key)
+        self._pending[key] = (message, text, kwargs)
+        self._ensure_running()
+        self._wakeup.set()
+
+    def discard(self, message):
+        # Вызывать перед удалением или финальной правкой сообщения: иначе запоздавшая
+        # правка прогресса может затереть итоговый текст
+        key = (message.chat.id, message.message_id)
+        self._pending.pop(key, None)
+        task = self._inflight.get(key)
+        if task is not None:
+            self._discarded.add(key)
+            task.cancel()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            if now < self._global_ready:
+                await asyncio.sleep(self._global_ready - now)
+                continue
+
+            # Сообщение с идущей правкой ждёт её окончания, чтобы тексты не обгоняли друг друга
+            candidates = [k for k in self._pending if k not in self._inflight]
+            key = next((k for k in candidates if self._chat_ready.get(k[0], 0) <= now), None)
+            if key is None:
+                self._wakeup.clear()
+                if not candidates:
+                    await self._wakeup.wait()
+                    continue
+                wait = min(self._chat_ready.get(k[0], 0) for k in candidates) - now
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(wait, 0.01))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            message, text, kwargs = self._pending.pop(key)
+            self._chat_ready[key[0]] = now + self.per_chat_interval
+            self._global_ready = now + 1 / self.global_rate
+            task = asyncio.create_task(self._edit(key, message, text, kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._edit_done(key, t))
+
+            if len(self._chat_ready) > 10_000:
+                self._chat_ready = {k: v for k, v in self._chat_ready.items() if v > now}
+
+    async def _edit(self, key, message, text, kwargs):
+        try:
+            await message.edit_text(text, **kwargs)
+        except TelegramRetryAfter as e:
+            self._chat_ready[key[0]] = time.monotonic() + e.retry_after
+            # Если за это время не пришёл текст новее, повторим этот — но не для отброшенного сообщения
+            if key not in self._discarded:
+                self._pending.setdefault(key, (message, text, kwargs))
+                self._wakeup.set()
+        except TelegramBadRequest:
+            # «message is not modified» или сообщение уже удалено
+            pass
+        except Exception as e:
+            logger.debug("Status edit failed: %s", e)
+
+    def _edit_done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        self._discarded.discard(key)
+        if key in self._pending:
+            self._wakeup.set()
@@ -0,0 +1,157 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from src.services.metrics import QUEUE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Меньше значение — раньше в очереди
+PRIORITY_AUDIO = 0
+PRIORITY_SHORT = 1
+PRIORITY_NORMAL = 2
+
+STAGES = ("network", "transcode", "upload")
+
+
+class _Waiter:
+    __slots__ = ("user_id", "priority", "seq", "future", "on_position", "position")
+
+    def __init__(self, user_id, priority, seq, future, on_position):
+        self.user_id = user_id
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.on_position = on_position
+        self.position = None
+
+
+class _Stage:
+    """Очередь одного этапа: лимит одновременных задач и round-robin между пользователями."""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = max(1, limit)
+        self.active = 0
+        self.queues = {}     # user_id -> список ожидающих, отсортированный по (priority, seq)
+        self.users = deque()  # порядок обхода пользователей
+
+    def waiting(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def _pick(self, queues, users):
+        # Берём самый приоритетный запрос, при равенстве — пользователя, чья очередь подошла раньше
+        best = None
+        for idx, uid in enumerate(users):
+            head = queues[uid][0]
+            if best is None or head.priority < best[1].priority:
+                best = (idx, head)
+        idx, waiter = best
+        uid = users[idx]
+        del users[idx]
+        queues[uid] = queues[uid][1:]
+        if queues[uid]:
+            users.append(uid)
+        else:
+            del queues[uid]
+        return waiter
+
+    def order(self):
+        queues = dict(self.queues)
+        users = deque(self.users)
+        result = []
+        while users:
+            result.append(self._pick(queues, users))
+        return result
+
+    def push(self, waiter):
+        queue = self.queues.get(waiter.user_id)
+        if queue is None:
+            self.queues[waiter.user_id] = [waiter]
+            self.users.append(waiter.user_id)
+        else:
+            queue.append(waiter)
+            queue.sort(key=lambda w: (w.priority, w.seq))
+
+    def remove(self, waiter):
+        queue = self.queues.get(waiter.user_id)
+        if not queue or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self.queues[waiter.user_id]
+            self.users.remove(waiter.user_id)
+
+    def pop_next(self):
+        return self._pick(self.queues, self.users)
+
+
+class JobScheduler:
+    def __init__(self, network_limit: int, transcode_limit: int, upload_limit: int):
+        self._stages = {
+            "network": _Stage("network", network_limit),
+            "transcode": _Stage("transcode", transcode_limit),
+            "upload": _Stage("upload", upload_limit),
+        }
+        self._seq = itertools.count()
+        self._tasks = set()
+
+    def stats(self):
+        return {name: (st.active, st.waiting()) for name, st in self._stages.items()}
+
+    @asynccontextmanager
+    async def slot(self, stage: str, user_id=None, priority: int = PRIORITY_NORMAL, on_position=None):
+        st = self._stages[stage]
+        start = time.monotonic()
+        await self._acquire(st, user_id, priority, on_position)
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - start, stage=stage)
+        try:
+            yield
+        finally:
+            self._release(st)
+
+    async def _acquire(self, st, user_id, priority, on_position):
+        if st.active < st.limit and not st.users:
+            st.active += 1
+            return
+
+        waiter = _Waiter(user_id, priority, next(self._seq), asyncio.get_running_loop().create_future(), on_position)
+        st.push(waiter)
+        self._report_positions(st)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Слот уже выдан, но ждать его некому
+                self._release(st)
+            else:
+                st.remove(waiter)
+                self._report_positions(st)
+            raise
+
+    def _release(self, st):
+        st.active -= 1
+        while st.active < st.limit and st.users:
+            waiter = st.pop_next()
+            if waiter.future.done():
+                continue
+            st.active += 1
+            waiter.future.set_result(None)
+        self._report_positions(st)
+
+    def _report_positions(self, st):
+        for pos, waiter in enumerate(st.order(), start=1):
+            if waiter.position == pos or not waiter.on_position:
+                waiter.position = pos
+                continue
+            waiter.position = pos
+            try:
+                result = waiter.on_position(pos)
+                if asyncio.iscoroutine(result):
+                    task = asyncio.create_task(result)
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            except Exception as e:
+                logger.debug("Queue position callback failed: %s", e)
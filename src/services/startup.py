@@ -0,0 +1,32 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Засекает этапы запуска, чтобы было видно, на что уходит время рестарта.
+
+    Модуль намеренно без тяжёлых зависимостей: его импортируют первым.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def as_dict(self) -> dict:
+        return dict(self.phases)
+
+    def report(self):
+        total = self._last - self.started
+        lines = [f"  {phase:<16} {seconds:7.3f} с" for phase, seconds in self.phases]
+        logger.info("Запуск за %.3f с:\n%s", total, "\n".join(lines))
+
+
+STARTUP = StartupTimer()
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Все файлы задачи начинаются с raw_<id> или final_<id>: так по имени видно, чей это файл
+OWNER_RE = re.compile(r"^(?:raw|final)_([0-9a-f]{12})")
+# RAM-каталог обычно общий (/dev/shm), поэтому бот пишет только в свой подкаталог
+STAGING_SUBDIR = "sdbot"
+
+
+class StorageFull(Exception):
+    pass
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Не удалось удалить %s: %s", path, e)
+
+
+def _reap_root(root, now, max_age, skip=()):
+    # Удаляет файлы задач в одном каталоге; возвращает (сколько файлов, сколько байт)
+    removed = freed = 0
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return 0, 0
+    for entry in entries:
+        if not entry.is_file():
+            continue
+        owner = OWNER_RE.match(entry.name)
+        if not owner or owner.group(1) in skip:
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if max_age is not None and now - stat.st_mtime < max_age:
+            continue
+        remove_file(entry.path)
+        removed += 1
+        freed += stat.st_size
+    return removed, freed
+
+
+def reap_siblings(parent: str, own: str, max_age: int, subdir: str = None) -> int:
+    """Удаляет файлы задач старше ``max_age`` в соседних каталогах воркеров.
+
+    Каталоги в ``parent``, кроме ``own``, остаются от воркеров, которые больше
+    не запускаются с таким WORKER_ID (например, прежний id с pid процесса).
+    Живого соседа это не задевает: его задачи не длятся дольше ``max_age``.
+    """
+    now = time.time()
+    removed = freed = 0
+    try:
+        entries = [e for e in os.scandir(parent) if e.is_dir() and e.name != own]
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        r, f = _reap_root(os.path.join(entry.path, subdir) if subdir else entry.path, now, max_age)
+        removed += r
+        freed += f
+    if removed:
+        logger.info("Удалено файлов прежних воркеров: %d (%d MB)", removed, freed >> 20)
+    return removed
+
+
+class Workspace:
+    """Файлы одной задачи и место, зарезервированное под них."""
+
+    def __init__(self, manager, job_id: str, directory: str, reserved: int):
+        self.manager = manager
+        self.job_id = job_id
+        self.directory = directory
+        self.reserved = reserved
+        self.closed = False
+
+    def path(self, kind: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{kind}_{self.job_id}{ext}")
+
+    def files(self):
+        # Сюда же попадают .part, .ytdl и отдельные дорожки yt-dlp
+        try:
+            with os.scandir(self.directory) as it:
+                return [e.path for e in it if e.is_file() and self.job_id in e.name]
+        except FileNotFoundError:
+            return []
+
+    def keep_only(self, path: str):
+        # Промежуточные файлы больше не нужны, резерв уменьшаем до размера результата
+        for f in self.files():
+            if f != path:
+                remove_file(f)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        self.manager._resize(self, size)
+
+    def detach(self):
+        # Задачу прервали остановкой процесса: резерв отдаём, а недокачанное оставляем
+        # для продолжения (если продолжать не будут, файлы уберёт reap)
+        if self.closed:
+            return
+        self.closed = True
+        self.manager._release(self)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for f in self.files():
+            remove_file(f)
+        self.manager._release(self)
+
+
+class StorageManager:
+    """Учёт места под временные файлы загрузок.
+
+    Перед загрузкой задача резервирует оценку своего размера. Если квота
+    исчерпана или на диске мало места, задача ждёт освобождения до
+    ``wait_timeout`` секунд, а затем получает StorageFull. Небольшие задачи
+    можно держать в RAM-каталоге (tmpfs), остальные пишутся на диск.
+    Файлы, не принадлежащие ни одной задаче, удаляются при старте и по таймеру.
+    """
+
+    def __init__(self, root: str, quota: int, min_free: int, staging_root: str = None,
+                 staging_quota: int = 0, staging_max_job: int = 0, wait_timeout: float = 300,
+                 orphan_age: int = 3 * 3600):
+        self.root = root
+        self.quota = quota
+        self.min_free = min_free
+        self.staging_root = os.path.join(staging_root, STAGING_SUBDIR) if staging_root else None
+        self.staging_quota = staging_quota
+        self.staging_max_job = staging_max_job
+        self.wait_timeout = wait_timeout
+        self.orphan_age = orphan_age
+        self._active = {}
+        self._used = {root: 0}
+        self._freed = None
+
+        os.makedirs(root, exist_ok=True)
+        if self.staging_root:
+            try:
+                os.makedirs(self.staging_root, exist_ok=True)
+                self._used[self.staging_root] = 0
+            except OSError as e:
+                logger.warning("RAM-каталог %s недоступен: %s", self.staging_root, e)
+                self.staging_root = None
+
+    @property
+    def roots(self):
+        return list(self._used)
+
+    async def reserve(self, estimate: int, job_id: str = None) -> Workspace:
+        # Постоянный id позволяет после перезапуска найти недокачанные файлы задачи;
+        # если такой id уже занят живой задачей, берём случайный
+        if not job_id or job_id in self._active:
+            job_id = uuid.uuid4().hex[:12]
+        if self.staging_root and estimate <= self.staging_max_job and self._fits(self.staging_root, estimate):
+            return self._open(job_id, self.staging_root, estimate)
+
+        if estimate > self.quota:
+            raise StorageFull(f"Job needs ~{estimate >> 20} MB, quota is {self.quota >> 20} MB")
+
+        if self._freed is None:
+            self._freed = asyncio.Event()
+        deadline = time.monotonic() + self.wait_timeout
+        while not self._fits(self.root, estimate):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise StorageFull("Not enough space for downloads")
+            self._freed.clear()
+            # Место может освободиться и не через нас, поэтому проверяем и по таймеру
+            try:
+                await asyncio.wait_for(self._freed.wait(), min(left, 5))
+            except asyncio.TimeoutError:
+                pass
+        return self._open(job_id, self.root, estimate)
+
+    def _fits(self, root, estimate):
+        quota = self.staging_quota if root == self.staging_root else self.quota
+        if self._used[root] + estimate > quota:
+            return False
+        try:
+            free = shutil.disk_usage(root).free
+        except OSError:
+            return False
+        return free - estimate >= (0 if root == self.staging_root else self.min_free)
+
+    def _open(self, job_id, root, estimate):
+        ws = Workspace(self, job_id, root, estimate)
+        self._active[job_id] = ws
+        self._used[root] += estimate
+        return ws
+
+    def _resize(self, ws: Workspace, size: int):
+        if ws.closed:
+            return
+        self._used[ws.directory] += size - ws.reserved
+        ws.reserved = size
+        self._notify()
+
+    def _release(self, ws: Workspace):
+        if self._active.pop(ws.job_id, None) is None:
+            return
+        self._used[ws.directory] -= ws.reserved
+        ws.reserved = 0
+        self._notify()
+
+    def _notify(self):
+        if self._freed is not None:
+            self._freed.set()
+
+    def usage(self):
+        return dict(self._used)
+
+    def reap(self, max_age: int = None, keep=()):
+        """Удаляет файлы задач (raw_/final_<id>), которые не принадлежат ни одной активной задаче.
+
+        Без ``max_age`` удаляются все такие файлы (при старте), иначе — только старше ``max_age`` секунд.
+        Файлы задач из ``keep`` (их продолжат после перезапуска) не трогаются, а файлы
+        с другими именами не трогаются никогда: каталог может быть общим.
+        """
+        now = time.time()
+        removed = freed = 0
+        skip = set(self._active) | set(keep)
+        for root in self.roots:
+            r, f = _reap_root(root, now, max_age, skip)
+            removed += r
+            freed += f
+        if removed:
+            logger.info("Удалено забытых файлов: %d (%d MB)", removed, freed >> 20)
+        return removed
+
+    async def reap_loop(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.reap, self.orphan_age)
@@ -0,0 +1,62 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBED_STATUSES = ("member", "administrator", "creator")
+
+
+class SubscriptionCache:
+    """Кеш проверки подписки на канал.
+
+    Положительный и отрицательный ответы живут разное время. Изменения
+    приходят через апдейты chat_member, а при ошибке Bot API используется
+    последний известный статус.
+    """
+
+    def __init__(self, channel_id: str, positive_ttl: int, negative_ttl: int, max_entries: int = 100_000):
+        self.channel_id = str(channel_id or "")
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._items = {}  # user_id -> (подписан, время проверки)
+
+    def matches_channel(self, chat) -> bool:
+        if str(chat.id) == self.channel_id:
+            return True
+        username = getattr(chat, "username", None)
+        return bool(username) and f"@{username}".lower() == self.channel_id.lower()
+
+    def set_status(self, user_id: int, member) -> bool:
+        subscribed = is_member_status(member)
+        self._items.pop(user_id, None)
+        self._items[user_id] = (subscribed, time.monotonic())
+        if len(self._items) > self.max_entries:
+            # dict хранит порядок вставки — выкидываем самые старые записи
+            self._items.pop(next(iter(self._items)))
+        return subscribed
+
+    async def is_subscribed(self, bot, user_id: int) -> bool:
+        item = self._items.get(user_id)
+        if item:
+            subscribed, checked = item
+            ttl = self.positive_ttl if subscribed else self.negative_ttl
+            if time.monotonic() - checked < ttl:
+                return subscribed
+
+        try:
+            member = await bot.get_chat_member(chat_id=self.channel_id, user_id=user_id)
+        except Exception as e:
+            if item:
+                return item[0]
+            # Нет ни ответа, ни истории — не наказываем пользователя за сбой Bot API
+            logger.warning("Subscription check for %s failed: %s", user_id, e)
+            return True
+        return self.set_status(user_id, member)
+
+
+def is_member_status(member) -> bool:
+    status = getattr(member, "status", member)
+    if status == "restricted":
+        return bool(getattr(member, "is_member", False))
+    return status in SUBSCRIBED_STATUSES
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+
+from src.services.http import get_session
+from src.services.metrics import platform_of
+from src.services.storage import remove_file
+from src.services.transcoder import Transcoder, TranscodeError
+
+logger = logging.getLogger(__name__)
+
+# Требования Telegram к обложке документа: JPEG не больше 320x320 и 200 КБ
+THUMB_SIZE = 320
+THUMB_MAX_BYTES = 200 * 1024
+# Обложки больше этого не скачиваем — это уже не картинка-превью
+SOURCE_MAX_BYTES = 10 * 1024 * 1024
+# Качество JPEG для ffmpeg (-q:v): чем больше число, тем меньше файл
+QUALITY_STEPS = (4, 8, 14, 24)
+
+SCALE = f"scale=w='min({THUMB_SIZE},iw)':h='min({THUMB_SIZE},ih)':force_original_aspect_ratio=decrease"
+
+
+def thumb_key(url: str, video_id: str = None) -> str:
+    # По id ролика: у превью и у загрузки одна и та же обложка, даже если ссылки записаны по-разному
+    source = f"{platform_of(url)}|{video_id}" if video_id else url
+    return hashlib.sha1(source.encode()).hexdigest()[:16]
+
+
+def _is_thumb(name: str) -> bool:
+    # Готовые обложки — <key>.jpg; недописанные (<key>.<случайное>.jpg) не трогаем
+    return name.endswith(".jpg") and name.count(".") == 1
+
+
+class ThumbnailCache:
+    """Готовые обложки 320px в JPEG, по одному файлу на ролик.
+
+    Обложка скачивается один раз через общую aiohttp-сессию и ужимается
+    ffmpeg'ом; если ссылки нет или она не открылась, берётся кадр из
+    скачанного файла. Одновременные запросы одной обложки ждут одну задачу.
+    Ошибки не пробрасываются: без обложки файл всё равно отправится.
+    """
+
+    def __init__(self, directory: str, max_entries: int = 2000):
+        self.directory = directory
+        self.max_entries = max_entries
+        # Отдельный ffmpeg с маленьким лимитом, чтобы обложки не ждали за перекодировками видео
+        self.transcoder = Transcoder(cores=2, threads_per_job=1, timeout=30)
+        self._pending = {}
+        self._count = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jpg")
+
+    async def get(self, key: str, url: str = None, video_path: str = None, duration: float = 0):
+        """Путь к обложке или None. ``url`` — удалённая картинка, ``video_path`` — локальное видео для кадра."""
+        path = self.path(key)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # Свежие обложки переживают чистку
+            except OSError:
+                pass
+            return path
+        if not url and not video_path:
+            return None
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._make_safe(key, url, video_path, duration))
+            self._pending[key] = task
+            task.add_done_callback(lambda t: self._pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _make_safe(self, key, url, video_path, duration):
+        try:
+            return await self._make(key, url, video_path, duration)
+        except Exception as e:
+            logger.warning("Обложка %s не получилась: %s", key, e)
+            return None
+
+    async def _make(self, key, url, video_path, duration):
+        path = self.path(key)
+        tmp = os.path.join(self.directory, f"{key}.{uuid.uuid4().hex[:8]}")
+        try:
+            made = False
+            if url:
+                made = await self._from_url(url, tmp)
+            if not made and video_path and os.path.exists(video_path):
+                # Кадр не с самого начала: там часто чёрный экран или заставка
+                offset = min(1.0, duration / 3) if duration else 0
+                made = await self._encode(["-ss", f"{offset:.2f}", "-i", video_path], tmp + ".jpg")
+            if not made:
+                return None
+            os.replace(tmp + ".jpg", path)
+        finally:
+            remove_file(tmp)
+            remove_file(tmp + ".jpg")
+        self._prune()
+        return path
+
+    async def _from_url(self, url, tmp) -> bool:
+        try:
+            async with get_session().get(url) as resp:
+                resp.raise_for_status()
+                if resp.content_length and resp.content_length > SOURCE_MAX_BYTES:
+                    return False
+                # content.read(n) отдаёт только уже пришедшее, поэтому читаем до конца с ограничением
+                chunks, size = [], 0
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > SOURCE_MAX_BYTES:
+                        return False
+                    chunks.append(chunk)
+                data = b"".join(chunks)
+        except Exception as e:
+            logger.info("Не удалось скачать обложку %s: %s", url, e)
+            return False
+        if not data:
+            return False
+        await asyncio.to_thread(self._write, tmp, data)
+        return await self._encode(["-i", tmp], tmp + ".jpg")
+
+    @staticmethod
+    def _write(path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    async def _encode(self, input_args, output) -> bool:
+        # Подбираем качество, пока обложка не влезет в лимит Telegram
+        for quality in QUALITY_STEPS:
+            args = [*input_args, "-frames:v", "1", "-vf", SCALE, "-q:v", str(quality), "-update", "1", output]
+            try:
+                await self.transcoder.run(args)
+            except TranscodeError as e:
+                logger.info("Не удалось сделать обложку: %s", e)
+                return False
+            try:
+                if os.path.getsize(output) <= THUMB_MAX_BYTES:
+                    return True
+            except OSError:
+                return False
+        return False
+
+    def _prune(self):
+        # Считаем файлы один раз, дальше ведём счётчик; чистим сразу десятую часть самых старых
+        if self._count is None:
+            self._count = self._scan_count()
+        else:
+            self._count += 1
+        if self._count <= self.max_entries:
+            return
+        try:
+            entries = sorted((e for e in os.scandir(self.directory) if _is_thumb(e.name)),
+                             key=lambda e: e.stat().st_mtime)
+        except OSError as e:
+            logger.warning("Не удалось почистить обложки: %s", e)
+            return
+        excess = len(entries) - self.max_entries + self.max_entries // 10
+        for entry in entries[:max(excess, 0)]:
+            remove_file(entry.path)
+        self._count = len(entries) - max(excess, 0)
+
+    def _scan_count(self) -> int:
+        try:
+            return sum(1 for e in os.scandir(self.directory) if _is_thumb(e.name))
+        except OSError:
+            return 0
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class TranscodeError(Exception):
+    pass
+
+class Transcoder:
+    """Запускает ffmpeg как дочерние процессы asyncio, не блокируя цикл событий.
+
+    Одновременно работает не больше ``cores // threads_per_job`` процессов,
+    каждый ограничен ``-threads threads_per_job``.
+    """
+
+    def __init__(self, cores: int, threads_per_job: int, timeout: int):
+        self.threads = max(1, threads_per_job)
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max(1, cores // self.threads))
+
+    async def run(self, args, duration=None, progress_callback=None, timeout=None):
+        # Последний аргумент — выходной файл, перед ним ставим ограничение по потокам
+        cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-y", "-nostats", "-progress", "pipe:1",
+               *args[:-1], "-threads", str(self.threads), args[-1]]
+
+        async with self._slots:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            stderr_tail = deque(maxlen=20)
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(
+                        self._read_progress(proc.stdout, duration, progress_callback),
+                        self._read_stderr(proc.stderr, stderr_tail),
+                        proc.wait()
+                    ),
+                    timeout or self.timeout
+                )
+            except asyncio.TimeoutError:
+                raise TranscodeError(f"ffmpeg timed out after {timeout or self.timeout}s")
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+
+        if proc.returncode != 0:
+            raise TranscodeError(f"ffmpeg exited with {proc.returncode}: {' | '.join(stderr_tail)}")
+
+    async def _read_progress(self, stream, duration, progress_callback):
+        last_sent = -1
+        async for raw in stream:
+            line = raw.decode(errors="ignore").strip()
+            if not progress_callback or not duration or not line.startswith("out_time_us="):
+                continue
+            try:
+                seconds = int(line.split("=", 1)[1]) / 1_000_000
+            except ValueError:
+                continue
+            percent = min(100, int(seconds * 100 / duration))
+            if percent > last_sent:
+                last_sent = percent
+                try:
+                    progress_callback(percent)
+                except Exception as e:
+                    logger.debug("Progress callback failed: %s", e)
+
+    async def _read_stderr(self, stream, tail):
+        async for raw in stream:
+            line = raw.decode(errors="ignore").strip()
+            if line:
+                tail.append(line)
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import logging
+import os
+from telethon import helpers
+from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 512 * 1024
+BIG_FILE_SIZE = 10 * 1024 * 1024
+POLL_INTERVAL = 0.2
+
+
+class GrowingFile:
+    """Файл, который ещё дописывается (ffmpeg или загрузка потоком).
+
+    Производитель вызывает ``finish()`` после успешной записи или ``fail()``,
+    если файл использовать нельзя.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ok = False
+        self._done = asyncio.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def finish(self):
+        self.ok = True
+        self._done.set()
+
+    def fail(self):
+        self.ok = False
+        self._done.set()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class UploadAborted(Exception):
+    pass
+
+
+class ParallelUploader:
+    """Загрузка файла в Telegram частями, несколько частей одновременно.
+
+    Умеет начинать загрузку ещё растущего файла: части отправляются по мере
+    появления, а общее число частей (``file_total_parts = -1``) сообщается
+    только вместе с последней частью.
+    """
+
+    def __init__(self, client, workers: int = 4):
+        self.client = client
+        self.workers = max(1, workers)
+
+    async def upload(self, path: str, growing: GrowingFile = None, progress_callback=None):
+        if growing is not None:
+            # Маленькие файлы загружаются другим методом, поэтому ждём 10 МБ или конца записи
+            while not growing.done and _size(path) <= BIG_FILE_SIZE:
+                await growing.wait(POLL_INTERVAL)
+            if growing.done:
+                if not growing.ok:
+                    raise UploadAborted(path)
+                growing = None
+
+        size = None if growing else os.path.getsize(path)
+        is_big = growing is not None or size > BIG_FILE_SIZE
+        file_id = helpers.generate_random_long()
+        name = os.path.basename(path)
+
+        state = {"next": 0, "total": None if growing else (size + PART_SIZE - 1) // PART_SIZE, "sent": 0}
+        md5 = hashlib.md5() if not is_big else None
+        lock = asyncio.Lock()
+
+        with open(path, "rb") as f:
+            async def next_part():
+                # Части выдаются строго по порядку, чтение — под замком
+                async with lock:
+                    while True:
+                        index = state["next"]
+                        if state["total"] is not None and index >= state["total"]:
+                            return None
+                        offset = index * PART_SIZE
+                        available = _size(path) - offset
+                        if growing is not None and growing.done:
+                            if not growing.ok:
+                                raise UploadAborted(path)
+                            state["total"] = (_size(path) + PART_SIZE - 1) // PART_SIZE
+                            if index >= state["total"]:
+                                return None
+                        elif growing is not None and available <= PART_SIZE:
+                            # Последнюю полную часть придерживаем: вдруг она окажется финальной
+                            await growing.wait(POLL_INTERVAL)
+                            continue
+
+                        f.seek(offset)
+                        data = await asyncio.to_thread(f.read, PART_SIZE)
+                        if md5 is not None:
+                            md5.update(data)
+                        state["next"] = index + 1
+                        return index, data, state["total"] if state["total"] is not None else -1
+
+            async def worker():
+                while True:
+                    part = await next_part()
+                    if part is None:
+                        return
+                    index, data, total = part
+                    if is_big:
+                        request = SaveBigFilePartRequest(file_id, index, total, data)
+                    else:
+                        request = SaveFilePartRequest(file_id, index, data)
+                    if not await self.client(request):
+                        raise RuntimeError(f"Failed to upload file part {index}")
+                    state["sent"] += len(data)
+                    if progress_callback:
+                        progress_callback(state["sent"], _size(path))
+
+            await asyncio.gather(*[worker() for _ in range(self.workers)])
+
+        if is_big:
+            return InputFileBig(file_id, state["total"], name)
+        return InputFile(file_id, state["total"], name, md5.hexdigest())
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
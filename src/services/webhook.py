@@ -0,0 +1,125 @@
+import asyncio
+import hmac
+import logging
+import signal
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Приём обновлений через webhook вместо long polling.
+
+    Обновление подтверждается сразу, а обрабатывается в отдельной задаче.
+    Одновременно обрабатывается не больше ``max_concurrency`` обновлений:
+    если все места заняты дольше ``accept_timeout`` секунд, Telegram получает
+    503 и сам повторит доставку позже. При остановке новые обновления не
+    принимаются, а начатые (в том числе загрузки) дорабатывают до
+    ``drain_timeout`` секунд. ``jobs`` — задачи, запущенные не из обновлений
+    (например, продолженные после перезапуска); их ждут вместе с обновлениями.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str, path: str = "/webhook",
+                 max_concurrency: int = 256, accept_timeout: float = 5, drain_timeout: float = 60,
+                 jobs: set = None):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.path = path
+        self.accept_timeout = accept_timeout
+        self.drain_timeout = drain_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+        self._jobs = jobs if jobs is not None else set()
+        self._closing = False
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        # Для балансировщика: при остановке отвечает 503, и трафик уходит на другие копии
+        app.router.add_get("/healthz", self.health)
+        return app
+
+    async def health(self, request):
+        return web.Response(status=503 if self._closing else 200, text="draining" if self._closing else "ok")
+
+    async def handle(self, request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if self._closing:
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            return web.Response(status=400)
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.accept_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Webhook: все %d мест заняты, update %s отклонён", len(self._tasks), update.update_id)
+            return web.Response(status=503)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return web.Response()
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        self._slots.release()
+
+    async def _process(self, update: Update):
+        try:
+            response = await self.dp.feed_update(self.bot, update)
+            if isinstance(response, TelegramMethod):
+                await self.bot(response)
+        except Exception as e:
+            logger.exception("Webhook: ошибка обработки update %s: %s", update.update_id, e)
+
+    async def drain(self):
+        self._closing = True
+        tasks = self._tasks | self._jobs
+        if not tasks:
+            return
+        logger.info("Webhook: жду завершения %d обновлений и загрузок", len(tasks))
+        done, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Webhook: прервано обновлений после %d с: %d", self.drain_timeout, len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def serve(self, host: str, port: int, url: str = None, allowed_updates=None, max_connections: int = 40):
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Webhook слушает %s:%s%s", host, port, self.path)
+
+        if url:
+            # Без адреса webhook считается уже настроенным (например, одним из экземпляров за балансировщиком)
+            await self.bot.set_webhook(url.rstrip("/") + self.path, secret_token=self.secret,
+                                       allowed_updates=allowed_updates, max_connections=max_connections)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        try:
+            await stop.wait()
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.remove_signal_handler(sig)
+                except (NotImplementedError, RuntimeError):
+                    pass
+            await self.drain()
+            await runner.cleanup()
@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Меняются от вызова к вызову и не требуют нового экземпляра
+PER_CALL_OPTS = {'outtmpl', 'user_agent', 'progress_hooks', 'format'}
+
+
+def _import_yt_dlp():
+    # yt-dlp нужен только при первой ссылке, поэтому не замедляет старт бота
+    import yt_dlp
+    return yt_dlp
+
+
+class _Pooled:
+    def __init__(self, ydl):
+        self.ydl = ydl
+        self.hook = None
+        # Хук регистрируется один раз, а получатель прогресса меняется на каждый вызов
+        ydl.add_progress_hook(self._dispatch)
+
+    def _dispatch(self, d):
+        hook = self.hook
+        if hook is not None:
+            hook(d)
+
+    def prepare(self, opts, progress_hook):
+        params = self.ydl.params
+        params['outtmpl']['default'] = opts['outtmpl']
+        user_agent = opts.get('user_agent')
+        if user_agent:
+            # Параметр user_agent читает только CLI, библиотека берёт заголовок из http_headers
+            params['http_headers']['User-Agent'] = user_agent
+        fmt = opts.get('format')
+        if fmt and params.get('format') != fmt:
+            # Строка формата разбирается при создании YoutubeDL, поэтому селектор пересобираем сами
+            params['format'] = fmt
+            self.ydl.format_selector = self.ydl.build_format_selector(fmt)
+        self.hook = progress_hook
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logger.debug("YoutubeDL close failed: %s", e)
+
+
+class YDLPool:
+    """Готовые экземпляры YoutubeDL, сгруппированные по набору настроек.
+
+    Создание YoutubeDL заново инициализирует экстракторы, cookies и HTTP-клиент,
+    поэтому экземпляры переиспользуются. Один экземпляр одновременно отдан
+    только одному потоку; на вызов меняются лишь ``PER_CALL_OPTS``.
+    """
+
+    def __init__(self, max_idle: int = 4):
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(opts) -> str:
+        static = {k: v for k, v in opts.items() if k not in PER_CALL_OPTS}
+        cookiefile = static.get('cookiefile')
+        if cookiefile:
+            # Новый cookies.txt подхватывается новыми экземплярами, старые просто уходят
+            try:
+                static['_cookies_mtime'] = os.path.getmtime(cookiefile)
+            except OSError:
+                pass
+        return json.dumps(static, sort_keys=True, default=str)
+
+    def _create(self, opts) -> _Pooled:
+        yt_dlp = _import_yt_dlp()
+        params = {k: v for k, v in opts.items() if k != 'progress_hooks'}
+        with self._lock:
+            self.created += 1
+        return _Pooled(yt_dlp.YoutubeDL(params))
+
+    def _put(self, key, entry) -> bool:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(entry)
+                return True
+        return False
+
+    @contextmanager
+    def lease(self, opts: dict, progress_hook=None):
+        """Выдаёт YoutubeDL с настройками ``opts`` на время блока ``with``."""
+        key = self._key(opts)
+        with self._lock:
+            idle = self._idle.get(key)
+            entry = idle.pop() if idle else None
+            if entry is not None:
+                self.reused += 1
+        if entry is None:
+            entry = self._create(opts)
+        entry.prepare(opts, progress_hook)
+        try:
+            yield entry.ydl
+        except BaseException as e:
+            # Ошибки извлечения — обычное дело, экземпляр после них исправен; отмену не доверяем
+            if not isinstance(e, Exception):
+                entry.close()
+                raise
+            entry.hook = None
+            if not self._put(key, entry):
+                entry.close()
+            raise
+        entry.hook = None
+        if not self._put(key, entry):
+            entry.close()
+
+    def warm(self, opts_list):
+        """Заранее создаёт по экземпляру на каждый набор настроек (вызывать в потоке)."""
+        for opts in opts_list:
+            key = self._key(opts)
+            with self._lock:
+                if self._idle.get(key):
+                    continue
+            if not self._put(key, self._create(opts)):
+                break
+
+    def close(self):
+        with self._lock:
+            entries = [e for idle in self._idle.values() for e in idle]
+            self._idle.clear()
+        for entry in entries:
+            entry.close()
@@ -0,0 +1,73 @@
+# --- ЛОКАЛИЗАЦИЯ ---
+STRINGS = {
+    "ru": {
+        "choose_lang": "Выберите язык / Choose language:",
+        "welcome": "Привет, {name}! 👋\n\nЯ помогу тебе скачать видео из <b>TikTok, YouTube, Instagram или VK</b>.\nПросто пришли мне ссылку!",
+        "sub_req": "⚠️ <b>Для использования бота нужно подписаться на наш канал!</b>",
+        "btn_sub": "✅ Подписаться",
+        "btn_check_sub": "🔄 Проверить подписку",
+        "btn_channel": "📢 Наш канал",
+        "btn_help": "🆘 Помощь",
+        "btn_video": "🎬 Видео (Max)",
+        "btn_audio": "🎵 Аудио ({fmt})",
+        "btn_audio_fmt": "🎧 Формат аудио: {fmt}",
+        "audio_fmt_title": "🎧 Выберите формат аудио.\n\nM4A и Opus отдаются без перекодировки и приходят быстрее, MP3 подходит для любого плеера.",
+        "btn_cancel": "❌ Отмена",
+        "btn_settings": "⚙️ Настройки",
+        "btn_change_lang": "🌐 Сменить язык",
+        "btn_back": "⬅️ Назад",
+        "link_ok": "Выберите качество видео:",
+        "link_ok_general": "Ссылка принята! Что скачиваем?",
+        "too_big": "⚠️ Видео слишком большое для Telegram, можно скачать только аудио.",
+        "batch_found": "📦 Ссылок в сообщении: {n}. Пришлю всё одним альбомом — что скачиваем?",
+        "batch_truncated": "\n\nЗа раз можно не больше {max}, возьму первые {max}.",
+        "batch_progress": "📦 Готово {done} из {total}",
+        "batch_partial": "⚠️ Не удалось скачать {failed} из {total}, остальное отправлено.",
+        "step_1": "🔍 Анализирую ссылку...",
+        "step_2": "📥 Загружаю: {p}",
+        "step_3": "⚙️ Обработка файла: {p}",
+        "step_4": "📤 Отправка в Telegram: {p}",
+        "queue": "⏳ Вы в очереди: {pos}",
+        "busy": "😔 Сервер сейчас перегружен, попробуйте через несколько минут.",
+        "host_busy": "😔 Сайт сейчас ограничивает загрузки, попробуйте через несколько минут.",
+        "queued": "⏳ Задача в очереди, скоро начнём...",
+        "retry": "🔁 Не получилось, пробуем ещё раз...",
+        "resumed": "🔄 Бот перезапускался, продолжаю загрузку...",
+        "promo": "\n\n🚀 <b>Скачано через: @youtodownloadbot</b>"
+    },
+    "en": {
+        "choose_lang": "Choose language / Выберите язык:",
+        "welcome": "Hello, {name}! 👋\n\nI can download from <b>TikTok, YouTube, Instagram or VK</b>.",
+        "sub_req": "⚠️ <b>Please subscribe to our channel!</b>",
+        "btn_sub": "✅ Subscribe",
+        "btn_check_sub": "🔄 Check",
+        "btn_channel": "📢 Channel",
+        "btn_help": "🆘 Help",
+        "btn_video": "🎬 Video (Max)",
+        "btn_audio": "🎵 Audio ({fmt})",
+        "btn_audio_fmt": "🎧 Audio format: {fmt}",
+        "audio_fmt_title": "🎧 Choose the audio format.\n\nM4A and Opus are sent without re-encoding and arrive faster, MP3 plays everywhere.",
+        "btn_cancel": "❌ Cancel",
+        "btn_settings": "⚙️ Settings",
+        "btn_change_lang": "🌐 Language",
+        "btn_back": "⬅️ Back",
+        "link_ok": "Choose video quality:",
+        "link_ok_general": "Link accepted! What to download?",
+        "too_big": "⚠️ The video is too large for Telegram, only audio is available.",
+        "batch_found": "📦 Links in your message: {n}. I'll send them as one album — what to download?",
+        "batch_truncated": "\n\nUp to {max} at a time, taking the first {max}.",
+        "batch_progress": "📦 Done {done} of {total}",
+        "batch_partial": "⚠️ Failed to download {failed} of {total}, the rest has been sent.",
+        "step_1": "🔍 Analyzing...",
+        "step_2": "📥 Downloading: {p}",
+        "step_3": "⚙️ Processing: {p}",
+        "step_4": "📤 Sending: {p}",
+        "queue": "⏳ Queue position: {pos}",
+        "busy": "😔 The server is busy right now, please try again in a few minutes.",
+        "host_busy": "😔 The site is limiting downloads right now, please try again in a few minutes.",
+        "queued": "⏳ Your job is queued, starting soon...",
+        "retry": "🔁 Something went wrong, trying again...",
+        "resumed": "🔄 The bot restarted, resuming your download...",
+        "promo": "\n\n🚀 <b>Via: @youtodownloadbot</b>"
+    }
+}
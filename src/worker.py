@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+import signal
+from aiogram import Bot
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+
+from src.config import conf
+from src.db import init_db, close_db
+from src.services.downloader import VideoDownloader
+from src.services.hosts import HostUnavailable
+from src.services.storage import StorageManager, reap_siblings, STAGING_SUBDIR
+from src.services.scheduler import JobScheduler
+from src.services.uploader import ParallelUploader
+from src.services.progress import EditScheduler
+from src.services.pipeline import Job, Pipeline, StatusMessage, document_result
+from src.services.jobqueue import make_store
+from src.services.thumbnails import ThumbnailCache
+from src.services.http import close_session
+from src.services.metrics import Gauge, start_metrics_server
+from src.services.startup import STARTUP
+
+logger = logging.getLogger(__name__)
+
+IDLE_POLL = 1
+
+
+class Worker:
+    """Берёт задачи из очереди и доводит их до отправки файла пользователю."""
+
+    def __init__(self, store, pipeline: Pipeline, bot: Bot, worker_id: str, concurrency: int,
+                 lease: int, retry_delay: int):
+        self.store = store
+        self.pipeline = pipeline
+        self.bot = bot
+        self.worker_id = worker_id
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        self._stopping = asyncio.Event()
+
+    @property
+    def active(self) -> int:
+        return len(self._tasks)
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self, drain_timeout: float):
+        logger.info("Воркер %s ждёт задачи", self.worker_id)
+        while not self._stopping.is_set():
+            await self._slots.acquire()
+            try:
+                claimed = await self.store.claim(self.worker_id, self.lease)
+            except Exception as e:
+                logger.warning("Очередь недоступна: %s", e)
+                claimed = None
+            if claimed is None:
+                self._slots.release()
+                await self._idle()
+                continue
+            task = asyncio.create_task(self._handle(claimed))
+            self._tasks.add(task)
+            task.add_done_callback(self._done)
+
+        if self._tasks:
+            # Незаконченные задачи не теряются: после истечения аренды их заберёт другой воркер
+            logger.info("Воркер %s: жду завершения %d задач", self.worker_id, len(self._tasks))
+            done, pending = await asyncio.wait(set(self._tasks), timeout=drain_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _idle(self):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), IDLE_POLL)
+        except asyncio.TimeoutError:
+            pass
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        self._slots.release()
+
+    async def _handle(self, claimed):
+        job = Job.from_dict(claimed.payload)
+        status = StatusMessage(self.bot, job.chat_id, job.status_message_id)
+        # Пачка ссылок идёт одной задачей, чтобы уйти одним альбомом
+        work = asyncio.create_task(self.pipeline.run_batch(job, status) if job.items else self.pipeline.run(job, status))
+        heartbeat = asyncio.create_task(self._heartbeat(claimed.id, work))
+        try:
+            outcome = await work
+        except asyncio.CancelledError:
+            if not (heartbeat.done() and not heartbeat.cancelled() and heartbeat.result()):
+                raise
+            # Аренду перехватил другой воркер — задача уже не наша
+            logger.warning("Задача %s отменена: аренда потеряна", claimed.id)
+            return
+        except Exception as e:
+            logger.warning("Задача %s (попытка %d) не удалась: %s", claimed.id, claimed.attempts, e)
+            # Платформа на паузе — повторять раньше её окончания бессмысленно
+            delay = max(self.retry_delay, e.retry_in) if isinstance(e, HostUnavailable) else self.retry_delay
+            if await self.store.fail(claimed.id, self.worker_id, f"{type(e).__name__}: {e}"[:500], delay):
+                await self.pipeline.show_status(status, job.lang, "retry")
+            else:
+                await self.pipeline.show_error(status, job.lang, e)
+            return
+        finally:
+            heartbeat.cancel()
+            if not work.done():
+                work.cancel()
+        if job.items:
+            result = {"items": outcome}
+        else:
+            sent, title = outcome
+            result = document_result(sent, title)
+        await self.store.complete(claimed.id, self.worker_id, result)
+
+    async def _heartbeat(self, job_id, work):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                alive = await self.store.extend(job_id, self.worker_id, self.lease)
+            except Exception as e:
+                # Очередь могла ненадолго пропасть — попробуем на следующем такте
+                logger.warning("Не удалось продлить аренду задачи %s: %s", job_id, e)
+                continue
+            if not alive:
+                work.cancel()
+                return True
+
+
+async def start_worker():
+    store = make_store(conf)
+    if store is None:
+        raise ValueError("Для запуска воркера укажите JOB_QUEUE=sqlite или JOB_QUEUE=redis в .env файле!")
+    init_db()
+
+    worker_id = conf.worker_id
+    # У каждого воркера свой каталог, чтобы очистка не задевала файлы соседей
+    storage = StorageManager(os.path.join(conf.download_path, worker_id), conf.storage_quota, conf.storage_min_free,
+                             staging_root=conf.staging_path and os.path.join(conf.staging_path, worker_id),
+                             staging_quota=conf.staging_quota, staging_max_job=conf.staging_max_job,
+                             wait_timeout=conf.storage_wait, orphan_age=conf.orphan_age)
+    # Недокачанные файлы не трогаем: вернувшуюся задачу этот воркер докачает с того же места,
+    # если перезапущен с тем же WORKER_ID
+    storage.reap(conf.orphan_age)
+    # Каталоги воркеров, запускавшихся под другим id, иначе копились бы вечно
+    reap_siblings(conf.download_path, worker_id, conf.orphan_age)
+    if conf.staging_path:
+        reap_siblings(conf.staging_path, worker_id, conf.orphan_age, subdir=STAGING_SUBDIR)
+    reap_task = asyncio.create_task(storage.reap_loop(conf.reap_interval))
+
+    scheduler = JobScheduler(conf.network_limit, conf.transcode_limit, conf.upload_limit)
+    downloader = VideoDownloader(scheduler, storage)
+    # Сессия в памяти: файл сессии нельзя делить между процессами
+    client = TelegramClient(StringSession(), conf.api_id, conf.api_hash)
+    uploader = ParallelUploader(client, workers=conf.upload_workers)
+    edits = EditScheduler(per_chat_interval=conf.edit_interval, global_rate=conf.edit_rate)
+    bot = Bot(token=conf.bot_token)
+    thumbnails = ThumbnailCache(conf.thumb_path, conf.thumb_cache_max)
+    pipeline = Pipeline(downloader, uploader, client, scheduler, edits, conf.progress_interval, thumbnails)
+    worker = Worker(store, pipeline, bot, worker_id, conf.worker_concurrency, conf.job_lease, conf.job_retry_delay)
+
+    metrics_runner = None
+    if conf.metrics_port:
+        Gauge("bot_inflight_jobs", "Download jobs in progress", func=lambda: downloader.inflight)
+        Gauge("bot_storage_bytes", "Space reserved for temp files", ("root",), func=storage.usage)
+        Gauge("bot_worker_jobs", "Queue jobs held by this worker", func=lambda: worker.active)
+        Gauge("bot_host_limit", "Current concurrency limit per platform", ("platform",),
+              func=downloader.hosts.limits_snapshot)
+        Gauge("bot_host_paused", "Platforms paused after repeated rate limiting", ("platform",),
+              func=downloader.hosts.open_snapshot)
+        metrics_runner = await start_metrics_server(conf.metrics_host, conf.metrics_port)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    STARTUP.mark("init")
+    print(f"🚀 Запуск воркера {worker_id}...")
+    # Воркер только качает, поэтому задачи берёт уже с прогретым yt-dlp
+    await asyncio.gather(client.start(bot_token=conf.bot_token), downloader.warm())
+    STARTUP.mark("telethon + ytdl")
+    STARTUP.report()
+    try:
+        await worker.run(conf.drain_timeout)
+    finally:
+        print("🛑 Остановка воркера...")
+        await client.disconnect()
+        downloader.close()
+        await close_session()
+        reap_task.cancel()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await store.close()
+        close_db()
+        await bot.session.close()